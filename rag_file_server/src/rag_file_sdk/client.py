@@ -0,0 +1,111 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import requests
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ClientOptions(BaseModel):
+    timeout: float = 60  # 单个请求的超时（秒）
+    retries: int = 3  # 连接失败的重试次数，GET 请求还重试读取失败和 502/503/504
+    pool_size: int = 32  # 到文件服务的最大连接数
+
+
+_options = ClientOptions()
+_sessions: dict[int, requests.Session] = {}  # pid -> session，fork 出的进程不能共用父进程的连接
+_stream_clients: dict[int, httpx.Client] = {}  # pid -> client
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def configure(timeout: float | None = None, retries: int | None = None, pool_size: int | None = None):
+    """Set the options of the clients created afterwards, the clients already created are dropped."""
+    global _options
+    _options = _options.model_copy(update={key: value for key, value in
+                                           dict(timeout=timeout, retries=retries, pool_size=pool_size).items()
+                                           if value is not None})
+    with _lock:
+        _sessions.clear()
+        _stream_clients.clear()
+        _async_clients.clear()
+
+
+class _Session(requests.Session):
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def get_session() -> requests.Session:
+    """Keep-alive session shared by the sync clients of this process."""
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _lock:
+            if (session := _sessions.get(pid)) is None:
+                session = _sessions[pid] = create_session()
+    return session
+
+
+def create_session(options: ClientOptions | None = None) -> requests.Session:
+    options = options or _options
+    retry = Retry(total=options.retries,
+                  connect=options.retries,
+                  read=options.retries,
+                  status=options.retries,
+                  allowed_methods=frozenset({'GET', 'HEAD'}),
+                  status_forcelist=(502, 503, 504),
+                  backoff_factor=0.2,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=options.pool_size, pool_maxsize=options.pool_size, max_retries=retry)
+    session = _Session(options.timeout)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_stream_client() -> httpx.Client:
+    """
+    Keep-alive client of this process for uploads, requests reads the files of a multipart body into memory,
+    httpx sends them in chunks.
+    """
+    pid = os.getpid()
+    client = _stream_clients.get(pid)
+    if client is None:
+        with _lock:
+            if (client := _stream_clients.get(pid)) is None:
+                client = _stream_clients[pid] = create_stream_client()
+    return client
+
+
+def create_stream_client(options: ClientOptions | None = None) -> httpx.Client:
+    # httpx 只重试连接失败
+    options = options or _options
+    limits = httpx.Limits(max_connections=options.pool_size, max_keepalive_connections=options.pool_size)
+    return httpx.Client(timeout=options.timeout, transport=httpx.HTTPTransport(retries=options.retries, limits=limits))
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Async client shared by the async clients of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _async_clients[loop] = create_async_client()
+    return client
+
+
+def create_async_client(options: ClientOptions | None = None) -> httpx.AsyncClient:
+    # httpx 只重试连接失败
+    options = options or _options
+    limits = httpx.Limits(max_connections=options.pool_size, max_keepalive_connections=options.pool_size)
+    return httpx.AsyncClient(timeout=options.timeout,
+                             transport=httpx.AsyncHTTPTransport(retries=options.retries, limits=limits))
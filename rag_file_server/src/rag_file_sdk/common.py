@@ -1,11 +1,25 @@
+import io
+from typing import BinaryIO
+
+import httpx
 from requests import Response
 from rag_file_server.error_code import raise_exception
 
 
-def check_response(response: Response):
-    if not response.ok:
+def check_response(response: Response | httpx.Response):
+    if response.status_code >= 400:
         try:
             desc = response.json().get('detail')
         except Exception as e:
             desc = response.text
         raise_exception(response.status_code, desc)
+
+
+def drop_none(params: dict) -> dict:
+    # requests 会忽略值为 None 的参数，httpx 会把它作为空字符串发送
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def upload_file(content: bytes | BinaryIO) -> BinaryIO:
+    # 文件对象按块上传，不整个读入内存
+    return io.BytesIO(content) if isinstance(content, bytes) else content
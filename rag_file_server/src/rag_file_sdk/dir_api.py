@@ -1,20 +1,43 @@
-import io
 import uuid
-from typing import Literal
+from typing import Literal, BinaryIO
 
-import requests
-from pydantic import BaseModel
+import httpx
+from pydantic import BaseModel, ConfigDict
 
-from rag_file_sdk.common import check_response
-from rag_file_server.dir.model import FileNode, FileType, FileNodeVo, UploadResponseOfDir, FileStatus, CeleryTaskType
+from rag_file_sdk.client import get_session, get_async_client, get_stream_client
+from rag_file_sdk.common import check_response, drop_none, upload_file
+from rag_file_server.dir.model import FileNode, FileType, FileNodeVo, UploadResponseOfDir, FileStatus, CeleryTaskType, \
+    FilePatch
 
 
 def get_bucket_name(endpoint: str, file_id: str) -> str:
-    response = requests.get(endpoint + "/api/dir/bucket_name", params={"file_id": file_id})
+    response = get_session().get(endpoint + "/api/dir/bucket_name", params={"file_id": file_id})
     check_response(response)
     return response.json()
 
 
+def dump_patches(patches: list[FilePatch]) -> list[dict]:
+    # 只发送设置了的字段，未设置的字段不更新
+    return [patch.model_dump(mode='json', exclude_unset=True) for patch in patches]
+
+
+class FilePatchBatch:
+    """Collect the updates of files to send them with one patch_files, the updates of a file are merged."""
+
+    def __init__(self):
+        self.fields: dict[str, dict] = {}  # file_node_id -> 要更新的字段
+
+    def __len__(self):
+        return len(self.fields)
+
+    def add(self, id_list: list[str] | str, **fields):
+        for file_id in DirMgr.make_file_node_ids(id_list):
+            self.fields.setdefault(str(file_id), {}).update(fields)
+
+    def patches(self) -> list[FilePatch]:
+        return [FilePatch(id=file_id, **fields) for file_id, fields in self.fields.items()]
+
+
 class DirMgr(BaseModel):
     endpoint: str
 
@@ -26,19 +49,19 @@ class DirMgr(BaseModel):
         return self.endpoint + '/api/dir'
 
     def get_top_dir_node(self, file_id: str) -> FileNode:
-        response = requests.get(f"{self.url_prefix}/top_dir_node", params={"file_id": file_id})
+        response = get_session().get(f"{self.url_prefix}/top_dir_node", params={"file_id": file_id})
         check_response(response)
         return FileNode.model_validate(response.json())
 
     def add_dir(self, name: str, parent_id: str | None = None) -> FileNode:
-        response = requests.put(f"{self.url_prefix}/dir",
-                                json={"parent_id": parent_id, "name": name})
+        response = get_session().put(f"{self.url_prefix}/dir",
+                                     json={"parent_id": parent_id, "name": name})
         check_response(response)
         return FileNode(**response.json())
 
     def list_files(self, parent_id: str | None = None,
                    file_type: FileType | None = None) -> list[FileNodeVo]:
-        response = requests.get(f"{self.url_prefix}/list", params={"parent_id": parent_id, "file_type": file_type})
+        response = get_session().get(f"{self.url_prefix}/list", params={"parent_id": parent_id, "file_type": file_type})
         check_response(response)
         return [FileNodeVo(**item) for item in response.json()]
 
@@ -47,99 +70,229 @@ class DirMgr(BaseModel):
         return id_list if isinstance(id_list, list) else [id_list]
 
     def get_files_by_ids(self, file_node_ids: list[str]):
-        response = requests.get(f"{self.url_prefix}/files_by_ids", params={"file_node_ids": file_node_ids})
+        response = get_session().get(f"{self.url_prefix}/files_by_ids", params={"file_node_ids": file_node_ids})
         check_response(response)
         return [FileNode.model_validate(item) for item in response.json()]
 
     def update_file_name(self, file_id: str, name: str) -> None:
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={"id_list": [file_id], "name": name})
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={"id_list": [file_id], "name": name})
         check_response(response)
 
     def update_files_parent(self, id_list: list[str], parent_id: str | None):
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={"id_list": id_list,
-                                       "parent_id": parent_id})
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={"id_list": id_list,
+                                            "parent_id": parent_id})
         check_response(response)
 
     def update_files_status(self, id_list: list[str], status: FileStatus):
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={"id_list": id_list,
-                                       "status": status})
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={"id_list": id_list,
+                                            "status": status})
         check_response(response)
 
     def update_parse_percent(self, id_list: list[str] | str, parse_percent: float) -> None:
         id_list = self.make_file_node_ids(id_list)
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={"id_list": id_list, "parse_percent": parse_percent})
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={"id_list": id_list, "parse_percent": parse_percent})
         check_response(response)
 
     def update_to_vector_store_percent(self,
                                        id_list: list[str] | str,
                                        to_vector_store_percent: float) -> None:
         id_list = self.make_file_node_ids(id_list)
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={"id_list": id_list, "to_vector_store_percent": to_vector_store_percent})
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={"id_list": id_list, "to_vector_store_percent": to_vector_store_percent})
         check_response(response)
 
     def update_celery_task(self, id_list: list[str] | str,
                            celery_task_id: str | None,
                            celery_task_type: CeleryTaskType | None) -> None:
         id_list = self.make_file_node_ids(id_list)
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={
-                                     "id_list": id_list,
-                                     "celery_task_id": celery_task_id,
-                                     "celery_task_type": celery_task_type
-                                 })
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={
+                                          "id_list": id_list,
+                                          "celery_task_id": celery_task_id,
+                                          "celery_task_type": celery_task_type
+                                      })
         check_response(response)
 
     def update_files(self, id_list: list[str], data: dict):
-        response = requests.post(f"{self.url_prefix}/files",
-                                 json={"id_list": id_list, **data})
+        response = get_session().post(f"{self.url_prefix}/files",
+                                      json={"id_list": id_list, **data})
+        check_response(response)
+
+    def patch_files(self, patches: list[FilePatch]):
+        """Update different fields and values of each file in one request and one transaction."""
+        if not patches:
+            return
+        response = get_session().post(f"{self.url_prefix}/files/patch", json=dump_patches(patches))
         check_response(response)
 
     def delete_files(self, file_id_list: list[str]):
         file_ids = [str(file_id) for file_id in file_id_list]
-        response = requests.delete(f"{self.url_prefix}/files", json=file_ids)
+        response = get_session().delete(f"{self.url_prefix}/files", json=file_ids)
         check_response(response)
 
     def get_tree(self, root_id: str | None = None, file_type: FileType | None = None) -> FileNodeVo:
-        response = requests.get(f"{self.url_prefix}/tree", params={"root_id": root_id, "file_type": file_type})
+        response = get_session().get(f"{self.url_prefix}/tree", params={"root_id": root_id, "file_type": file_type})
         check_response(response)
         return FileNodeVo(**response.json())
 
     def get_parents(self, file_id: str) -> list[FileNode]:
-        response = requests.get(f"{self.url_prefix}/parents", params={"file_id": file_id})
+        response = get_session().get(f"{self.url_prefix}/parents", params={"file_id": file_id})
         check_response(response)
         return [FileNode(**item) for item in response.json()]
 
     def get_by_name(self, name: str, parent_id: str | None = None):
-        response = requests.get(f"{self.url_prefix}/by_name", params={"name": name, "parent_id": parent_id})
+        response = get_session().get(f"{self.url_prefix}/by_name", params={"name": name, "parent_id": parent_id})
         check_response(response)
         data = response.json()
         return FileNode(**data) if data else None
 
     def add_files(self,
                   file_name_list: list[str],
-                  content_list: list[bytes],
+                  content_list: list[bytes | BinaryIO],
                   parent_id: str,
                   action: Literal['override', 'ignore'] = 'ignore') -> UploadResponseOfDir:
-        files = [("files", (file_name, io.BytesIO(content))) for (file_name, content) in
+        files = [("files", (file_name, upload_file(content))) for (file_name, content) in
                  zip(file_name_list, content_list)]
-        response = requests.put(f"{self.url_prefix}/files",
-                                data={"parent_id": parent_id, "action": action},
-                                files=files)
+        response = get_stream_client().put(f"{self.url_prefix}/files",
+                                           data={"parent_id": parent_id, "action": action},
+                                           files=files)
         check_response(response)
         return UploadResponseOfDir(**response.json())
 
     def on_celery_task_failed(self, celery_task_id: str) -> list[FileNode]:
-        response = requests.post(f"{self.url_prefix}/celery_task_failed",
-                                 json={"task_id": celery_task_id})
+        response = get_session().post(f"{self.url_prefix}/celery_task_failed",
+                                      json={"task_id": celery_task_id})
         check_response(response)
         return [FileNode.validate(item) for item in response.json()]
 
     def get_total_files(self, parent_id: str) -> int:
-        response = requests.get(f"{self.url_prefix}/total_files", params={"parent_id": parent_id})
+        response = get_session().get(f"{self.url_prefix}/total_files", params={"parent_id": parent_id})
+        check_response(response)
+        return int(response.json())
+
+
+class AsyncDirMgr(BaseModel):
+    """Async client of the dir api with the same methods as DirMgr, all requests share the connection pool of client."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    endpoint: str
+    client: httpx.AsyncClient
+
+    def __init__(self, endpoint: str, client: httpx.AsyncClient | None = None):
+        super().__init__(endpoint=endpoint, client=client or get_async_client())
+
+    @property
+    def url_prefix(self):
+        return self.endpoint + '/api/dir'
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get_top_dir_node(self, file_id: str) -> FileNode:
+        response = await self.client.get(f"{self.url_prefix}/top_dir_node", params={"file_id": file_id})
+        check_response(response)
+        return FileNode.model_validate(response.json())
+
+    async def add_dir(self, name: str, parent_id: str | None = None) -> FileNode:
+        response = await self.client.put(f"{self.url_prefix}/dir",
+                                         json={"parent_id": parent_id, "name": name})
+        check_response(response)
+        return FileNode(**response.json())
+
+    async def list_files(self, parent_id: str | None = None,
+                         file_type: FileType | None = None) -> list[FileNodeVo]:
+        response = await self.client.get(f"{self.url_prefix}/list",
+                                         params=drop_none({"parent_id": parent_id, "file_type": file_type}))
+        check_response(response)
+        return [FileNodeVo(**item) for item in response.json()]
+
+    async def get_files_by_ids(self, file_node_ids: list[str]) -> list[FileNode]:
+        response = await self.client.get(f"{self.url_prefix}/files_by_ids", params={"file_node_ids": file_node_ids})
+        check_response(response)
+        return [FileNode.model_validate(item) for item in response.json()]
+
+    async def update_file_name(self, file_id: str, name: str) -> None:
+        await self.update_files([file_id], {"name": name})
+
+    async def update_files_parent(self, id_list: list[str], parent_id: str | None):
+        await self.update_files(id_list, {"parent_id": parent_id})
+
+    async def update_files_status(self, id_list: list[str], status: FileStatus):
+        await self.update_files(id_list, {"status": status})
+
+    async def update_parse_percent(self, id_list: list[str] | str, parse_percent: float) -> None:
+        await self.update_files(DirMgr.make_file_node_ids(id_list), {"parse_percent": parse_percent})
+
+    async def update_to_vector_store_percent(self,
+                                             id_list: list[str] | str,
+                                             to_vector_store_percent: float) -> None:
+        await self.update_files(DirMgr.make_file_node_ids(id_list),
+                                {"to_vector_store_percent": to_vector_store_percent})
+
+    async def update_celery_task(self, id_list: list[str] | str,
+                                 celery_task_id: str | None,
+                                 celery_task_type: CeleryTaskType | None) -> None:
+        await self.update_files(DirMgr.make_file_node_ids(id_list),
+                                {"celery_task_id": celery_task_id, "celery_task_type": celery_task_type})
+
+    async def update_files(self, id_list: list[str], data: dict):
+        response = await self.client.post(f"{self.url_prefix}/files", json={"id_list": id_list, **data})
+        check_response(response)
+
+    async def patch_files(self, patches: list[FilePatch]):
+        if not patches:
+            return
+        response = await self.client.post(f"{self.url_prefix}/files/patch", json=dump_patches(patches))
+        check_response(response)
+
+    async def delete_files(self, file_id_list: list[str]):
+        file_ids = [str(file_id) for file_id in file_id_list]
+        # httpx 的 delete 不能带请求体
+        response = await self.client.request("DELETE", f"{self.url_prefix}/files", json=file_ids)
+        check_response(response)
+
+    async def get_tree(self, root_id: str | None = None, file_type: FileType | None = None) -> FileNodeVo:
+        response = await self.client.get(f"{self.url_prefix}/tree",
+                                         params=drop_none({"root_id": root_id, "file_type": file_type}))
+        check_response(response)
+        return FileNodeVo(**response.json())
+
+    async def get_parents(self, file_id: str) -> list[FileNode]:
+        response = await self.client.get(f"{self.url_prefix}/parents", params={"file_id": file_id})
+        check_response(response)
+        return [FileNode(**item) for item in response.json()]
+
+    async def get_by_name(self, name: str, parent_id: str | None = None):
+        response = await self.client.get(f"{self.url_prefix}/by_name",
+                                         params=drop_none({"name": name, "parent_id": parent_id}))
+        check_response(response)
+        data = response.json()
+        return FileNode(**data) if data else None
+
+    async def add_files(self,
+                        file_name_list: list[str],
+                        content_list: list[bytes | BinaryIO],
+                        parent_id: str,
+                        action: Literal['override', 'ignore'] = 'ignore') -> UploadResponseOfDir:
+        files = [("files", (file_name, upload_file(content))) for (file_name, content) in
+                 zip(file_name_list, content_list)]
+        response = await self.client.put(f"{self.url_prefix}/files",
+                                         data={"parent_id": parent_id, "action": action},
+                                         files=files)
+        check_response(response)
+        return UploadResponseOfDir(**response.json())
+
+    async def on_celery_task_failed(self, celery_task_id: str) -> list[FileNode]:
+        response = await self.client.post(f"{self.url_prefix}/celery_task_failed",
+                                          json={"task_id": celery_task_id})
+        check_response(response)
+        return [FileNode.validate(item) for item in response.json()]
+
+    async def get_total_files(self, parent_id: str) -> int:
+        response = await self.client.get(f"{self.url_prefix}/total_files", params={"parent_id": parent_id})
         check_response(response)
         return int(response.json())
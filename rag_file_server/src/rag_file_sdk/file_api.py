@@ -1,10 +1,21 @@
-import io
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
 
+import httpx
 import requests
-from pydantic import BaseModel
-from rag_file_server.file.model import MetaData, UploadResponse
-from rag_file_sdk.common import check_response
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict
+from rag_file_server.error_code import ErrorCode
+from rag_file_server.file.model import MetaData, UploadResponse, UploadStatus, UploadPart, UploadedFile
+from rag_file_sdk.client import get_session, get_async_client, get_stream_client
+from rag_file_sdk.common import check_response, drop_none, upload_file
+
+
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_WORKERS = 4
 
 
 class Bucket(BaseModel):
@@ -19,42 +30,62 @@ class Bucket(BaseModel):
         super().__init__(endpoint=endpoint, bucket_name=bucket_name)
 
     def create_bucket(self):
-        response = requests.put(f"{self.url_prefix}/bucket/{self.bucket_name}")
+        response = get_session().put(f"{self.url_prefix}/bucket/{self.bucket_name}")
         check_response(response)
 
     def delete_bucket(self):
-        response = requests.delete(f"{self.url_prefix}/bucket/{self.bucket_name}")
+        response = get_session().delete(f"{self.url_prefix}/bucket/{self.bucket_name}")
         check_response(response)
         self.bucket_name = None
 
     def get_file(self, file_name: str) -> bytes:
-        response = requests.get(f"{self.url_prefix}/file/{self.bucket_name}/{file_name}")
+        response = get_session().get(f"{self.url_prefix}/file/{self.bucket_name}/{file_name}")
         check_response(response)
         return response.content
 
     def get_files(self, file_names: list[str]) -> bytes:
-        response = requests.post(f"{self.url_prefix}/get_files/{self.bucket_name}", json=file_names)
+        response = get_session().post(f"{self.url_prefix}/get_files/{self.bucket_name}", json=file_names)
         check_response(response)
         return response.content  # .zip data for dir or multiple files.
 
-    def set_file(self, file_name: str, content: bytes, override: bool = False) -> None:
-        response = requests.put(f"{self.url_prefix}/file/{self.bucket_name}",
-                                data={"override": override},
-                                files={"file": (file_name, io.BytesIO(content))})
+    def set_file(self, file_name: str, content: bytes | BinaryIO, override: bool = False) -> None:
+        response = get_stream_client().put(f"{self.url_prefix}/file/{self.bucket_name}",
+                                           data={"override": override},
+                                           files={"file": (file_name, upload_file(content))})
         check_response(response)
 
-    def set_files(self, file_name_list: list[str], content_list: list[bytes], override: bool = False) -> UploadResponse:
+    def set_files(self, file_name_list: list[str], content_list: list[bytes | BinaryIO],
+                  override: bool = False) -> UploadResponse:
         assert len(file_name_list) == len(content_list)
-        files = [("files", (file_name, io.BytesIO(content))) for (file_name, content) in
+        files = [("files", (file_name, upload_file(content))) for (file_name, content) in
                  zip(file_name_list, content_list)]
-        response = requests.put(f"{self.url_prefix}/files/{self.bucket_name}",
-                                data={"override": override},
-                                files=files)
+        response = get_stream_client().put(f"{self.url_prefix}/files/{self.bucket_name}",
+                                           data={"override": override},
+                                           files=files)
         check_response(response)
         return UploadResponse(**response.json())
 
+    def link_file(self, file_name: str, src_bucket: str, src_file_name: str, override: bool = True) -> None:
+        response = get_session().put(f"{self.url_prefix}/link/{self.bucket_name}",
+                                     json={"src_bucket": src_bucket,
+                                           "src_file_name": src_file_name,
+                                           "file_name": file_name,
+                                           "override": override})
+        check_response(response)
+
+    def get_sha256(self, file_name: str) -> str:
+        response = get_session().get(f"{self.url_prefix}/sha256/{self.bucket_name}/{file_name}")
+        check_response(response)
+        return response.json()
+
+    def evict_files(self, max_size: int | None = None, max_age: float | None = None) -> list[str]:
+        response = get_session().post(f"{self.url_prefix}/evict/{self.bucket_name}",
+                                      params={"max_size": max_size, "max_age": max_age})
+        check_response(response)
+        return response.json()
+
     def get_metadata(self, file_name: str) -> MetaData:
-        response = requests.get(f"{self.url_prefix}/metadata/{self.bucket_name}/{file_name}")
+        response = get_session().get(f"{self.url_prefix}/metadata/{self.bucket_name}/{file_name}")
         check_response(response)
         return MetaData(**response.json())
 
@@ -62,17 +93,17 @@ class Bucket(BaseModel):
         if not file_name_list:
             return []
 
-        response = requests.get(f"{self.url_prefix}/metadatas/{self.bucket_name}",
-                                params={"file_name_list": file_name_list})
+        response = get_session().get(f"{self.url_prefix}/metadatas/{self.bucket_name}",
+                                     params={"file_name_list": file_name_list})
         check_response(response)
         return [MetaData(**data) for data in response.json()]
 
     def delete_file(self, file_name: str) -> None:
-        response = requests.delete(f"{self.url_prefix}/file/{self.bucket_name}/{file_name}")
+        response = get_session().delete(f"{self.url_prefix}/file/{self.bucket_name}/{file_name}")
         check_response(response)
 
     def delete_files(self, file_name_list: list[str]) -> None:
-        response = requests.delete(f"{self.url_prefix}/files/{self.bucket_name}", data=json.dumps(file_name_list))
+        response = get_session().delete(f"{self.url_prefix}/files/{self.bucket_name}", data=json.dumps(file_name_list))
         check_response(response)
 
     def set_str(self, key: str, value: str):
@@ -85,7 +116,7 @@ class Bucket(BaseModel):
         return self.get_file(key).decode('utf-8')
 
     def get_strs(self, key_list: str) -> list[str]:
-        response = requests.get(f"{self.url_prefix}/strs/{self.bucket_name}", params={"key_list": key_list})
+        response = get_session().get(f"{self.url_prefix}/strs/{self.bucket_name}", params={"key_list": key_list})
         check_response(response)
         return response.json()
 
@@ -94,3 +125,193 @@ class Bucket(BaseModel):
 
     def delete_strs(self, key_list: list[str]):
         self.delete_files(key_list)
+
+    def init_upload(self, file_name: str, size: int, sha256: str | None = None,
+                    override: bool = False) -> UploadStatus:
+        response = get_session().post(f"{self.url_prefix}/uploads/{self.bucket_name}",
+                                      json={"file_name": file_name, "size": size, "sha256": sha256,
+                                            "override": override})
+        check_response(response)
+        return UploadStatus.model_validate(response.json())
+
+    def get_upload(self, upload_id: str) -> UploadStatus:
+        response = get_session().get(f"{self.url_prefix}/uploads/{self.bucket_name}/{upload_id}")
+        check_response(response)
+        return UploadStatus.model_validate(response.json())
+
+    def upload_part(self, upload_id: str, offset: int, data: bytes) -> UploadPart:
+        response = get_session().put(f"{self.url_prefix}/uploads/{self.bucket_name}/{upload_id}",
+                                     params={"offset": offset, "sha256": hashlib.sha256(data).hexdigest()},
+                                     data=data)
+        check_response(response)
+        return UploadPart.model_validate(response.json())
+
+    def complete_upload(self, upload_id: str) -> UploadedFile:
+        response = get_session().post(f"{self.url_prefix}/uploads/{self.bucket_name}/{upload_id}/complete")
+        check_response(response)
+        return UploadedFile.model_validate(response.json())
+
+    def abort_upload(self, upload_id: str) -> None:
+        response = get_session().delete(f"{self.url_prefix}/uploads/{self.bucket_name}/{upload_id}")
+        check_response(response)
+
+    def upload_file(self,
+                    file_name: str,
+                    file_path: str | Path,
+                    override: bool = False,
+                    upload_id: str | None = None,
+                    part_size: int = UPLOAD_PART_SIZE,
+                    workers: int = UPLOAD_WORKERS,
+                    retries: int = 3) -> UploadedFile:
+        """
+        Upload a large local file in parts of part_size, workers parts in parallel, each part retried on failure.
+        To resume an upload after a failure, init it with init_upload and pass its upload_id again,
+        only the ranges not received yet are uploaded.
+        """
+        if upload_id is None:
+            size = Path(file_path).stat().st_size
+            upload_id = self.init_upload(file_name, size, file_sha256(file_path), override).upload_id
+        ranges = []  # 未收到的 (offset, size)，按 part_size 切分
+        for start, range_size in self.get_upload(upload_id).missing_ranges():
+            for offset in range(start, start + range_size, part_size):
+                ranges.append((offset, min(part_size, start + range_size - offset)))
+
+        def upload(offset: int, size: int):
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size)
+            for attempt in range(retries + 1):
+                try:
+                    return self.upload_part(upload_id, offset, data)
+                except (requests.RequestException, HTTPException) as e:
+                    # 只重试网络错误和传输中损坏的分片
+                    if attempt == retries or \
+                            isinstance(e, HTTPException) and e.status_code != ErrorCode.CHECKSUM_MISMATCH.code:
+                        raise
+
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(lambda item: upload(*item), ranges))
+        return self.complete_upload(upload_id)
+
+
+def file_sha256(file_path: str | Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class AsyncBucket(BaseModel):
+    """Async client of a bucket with the same methods as Bucket, all requests share the connection pool of client."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    endpoint: str
+    bucket_name: str | None
+    client: httpx.AsyncClient
+
+    @property
+    def url_prefix(self):
+        return self.endpoint + '/api/file'
+
+    def __init__(self, endpoint: str, bucket_name: str, client: httpx.AsyncClient | None = None):
+        super().__init__(endpoint=endpoint, bucket_name=bucket_name, client=client or get_async_client())
+
+    async def create_bucket(self):
+        response = await self.client.put(f"{self.url_prefix}/bucket/{self.bucket_name}")
+        check_response(response)
+
+    async def delete_bucket(self):
+        response = await self.client.delete(f"{self.url_prefix}/bucket/{self.bucket_name}")
+        check_response(response)
+        self.bucket_name = None
+
+    async def get_file(self, file_name: str) -> bytes:
+        response = await self.client.get(f"{self.url_prefix}/file/{self.bucket_name}/{file_name}")
+        check_response(response)
+        return response.content
+
+    async def get_files(self, file_names: list[str]) -> bytes:
+        response = await self.client.post(f"{self.url_prefix}/get_files/{self.bucket_name}", json=file_names)
+        check_response(response)
+        return response.content  # .zip data for dir or multiple files.
+
+    async def set_file(self, file_name: str, content: bytes | BinaryIO, override: bool = False) -> None:
+        response = await self.client.put(f"{self.url_prefix}/file/{self.bucket_name}",
+                                         data={"override": override},
+                                         files={"file": (file_name, upload_file(content))})
+        check_response(response)
+
+    async def set_files(self, file_name_list: list[str], content_list: list[bytes | BinaryIO],
+                        override: bool = False) -> UploadResponse:
+        assert len(file_name_list) == len(content_list)
+        files = [("files", (file_name, upload_file(content))) for (file_name, content) in
+                 zip(file_name_list, content_list)]
+        response = await self.client.put(f"{self.url_prefix}/files/{self.bucket_name}",
+                                         data={"override": override},
+                                         files=files)
+        check_response(response)
+        return UploadResponse(**response.json())
+
+    async def link_file(self, file_name: str, src_bucket: str, src_file_name: str, override: bool = True) -> None:
+        response = await self.client.put(f"{self.url_prefix}/link/{self.bucket_name}",
+                                         json={"src_bucket": src_bucket,
+                                               "src_file_name": src_file_name,
+                                               "file_name": file_name,
+                                               "override": override})
+        check_response(response)
+
+    async def get_sha256(self, file_name: str) -> str:
+        response = await self.client.get(f"{self.url_prefix}/sha256/{self.bucket_name}/{file_name}")
+        check_response(response)
+        return response.json()
+
+    async def evict_files(self, max_size: int | None = None, max_age: float | None = None) -> list[str]:
+        response = await self.client.post(f"{self.url_prefix}/evict/{self.bucket_name}",
+                                          params=drop_none({"max_size": max_size, "max_age": max_age}))
+        check_response(response)
+        return response.json()
+
+    async def get_metadata(self, file_name: str) -> MetaData:
+        response = await self.client.get(f"{self.url_prefix}/metadata/{self.bucket_name}/{file_name}")
+        check_response(response)
+        return MetaData(**response.json())
+
+    async def get_metadatas(self, file_name_list: list[str]) -> list[MetaData]:
+        if not file_name_list:
+            return []
+
+        response = await self.client.get(f"{self.url_prefix}/metadatas/{self.bucket_name}",
+                                         params={"file_name_list": file_name_list})
+        check_response(response)
+        return [MetaData(**data) for data in response.json()]
+
+    async def delete_file(self, file_name: str) -> None:
+        response = await self.client.delete(f"{self.url_prefix}/file/{self.bucket_name}/{file_name}")
+        check_response(response)
+
+    async def delete_files(self, file_name_list: list[str]) -> None:
+        # httpx 的 delete 不能带请求体
+        response = await self.client.request("DELETE", f"{self.url_prefix}/files/{self.bucket_name}",
+                                             content=json.dumps(file_name_list))
+        check_response(response)
+
+    async def set_str(self, key: str, value: str):
+        await self.set_file(key, value.encode('utf-8'))
+
+    async def set_strs(self, key_list: list[str], value_list: list[str]):
+        await self.set_files(key_list, [value.encode('utf-8') for value in value_list])
+
+    async def get_str(self, key: str) -> str:
+        return (await self.get_file(key)).decode('utf-8')
+
+    async def get_strs(self, key_list: str) -> list[str]:
+        response = await self.client.get(f"{self.url_prefix}/strs/{self.bucket_name}", params={"key_list": key_list})
+        check_response(response)
+        return response.json()
+
+    async def delete_str(self, key: str):
+        await self.delete_file(key)
+
+    async def delete_strs(self, key_list: list[str]):
+        await self.delete_files(key_list)
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 class FileConfig(BaseModel):
     base_dir: str
     bucket_list: list[str]
+    upload_expire: float = 7 * 24 * 3600  # 未完成的分片上传保留时长（秒）
 
 
 class DirConfig(BaseModel):
@@ -1,4 +1,3 @@
-import asyncio
 import io
 import mimetypes
 import time
@@ -12,15 +11,16 @@ from typing import cast, Annotated, Literal, Sequence
 from fastapi import APIRouter, Depends, UploadFile, Form, Query
 from sqlalchemy.exc import NoResultFound
 from sqlmodel import Session, select
-from sqlalchemy import delete, update
+from sqlalchemy import delete, update, bindparam
 from starlette.background import BackgroundTask
 from starlette.responses import Response, FileResponse, PlainTextResponse
 
 from rag_file_server.config.config import config
 from rag_file_server.dir.database import engine, create_db_and_tables
 from rag_file_server.dir.model import FileNode, FileType, FileNodeVo, AddDirRequest, UpdateFileRequest, \
-    UploadResponseOfDir, CeleryTaskFailedRequest, FileStatus, CeleryTaskType
+    UploadResponseOfDir, CeleryTaskFailedRequest, FileStatus, CeleryTaskType, FilePatch
 from rag_file_server.error_code import raise_exception, ErrorCode
+from rag_file_server.file.api import CommonParams, save_upload
 from rag_file_server.file.model import MetaData
 from rag_file_sdk.file_api import Bucket
 
@@ -148,18 +148,17 @@ def add_files(files: list[UploadFile],
     for file_name, file_node in file_node_map.items():
         session.refresh(file_node)
 
-    key_list = []
-    content_list = []
+    # 上传的文件按块直接写入 bucket 目录，不再读入内存经 http 转给文件服务
+    bucket_dir = CommonParams(bucket=bucket.bucket_name).dir
+    sha256s = {}
     for file in files:
         if file.filename in file_node_map:
-            key_list.append(file_node_map[file.filename].storage_key)
-            content_list.append(asyncio.run(file.read()))
-    if key_list:
-        bucket.set_files(key_list, content_list)
+            sha256s[file.filename] = save_upload(file.file, bucket_dir / file_node_map[file.filename].storage_key)
 
     ignore_list = [file.filename for file in files if file.filename not in saved_list]
     return UploadResponseOfDir(saved_files=saved_list,
                                ignore_files=ignore_list,
+                               sha256s=sha256s,
                                file_nodes=file_node_map.values())
 
 
@@ -292,6 +291,26 @@ def update_files(request: UpdateFileRequest, session: Session = Depends(get_sess
     session.commit()
 
 
+@router.post("/files/patch")
+def patch_files(patches: list[FilePatch], session: Session = Depends(get_session)) -> None:
+    """Update different fields and values of each file in one transaction."""
+    # 更新字段相同的文件一条语句 executemany
+    groups: dict[tuple[str, ...], list[dict]] = {}
+    for patch in patches:
+        values = patch.model_dump(exclude={'id'}, exclude_unset=True)
+        if values:
+            groups.setdefault(tuple(sorted(values)), []).append(
+                {'file_id': patch.id, **{f"new_{field}": value for field, value in values.items()}})
+    table = FileNode.__table__
+    for fields, rows in groups.items():
+        # 绑定参数不能与列同名
+        stmt = (update(table)
+                .where(table.c.id == bindparam('file_id'))
+                .values({field: bindparam(f"new_{field}") for field in fields}))
+        session.execute(stmt, rows)
+    session.commit()
+
+
 @router.post("/celery_task_failed", response_model=list[FileNode])
 def on_celery_task_failed(request: CeleryTaskFailedRequest,
                           session: Session = Depends(get_session)) -> list[FileNode]:
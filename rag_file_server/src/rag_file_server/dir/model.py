@@ -75,6 +75,19 @@ class UpdateFileRequest(BaseModel):
     revision_not_in_vector_store: bool = False
 
 
+class FilePatch(BaseModel):
+    """Fields to update of one file, only the fields set are updated."""
+    id: str
+    name: str | None = None
+    parent_id: str | None = None
+    status: FileStatus | None = None
+    parse_percent: float | None = None
+    to_vector_store_percent: float | None = None
+    celery_task_id: str | None = None
+    celery_task_type: CeleryTaskType | None = None
+    revision_not_in_vector_store: bool | None = None
+
+
 class UploadResponseOfDir(UploadResponse):
     file_nodes: list[FileNode]
 
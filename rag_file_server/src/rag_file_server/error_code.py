@@ -11,6 +11,11 @@ class ErrorCode(Enum):
     DIR_NOT_EXISTS = (524, "Dir not exists")
     UNIQUE_CONSTRAINT_FAILED = (542, "unique constraint failed")
     BUCKET_ALREADY_EXIST = (525, "bucket already exist")
+    UPLOAD_NOT_EXISTS = (526, "Upload not exists")
+    UPLOAD_PART_INVALID = (527, "Upload part invalid")
+    CHECKSUM_MISMATCH = (528, "Checksum mismatch")
+    UPLOAD_INCOMPLETE = (529, "Upload incomplete")
+    INVALID_FILE_NAME = (530, "Invalid file name")
 
     def __init__(self, code, desc):
         self.code = code
@@ -1,20 +1,27 @@
+import hashlib
+import os
+import re
 import shutil
 import time
+import uuid
 import zipfile
-from typing import Annotated
+from typing import Annotated, BinaryIO, Iterable, Iterator
 
-from fastapi import APIRouter, UploadFile, File, Query, Depends, Form
+from fastapi import APIRouter, UploadFile, File, Query, Depends, Form, Request
 from pathlib import Path
 from pydantic import BaseModel, field_validator
 from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import FileResponse
 
 from rag_file_server.config.config import config
 from rag_file_server.error_code import raise_exception, ErrorCode
-from rag_file_server.file.model import UploadResponse, MetaData
+from rag_file_server.file.model import UploadResponse, MetaData, LinkFileRequest, InitUploadRequest, UploadPart, \
+    UploadStatus, UploadedFile
 
 # 定义根路径
 BASE_DIR = Path(config.file.base_dir)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 # 创建预设 buckets 目录
@@ -36,11 +43,47 @@ class CommonParams(BaseModel):
     @field_validator('bucket')
     @classmethod
     def validate_bucket(cls, bucket: str) -> str:
-        if (BASE_DIR / bucket).is_dir():
+        bucket_path = Path(bucket)
+        if not bucket_path.is_absolute() and '..' not in bucket_path.parts and (BASE_DIR / bucket).is_dir():
             return bucket
         raise_exception(ErrorCode.BUCKET_NOT_EXISTS, bucket)
 
 
+def get_file_path(bucket_dir: Path, file_name: str) -> Path:
+    """The path of file_name in the bucket dir, raise if the name is empty or points outside the bucket dir."""
+    file_path = Path(file_name)
+    if not file_name or file_path.is_absolute() or '..' in file_path.parts or \
+            not (bucket_dir / file_path).resolve().is_relative_to(bucket_dir.resolve()):
+        raise_exception(ErrorCode.INVALID_FILE_NAME, file_name)
+    return bucket_dir / file_path
+
+
+def save_chunks(chunks: Iterable[bytes], file_path: Path, sha256: str | None = None) -> str:
+    """
+    Write the chunks into file_path and return their sha256, raise if it is not the sha256 given.
+    The file is written aside and then replaces the old one, so the files hard linked to the old one are not changed.
+    """
+    hasher = hashlib.sha256()
+    tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.uploading")
+    try:
+        with open(tmp_path, "wb") as buffer:
+            for chunk in chunks:
+                hasher.update(chunk)
+                buffer.write(chunk)
+        if sha256 and hasher.hexdigest() != sha256:
+            raise_exception(ErrorCode.CHECKSUM_MISMATCH, file_path.name)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return hasher.hexdigest()
+
+
+def save_upload(src: BinaryIO, file_path: Path) -> str:
+    """Copy src into file_path chunk by chunk and return its sha256, see save_chunks."""
+    return save_chunks(iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b''), file_path)
+
+
 @router.put("/bucket/{bucket:path}")
 def create_bucket(bucket: str):
     if (BASE_DIR / bucket).is_dir():
@@ -96,25 +139,81 @@ def set_file(file: UploadFile = File(...),
     if not override and file_path.exists():
         raise_exception(ErrorCode.FILE_EXISTS, file.filename)
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    save_upload(file.file, file_path)
 
 
 @router.put("/files/{bucket:path}", response_model=UploadResponse)
 def set_files(files: list[UploadFile] = File(...),
-              override: bool = False,
+              override: Annotated[bool, Form()] = False,
               common: CommonParams = Depends()):
     saved_files = []
     ignore_files = []
+    sha256s = {}
     for file in files:
         file_path = common.dir / file.filename
         if not override and file_path.exists():
             ignore_files.append(file.filename)
         else:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            sha256s[file.filename] = save_upload(file.file, file_path)
             saved_files.append(file.filename)
-    return UploadResponse(saved_files=saved_files, ignore_files=ignore_files)
+    return UploadResponse(saved_files=saved_files, ignore_files=ignore_files, sha256s=sha256s)
+
+
+@router.put("/link/{bucket:path}")
+def link_file(request: LinkFileRequest, common: CommonParams = Depends()) -> None:
+    """Link a file of another bucket into this bucket, hard link is used if possible, otherwise copy."""
+    src_path = get_file_path(CommonParams(bucket=request.src_bucket).dir, request.src_file_name)
+    if not src_path.is_file():
+        raise_exception(ErrorCode.FILE_NOT_EXISTS, f"{request.src_bucket}/{request.src_file_name}")
+
+    file_path = get_file_path(common.dir, request.file_name)
+    if file_path.exists():
+        if not request.override:
+            raise_exception(ErrorCode.FILE_EXISTS, request.file_name)
+        file_path.unlink()
+
+    try:
+        os.link(src_path, file_path)
+    except OSError:
+        shutil.copyfile(src_path, file_path)
+    # 更新源文件的修改时间，淘汰时最近使用的文件最后被删除
+    os.utime(src_path)
+
+
+@router.get("/sha256/{bucket:path}/{file_name:path}")
+def get_sha256(file_name: str, common: CommonParams = Depends()) -> str:
+    file_path = common.dir / file_name
+    if not file_path.is_file():
+        raise_exception(ErrorCode.FILE_NOT_EXISTS, file_name)
+
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@router.post("/evict/{bucket:path}")
+def evict_files(max_size: int | None = None,
+                max_age: float | None = None,
+                common: CommonParams = Depends()) -> list[str]:
+    """
+    Delete files older than max_age seconds, then delete the least recently modified files
+    until the total size of the bucket is not more than max_size bytes.
+    """
+    # 以点开头的是分块上传的元数据、分块和写入中的临时文件
+    files = [(path, path.stat()) for path in common.dir.iterdir() if path.is_file() and not path.name.startswith('.')]
+    files.sort(key=lambda item: item[1].st_mtime)
+    total_size = sum(stat.st_size for _, stat in files)
+    now = time.time()
+    evicted = []
+    for path, stat in files:
+        if (max_age is not None and now - stat.st_mtime > max_age) or \
+                (max_size is not None and total_size > max_size):
+            path.unlink(missing_ok=True)
+            total_size -= stat.st_size
+            evicted.append(path.name)
+    return evicted
 
 
 @router.get("/metadata/{bucket:path}/{file_name:path}", response_model=MetaData)
@@ -149,3 +248,144 @@ def get_strs(key_list: list[str] = Query(), common: CommonParams = Depends()) ->
         if not file_path.is_file():
             raise_exception(ErrorCode.FILE_NOT_EXISTS, file_path.name)
     return [file_path.read_text('utf-8') for file_path in file_paths]
+
+
+# 分片上传：每个分片校验后保存为 bucket 目录中的 .{upload_id}.{offset}.{size}.{sha256}.part，
+# 上传信息在 .{upload_id}.upload.json，完成时按偏移拼接为目标文件。
+# 上传的状态都在文件名中，分片可以并行上传，失败后重传缺少的范围即可。
+_UPLOAD_ID = re.compile(r'[0-9a-f]{32}')
+_PART_NAME = re.compile(r'\.(?P<upload_id>[0-9a-f]{32})\.(?P<offset>\d+)\.(?P<size>\d+)'
+                        r'\.(?P<sha256>[0-9a-f]{64})\.part')
+
+
+def _upload_meta_path(bucket_dir: Path, upload_id: str) -> Path:
+    if not _UPLOAD_ID.fullmatch(upload_id):
+        raise_exception(ErrorCode.UPLOAD_NOT_EXISTS, upload_id)
+    return bucket_dir / f".{upload_id}.upload.json"
+
+
+def _part_path(bucket_dir: Path, upload_id: str, part: UploadPart) -> Path:
+    return bucket_dir / f".{upload_id}.{part.offset}.{part.size}.{part.sha256}.part"
+
+
+def _load_upload(bucket_dir: Path, upload_id: str) -> UploadStatus:
+    meta_path = _upload_meta_path(bucket_dir, upload_id)
+    if not meta_path.is_file():
+        raise_exception(ErrorCode.UPLOAD_NOT_EXISTS, upload_id)
+    status = UploadStatus.model_validate_json(meta_path.read_text('utf-8'))
+    status.parts = [UploadPart(offset=int(match['offset']), size=int(match['size']), sha256=match['sha256'])
+                    for path in bucket_dir.glob(f".{upload_id}.*.part")
+                    if (match := _PART_NAME.fullmatch(path.name))]
+    return status
+
+
+def _delete_upload(bucket_dir: Path, upload_id: str):
+    # 先删除上传信息，之后到达的分片不再被接受
+    _upload_meta_path(bucket_dir, upload_id).unlink(missing_ok=True)
+    for path in bucket_dir.glob(f".{upload_id}.*"):
+        path.unlink(missing_ok=True)
+
+
+def _delete_expired_uploads(bucket_dir: Path):
+    now = time.time()
+    for meta_path in bucket_dir.glob(".*.upload.json"):
+        try:
+            expired = now - meta_path.stat().st_mtime > config.file.upload_expire
+        except FileNotFoundError:
+            continue
+        if expired:
+            _delete_upload(bucket_dir, meta_path.name.split('.')[1])
+
+
+def _iter_parts(bucket_dir: Path, status: UploadStatus) -> Iterator[bytes]:
+    # 分片可能重叠（续传时分片大小不同），只取未写入的部分
+    pos = 0
+    for part in sorted(status.parts, key=lambda part: (part.offset, -part.size)):
+        if part.offset + part.size <= pos:
+            continue
+        with open(_part_path(bucket_dir, status.upload_id, part), "rb") as src:
+            src.seek(pos - part.offset)
+            yield from iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b'')
+        pos = part.offset + part.size
+
+
+@router.post("/uploads/{bucket:path}/{upload_id}/complete", response_model=UploadedFile)
+def complete_upload(upload_id: str, common: CommonParams = Depends()) -> UploadedFile:
+    """Join the parts into the file, the sha256 of the file is checked if given at init."""
+    status = _load_upload(common.dir, upload_id)
+    if missing := status.missing_ranges():
+        raise_exception(ErrorCode.UPLOAD_INCOMPLETE, f"missing (offset, size): {missing[:10]}")
+    file_path = common.dir / status.file_name
+    if not status.override and file_path.exists():
+        raise_exception(ErrorCode.FILE_EXISTS, status.file_name)
+
+    sha256 = save_chunks(_iter_parts(common.dir, status), file_path, status.sha256)
+    _delete_upload(common.dir, upload_id)
+    return UploadedFile(file_name=status.file_name, size=status.size, sha256=sha256)
+
+
+@router.post("/uploads/{bucket:path}", response_model=UploadStatus)
+def init_upload(request: InitUploadRequest, common: CommonParams = Depends()) -> UploadStatus:
+    """Start a chunked upload, the parts are uploaded with upload_part and joined with complete_upload."""
+    if not request.override and get_file_path(common.dir, request.file_name).exists():
+        raise_exception(ErrorCode.FILE_EXISTS, request.file_name)
+    _delete_expired_uploads(common.dir)
+
+    status = UploadStatus(upload_id=uuid.uuid4().hex, **request.model_dump())
+    _upload_meta_path(common.dir, status.upload_id).write_text(status.model_dump_json(), 'utf-8')
+    return status
+
+
+@router.get("/uploads/{bucket:path}/{upload_id}", response_model=UploadStatus)
+def get_upload(upload_id: str, common: CommonParams = Depends()) -> UploadStatus:
+    """The parts received, to resume an upload by uploading the missing ranges."""
+    return _load_upload(common.dir, upload_id)
+
+
+@router.put("/uploads/{bucket:path}/{upload_id}", response_model=UploadPart)
+async def upload_part(upload_id: str,
+                      request: Request,
+                      offset: int = Query(ge=0),
+                      sha256: str | None = None,
+                      common: CommonParams = Depends()) -> UploadPart:
+    """
+    Upload the request body as the part of the file at offset, it is streamed into the bucket dir.
+    The part is kept only if it is received completely and matches sha256 if given, so it can be retried safely.
+    """
+    status = await run_in_threadpool(_load_upload, common.dir, upload_id)
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = common.dir / f".{upload_id}.{offset}.{uuid.uuid4().hex}.partial"
+    try:
+        with open(tmp_path, "wb") as buffer:
+            data = bytearray()
+            async for chunk in request.stream():
+                size += len(chunk)
+                if offset + size > status.size:
+                    raise_exception(ErrorCode.UPLOAD_PART_INVALID, f"part at {offset} exceeds size {status.size}")
+                hasher.update(chunk)
+                data += chunk
+                # 攒够一块再在线程中写，不阻塞事件循环
+                if len(data) >= UPLOAD_CHUNK_SIZE:
+                    await run_in_threadpool(buffer.write, bytes(data))
+                    data.clear()
+            await run_in_threadpool(buffer.write, bytes(data))
+        if size == 0:
+            raise_exception(ErrorCode.UPLOAD_PART_INVALID, "empty part")
+        if sha256 and hasher.hexdigest() != sha256:
+            raise_exception(ErrorCode.CHECKSUM_MISMATCH, f"part at {offset}")
+        part = UploadPart(offset=offset, size=size, sha256=hasher.hexdigest())
+        part_path = _part_path(common.dir, upload_id, part)
+        os.replace(tmp_path, part_path)
+        if not _upload_meta_path(common.dir, upload_id).exists():
+            # 上传已完成或取消
+            part_path.unlink(missing_ok=True)
+            raise_exception(ErrorCode.UPLOAD_NOT_EXISTS, upload_id)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return part
+
+
+@router.delete("/uploads/{bucket:path}/{upload_id}")
+def abort_upload(upload_id: str, common: CommonParams = Depends()) -> None:
+    _delete_upload(common.dir, upload_id)
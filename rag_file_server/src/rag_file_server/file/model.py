@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class MetaData(BaseModel):
@@ -9,3 +9,47 @@ class MetaData(BaseModel):
 class UploadResponse(BaseModel):
     saved_files: list[str]
     ignore_files: list[str]
+    sha256s: dict[str, str] = {}  # 保存的文件名 -> 内容的 sha256，保存时计算
+
+
+class LinkFileRequest(BaseModel):
+    src_bucket: str
+    src_file_name: str
+    file_name: str
+    override: bool = True
+
+
+class InitUploadRequest(BaseModel):
+    file_name: str
+    size: int = Field(ge=0)
+    sha256: str | None = None  # 整个文件的 sha256，完成上传时校验
+    override: bool = False
+
+
+class UploadPart(BaseModel):
+    offset: int
+    size: int
+    sha256: str
+
+
+class UploadStatus(InitUploadRequest):
+    upload_id: str
+    parts: list[UploadPart] = []  # 已收到的分片
+
+    def missing_ranges(self) -> list[tuple[int, int]]:
+        """(offset, size) of the ranges not covered by the parts received."""
+        ret = []
+        pos = 0
+        for part in sorted(self.parts, key=lambda part: part.offset):
+            if part.offset > pos:
+                ret.append((pos, part.offset - pos))
+            pos = max(pos, part.offset + part.size)
+        if pos < self.size:
+            ret.append((pos, self.size - pos))
+        return ret
+
+
+class UploadedFile(BaseModel):
+    file_name: str
+    size: int
+    sha256: str
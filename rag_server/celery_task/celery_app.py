@@ -1,18 +1,27 @@
 import json
+import time
+from typing import Iterator
+
 import celery
-import requests
 from celery import Celery
 from celery.signals import task_failure, task_success
+from fastapi import HTTPException
+from rag_file_sdk.client import get_session
 from rag_file_sdk.dir_api import DirMgr
 from rag_file_sdk.file_api import Bucket
-from rag_file_server.dir.model import FileStatus
+from rag_file_server.dir.model import FileStatus, CeleryTaskType
 
 from celery_task.model import ToVectorStoreNotify, ParseFileNotify, send_process_notify, send_file_status_notify, \
     send_revision_md_notify
 from config.config import config
-from file_mgr.api import get_split_list
-from file_parser.model import ParseFileRequest
+from file_mgr.api import get_split_list, get_chunk_list
+from error_code import ErrorCode
+from file_parser.model import ParseJobRequest, ParseJob, ParseJobStatus, ParseProfile
+from file_parser.parse_cache import parse_cache
+from file_parser.result_writer import ParseResultWriter
 from store_retriever_server.crud import get_kb_vecstore_name
+from store_retriever_server.ingest_pipeline import IngestPipeline, DocsIngestPipeline
+from store_retriever_server.model import Chunk
 from store_retriever_server.store_engine import StoreEngine
 from util import check_response
 
@@ -23,29 +32,81 @@ notify_url = config.accept_nodify_url
 dir_mgr = DirMgr(config.file_server_url)
 
 
+def submit_parse_job(bucket_name: str,
+                     file_key: str,
+                     file_node_id: str,
+                     profile: ParseProfile = ParseProfile.STANDARD) -> str:
+    request = ParseJobRequest(file_node_id=file_node_id,
+                              notify_url=notify_url,
+                              bucket_name=bucket_name,
+                              file_key=file_key,
+                              profile=profile)
+    response = get_session().post(config.default_parse_job_url, json=request.model_dump())
+    check_response(response)
+    return response.json()['job_id']
+
+
+def get_parse_job(job_id: str) -> ParseJob | None:
+    response = get_session().get(f"{config.default_parse_job_url}/{job_id}")
+    if response.status_code == ErrorCode.PARSE_JOB_NOT_EXISTS.code:
+        return None
+    check_response(response)
+    return ParseJob.model_validate(response.json())
+
+
 @app.task(bind=True,
           acks_late=True,
+          max_retries=None,
           # autoretry_for=(Exception,),
           # retry_kwargs={'max_retries': 2, 'countdown': 10},
           # reject_on_worker_lost=True # 为 celery 崩溃恢复正在执行的任务，但是不起作用
           )
-def parse_pdf(self: celery.Task, bucket_name: str, file_key_list: list[str], file_node_ids: list[str]):
-    for file_node_id in file_node_ids:
-        send_process_notify(notify_url, ParseFileNotify, file_node_id, 1)
+def parse_pdf(self: celery.Task,
+              bucket_name: str,
+              file_key_list: list[str],
+              file_node_ids: list[str],
+              job_ids: list[str] | None = None,
+              cache_keys: list[str] | None = None,
+              profile: str = ParseProfile.STANDARD.value,
+              deadline: float | None = None):
+    """
+    Submit parse jobs to the parser and poll them by retrying this task, so no celery thread or http connection
+    is held during conversion. The parser writes the parsed pages into the bucket itself.
+    If cache_keys are given, the parse results are saved into the parse cache.
+    The task fails if the jobs are not finished parse_job_timeout seconds after submitted.
+    """
+    profile = ParseProfile(profile)
+    if deadline is None:
+        # 每次轮询都很短，task_time_limit 不再限制卡住的解析任务，按首次提交时间计算截止时间
+        deadline = time.time() + config.parse_job_timeout
+    if job_ids is None:
+        for file_node_id in file_node_ids:
+            send_process_notify(notify_url, ParseFileNotify, file_node_id, 1)
+        job_ids = [submit_parse_job(bucket_name, file_key, file_node_id, profile)
+                   for file_key, file_node_id in zip(file_key_list, file_node_ids)]
 
-    file_urls = [f"{config.file_server_url}/api/file/file/{bucket_name}/{file_key}"
-                 for file_key in file_key_list]
-    request = ParseFileRequest(file_urls=file_urls,
-                               file_node_ids=file_node_ids,
-                               notify_url=config.accept_nodify_url)
-    response = requests.post(config.default_pdf_parser_url, json=request.model_dump())
-    check_response(response)
+    running = False
+    for index, (file_key, file_node_id) in enumerate(zip(file_key_list, file_node_ids)):
+        job = get_parse_job(job_ids[index])
+        if job is None:  # parser 重启后任务丢失，重新提交
+            job_ids[index] = submit_parse_job(bucket_name, file_key, file_node_id, profile)
+            running = True
+        elif job.status == ParseJobStatus.FAILURE:
+            raise RuntimeError(f"parse {file_key} failed: {job.error}")
+        elif job.status != ParseJobStatus.SUCCESS:
+            running = True
 
-    bucket = Bucket(config.file_server_url, bucket_name)
-    for file_key, md_list in zip(file_key_list, response.json()):
-        key = file_key + '.md.json'
-        bucket.delete_str(key)
-        bucket.set_str(key, json.dumps(md_list))
+    if running:
+        if time.time() > deadline:
+            raise TimeoutError(f"parse {file_key_list} not finished in {config.parse_job_timeout} seconds")
+        raise self.retry(kwargs={**self.request.kwargs, 'job_ids': job_ids, 'deadline': deadline},
+                         countdown=config.parse_job_poll_interval)
+
+    for file_key, cache_key in zip(file_key_list, cache_keys or []):
+        try:
+            parse_cache.store(cache_key, bucket_name, file_key)
+        except Exception as e:
+            print(f"save parse cache of {file_key} failed: {e}")
 
     send_file_status_notify(notify_url, file_node_ids, FileStatus.PARSED)
     dir_mgr.update_celery_task(file_node_ids, None, None)
@@ -57,20 +118,123 @@ def parse_pdf(self: celery.Task, bucket_name: str, file_key_list: list[str], fil
           # retry_kwargs={'max_retries': 2, 'countdown': 10},
           # reject_on_worker_lost=True # 为 celery 崩溃恢复正在执行的任务，但是不起作用
           )
-def to_vector_store(self, kb_id: str, store_name: str, file_node_ids: list[str]):
+def to_vector_store(self, kb_id: str, store_name: str, file_node_ids: list[str], structure_chunking: bool = False):
+    """
+    Add the files into the vector store in pipeline, the next files are loaded and split
+    while the current ones are embedded, and the chunks of small files are embedded together.
+    """
     for file_node_id in file_node_ids:
         send_process_notify(notify_url, ToVectorStoreNotify, file_node_id, 1)
 
-    file_nodes = dir_mgr.get_files_by_ids(file_node_ids)
-    for file_node in file_nodes:
-        send_revision_md_notify(notify_url, [file_node.id], False)
-        # 因为下面修改数据需要快速执行，避免副作用，所以直接调用
-        dir_mgr.update_files([file_node.id], {'revision_not_in_vector_store': False})
-        split_list = get_split_list(kb_id, file_node.id)
-        vector_store_mgr = StoreEngine(store_name)
-        vector_store_mgr.add_doc(split_list, str(file_node.id))
-        send_file_status_notify(notify_url, file_node_ids, FileStatus.IN_VECTOR_STORE)
-        dir_mgr.update_celery_task([file_node.id], None, None)
+    send_revision_md_notify(notify_url, file_node_ids, False)
+    # 因为下面修改数据需要快速执行，避免副作用，所以直接调用
+    dir_mgr.update_files(file_node_ids, {'revision_not_in_vector_store': False})
+
+    def load(file_node_id: str) -> list[Chunk]:
+        if structure_chunking:
+            chunks = get_chunk_list(kb_id, file_node_id)
+        else:
+            chunks = [Chunk(text=text) for text in get_split_list(kb_id, file_node_id)]
+        send_process_notify(notify_url, ToVectorStoreNotify, file_node_id, 10)
+        return chunks
+
+    def on_done(file_node_id: str):
+        send_process_notify(notify_url, ToVectorStoreNotify, file_node_id, 100)
+        send_file_status_notify(notify_url, [file_node_id], FileStatus.IN_VECTOR_STORE)
+        dir_mgr.update_celery_task([file_node_id], None, None)
+
+    pipeline = DocsIngestPipeline(StoreEngine(store_name),
+                                  queue_size=config.ingest_queue_size,
+                                  embed_batch_size=config.ingest_embed_batch_size,
+                                  load_workers=config.ingest_load_workers)
+    pipeline.run(file_node_ids, load, on_done)
+
+
+def iter_parsed_pages(bucket_name: str, file_key: str, job_id: str | None) -> Iterator[tuple[int, list[str]]]:
+    """
+    Yield (start page index, markdown of the pages) of a file as the parse job writes its pages into the bucket,
+    the whole parse result is read if job_id is None (result already in the bucket).
+    """
+    bucket = Bucket(config.file_server_url, bucket_name)
+    next_page = 0
+    while True:
+        job = get_parse_job(job_id) if job_id else None
+        if job_id and job is None:
+            raise RuntimeError(f"parse job of {file_key} lost")
+        if job and job.status == ParseJobStatus.FAILURE:
+            raise RuntimeError(f"parse {file_key} failed: {job.error}")
+
+        if job is None or job.status == ParseJobStatus.SUCCESS:
+            md_list = json.loads(bucket.get_str(file_key + '.md.json'))
+            if next_page < len(md_list):
+                yield next_page, md_list[next_page:]
+            return
+
+        if job.pages_done > next_page:
+            keys = [ParseResultWriter.page_key(file_key, index) for index in range(next_page, job.pages_done)]
+            try:
+                md_list = bucket.get_strs(keys)
+            except HTTPException as e:
+                if e.status_code != ErrorCode.FILE_NOT_EXISTS.code:
+                    raise
+                # 任务刚结束，页文件已被整体结果替换
+                time.sleep(config.ingest_page_poll_interval)
+                continue
+            yield next_page, md_list
+            next_page = job.pages_done
+        else:
+            time.sleep(config.ingest_page_poll_interval)
+
+
+@app.task(bind=True, acks_late=True)
+def ingest_file(self: celery.Task,
+                kb_id: str,
+                store_name: str,
+                bucket_name: str,
+                file_key: str,
+                file_node_id: str,
+                cache_key: str | None = None,
+                parsed: bool = False,
+                profile: str = ParseProfile.STANDARD.value,
+                structure_chunking: bool = False):
+    """
+    Parse, split, embed and insert a file into the vector store in pipeline,
+    the pages are split and embedded while the parser is still converting the later pages.
+    If parsed, the parse result is already in the bucket (linked from parse cache).
+    If structure_chunking, the pages are chunked along the document structure.
+    """
+    job_id = None
+    if not parsed:
+        send_process_notify(notify_url, ParseFileNotify, file_node_id, 1)
+        job_id = submit_parse_job(bucket_name, file_key, file_node_id, ParseProfile(profile))
+
+    def on_parsed():
+        if cache_key and not parsed:
+            try:
+                parse_cache.store(cache_key, bucket_name, file_key)
+            except Exception as e:
+                print(f"save parse cache of {file_key} failed: {e}")
+        send_file_status_notify(notify_url, [file_node_id], FileStatus.TO_VECTOR_STORE_ING)
+        # 之后失败时标记为入库失败
+        dir_mgr.update_celery_task([file_node_id], self.request.id, CeleryTaskType.TO_VECTOR_STORE)
+
+    send_revision_md_notify(notify_url, [file_node_id], False)
+    dir_mgr.update_files([file_node_id], {'revision_not_in_vector_store': False})
+    pipeline = IngestPipeline(StoreEngine(store_name),
+                              file_node_id,
+                              queue_size=config.ingest_queue_size,
+                              embed_batch_size=config.ingest_embed_batch_size,
+                              structure=structure_chunking)
+    chunks = pipeline.run(iter_parsed_pages(bucket_name, file_key, job_id), on_parsed)
+    if structure_chunking:
+        key, data = file_key + ".md.chunks.json", [chunk.model_dump() for chunk in chunks]
+    else:
+        key, data = file_key + ".md.split.json", [chunk.text for chunk in chunks]
+    Bucket(config.file_server_url, bucket_name).set_file(key, json.dumps(data).encode('utf-8'), True)
+
+    send_process_notify(notify_url, ToVectorStoreNotify, file_node_id, 100)
+    send_file_status_notify(notify_url, [file_node_id], FileStatus.IN_VECTOR_STORE)
+    dir_mgr.update_celery_task([file_node_id], None, None)
 
 
 @app.task(bind=True, acks_late=True)
@@ -5,6 +5,7 @@ from rag_file_server.dir.model import FileStatus
 class AcceptedNotifyRequest(BaseModel):
     type: str
     data: dict
+    topics: list[str] = []  # 文件所属的知识库/租户和目录，websocket 客户端按此订阅
 
 
 class FileProcessNotify(BaseModel):
@@ -30,24 +31,17 @@ class RevisionMdNotify(BaseModel):
     not_in_vector_store: bool
 
 
+# 通知经 NotifyClient 缓冲、合并后批量发送
 def send_process_notify(notify_url: str, notify_type: type[FileProcessNotify], file_node_id: str, percent: float):
-    import requests
-    notify_request = AcceptedNotifyRequest(type=notify_type.__name__,
-                                           data=dict(file_node_id=file_node_id,
-                                                     percent=percent))
-    requests.post(notify_url, json=notify_request.model_dump())
+    from celery_task.notify_client import get_notify_client
+    get_notify_client(notify_url).process(notify_type, file_node_id, percent)
 
 
 def send_file_status_notify(notify_url: str, file_node_ids: list[str], status: FileStatus):
-    import requests
-    notify_request = AcceptedNotifyRequest(type=FileStatusNotify.__name__,
-                                           data=dict(file_node_ids=file_node_ids, status=status))
-    requests.post(notify_url, json=notify_request.model_dump())
+    from celery_task.notify_client import get_notify_client
+    get_notify_client(notify_url).file_status(file_node_ids, status)
 
 
 def send_revision_md_notify(notify_url: str, file_node_ids: list[str], not_in_vector_store: bool):
-    import requests
-    notify_request = AcceptedNotifyRequest(type=RevisionMdNotify.__name__,
-                                           data=dict(file_node_ids=file_node_ids,
-                                                     not_in_vector_store=not_in_vector_store))
-    requests.post(notify_url, json=notify_request.model_dump())
+    from celery_task.notify_client import get_notify_client
+    get_notify_client(notify_url).revision_md(file_node_ids, not_in_vector_store)
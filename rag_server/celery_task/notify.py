@@ -1,73 +1,274 @@
+import asyncio
+import json
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import TypeVar
 
-from fastapi import APIRouter
-from rag_file_sdk.dir_api import DirMgr
+import redis.asyncio
+from fastapi import APIRouter, HTTPException, status
+from rag_file_sdk.dir_api import AsyncDirMgr
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
 
-from celery_task.model import AcceptedNotifyRequest, ToVectorStoreNotify, ParseFileNotify, FileStatusNotify, \
-    RevisionMdNotify
+from celery_task.model import AcceptedNotifyRequest, ParseFileNotify, ToVectorStoreNotify
+from celery_task.notify_bus import apply_notifies_async, add_topics_async, publish_notifies_async, \
+    subscribe_notifies, get_top_dir_topic_async
 
 from fastapi import WebSocket, WebSocketDisconnect
 
 from config.config import config
+from db.database import engine
+from kb.model import Kb
+from user_role_group_mgr.auth import get_user_by_token
+from user_role_group_mgr.model import User
+from util import check_permission
 
 router = APIRouter(tags=["notify"])
 
 
+WS_QUEUE_SIZE = 256  # 每个连接待发送消息的上限，超出时丢弃最早的消息
+WS_SEND_TIMEOUT = 10  # 发送超时（秒），超时的连接视为已断开
+
+
+class Connection:
+    """
+    A websocket with its own bounded send queue and sender task, so a slow client only delays itself.
+    Pending percents of a file are coalesced into the latest one.
+    """
+
+    def __init__(self, websocket: WebSocket, topics: set[str]):
+        self.websocket = websocket
+        self.topics = topics  # 只接收这些主题的消息
+        self.pending: OrderedDict[object, dict] = OrderedDict()
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def matches(self, topics: list[str]) -> bool:
+        return not self.topics.isdisjoint(topics)
+
+    def put(self, message: dict):
+        data = message.get('data', {})
+        if message.get('type') in (ParseFileNotify.__name__, ToVectorStoreNotify.__name__):
+            key = (message['type'], data.get('file_node_id'))
+            self.pending.pop(key, None)
+        else:
+            key = object()
+        self.pending[key] = message
+        while len(self.pending) > WS_QUEUE_SIZE:
+            self.pending.popitem(last=False)
+        self.ready.set()
+
+    async def send_loop(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.pending:
+                _, message = self.pending.popitem(last=False)
+                await asyncio.wait_for(self.websocket.send_json(message), WS_SEND_TIMEOUT)
+
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: list[WebSocket] = []  # 存储活动的 WebSocket 连接
+        self.active_connections: dict[WebSocket, Connection] = {}  # 存储活动的 WebSocket 连接
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, topics: set[str]) -> Connection:
         await websocket.accept()  # 接受 WebSocket 连接
-        self.active_connections.append(websocket)
+        connection = Connection(websocket, topics)
+        connection.task = asyncio.create_task(self._send(connection))
+        self.active_connections[websocket] = connection
+        return connection
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)  # 移除断开的连接
+        connection = self.active_connections.pop(websocket, None)  # 移除断开的连接
+        if connection and connection.task:
+            connection.task.cancel()
+
+    async def _send(self, connection: Connection):
+        try:
+            await connection.send_loop()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 发送失败或超时，关闭并移除连接
+            print(f"websocket send failed: {e!r}")
+            self.active_connections.pop(connection.websocket, None)
+            try:
+                await connection.websocket.close()
+            except Exception:
+                pass
 
     async def broadcast(self, message: dict):
-        # 向所有活动连接广播消息
-        for connection in self.active_connections:
-            await connection.send_json(message)
+        # 放入订阅了该消息主题的连接的发送队列，由各连接并发发送
+        topics = message.get('topics') or []
+        for connection in list(self.active_connections.values()):
+            if connection.matches(topics):
+                connection.put(message)
 
 
 manager = ConnectionManager()
 
-# redis = redis.asyncio.Redis(host="localhost", port=6379, db=0)
-# async def notify_consumer():
-#     while True:
-#         message = await redis.blpop(['ParseFileNotify'])
-#         await manager.broadcast(message[1].decode('utf-8'))
-# await redis.rpush(notify.type, json.dumps(notify.data))
+# 设置 notify_redis_url 时，通知经 redis pub/sub 发给所有 web worker，各自转发给自己的 websocket
+_redis: redis.asyncio.Redis | None = None
+_dir_mgr: AsyncDirMgr | None = None
+
+
+def get_async_dir_mgr() -> AsyncDirMgr:
+    global _dir_mgr
+    if _dir_mgr is None:
+        _dir_mgr = AsyncDirMgr(config.file_server_url)
+    return _dir_mgr
 
 
 FileProcessNotifyT = TypeVar('FileProcessNotifyT', bound='FileProcessNotify')
 
 
+async def dispatch_notifies(notifies: list[AcceptedNotifyRequest]):
+    """Send the notifies to the websockets of every web worker through redis, or of this process without redis."""
+    if _redis is not None:
+        await publish_notifies_async(notifies, _redis)
+    else:
+        for notify in notifies:
+            await manager.broadcast(notify.model_dump())
+
+
+@asynccontextmanager
+async def notify_lifespan():
+    """
+    The async dir client of the notify handlers, and the subscriber of the notifies published to redis
+    for the websockets of this process, while in the context.
+    """
+    global _redis, _dir_mgr
+    _dir_mgr = AsyncDirMgr(config.file_server_url)
+    task = None
+    if config.notify_redis_url:
+        _redis = redis.asyncio.Redis.from_url(config.notify_redis_url)
+        task = asyncio.create_task(subscribe_notifies(_redis, manager.broadcast))
+    try:
+        yield
+    finally:
+        if task:
+            task.cancel()
+            await _redis.aclose()
+            _redis = None
+        await _dir_mgr.aclose()
+        _dir_mgr = None
+
+
+async def handle_notifies(notifies: list[AcceptedNotifyRequest]):
+    # 全程异步，不阻塞事件循环
+    dir_mgr = get_async_dir_mgr()
+    await apply_notifies_async(notifies, dir_mgr)
+    await add_topics_async(notifies, dir_mgr)
+    await dispatch_notifies(notifies)
+
+
 @router.post("/accept_notify")
 async def accept_notify(notify: AcceptedNotifyRequest):
-    dir_mgr = DirMgr(config.file_server_url)
-    if notify.type == ParseFileNotify.__name__:
-        data: ParseFileNotify = ParseFileNotify.model_validate(notify.data)
-        dir_mgr.update_parse_percent(data.file_node_id, data.percent)
-    elif notify.type == ToVectorStoreNotify.__name__:
-        data: ToVectorStoreNotify = ToVectorStoreNotify.model_validate(notify.data)
-        dir_mgr.update_to_vector_store_percent(data.file_node_id, data.percent)
-    elif notify.type == FileStatusNotify.__name__:
-        data: FileStatusNotify = FileStatusNotify.model_validate(notify.data)
-        dir_mgr.update_files_status(data.file_node_ids, data.status)
-    elif notify.type == RevisionMdNotify.__name__:
-        data: RevisionMdNotify = RevisionMdNotify.model_validate(notify.data)
-        dir_mgr.update_files(data.file_node_ids, {'revision_not_in_vector_store': data.not_in_vector_store})
-
-    await manager.broadcast(notify.model_dump())
+    await handle_notifies([notify])
+
+
+@router.post("/accept_notify/batch")
+async def accept_notify_batch(notifies: list[AcceptedNotifyRequest]):
+    await handle_notifies(notifies)
+
+
+def _is_topic_list(topics) -> bool:
+    return isinstance(topics, list) and all(isinstance(topic, str) for topic in topics)
+
+
+def _get_user(token: str | None) -> User | None:
+    if not token:
+        return None
+    with Session(engine) as db:
+        try:
+            user = get_user_by_token(token, db)
+        except HTTPException:
+            return None
+        _ = user.level  # 加载角色，会话关闭后仍可检查权限
+        return user
+
+
+def _default_topics(user: User) -> set[str]:
+    # 未指定主题时只接收用户所在租户及其知识库的消息
+    if user.top_group_id is None:
+        return set()
+    with Session(engine) as db:
+        kb_ids = db.exec(select(Kb.id).where(Kb.top_group_id == user.top_group_id)).all()
+    return {f"top_group:{user.top_group_id}", *(f"kb:{kb_id}" for kb_id in kb_ids)}
+
+
+def _can_access(user: User, scope: str) -> bool:
+    prefix, _, value = scope.partition(':')
+    top_group_id = None
+    if prefix == 'top_group' and value.isdigit():
+        top_group_id = int(value)
+    elif prefix == 'kb':
+        with Session(engine) as db:
+            kb = db.get(Kb, value)
+        top_group_id = kb.top_group_id if kb else None
+    if top_group_id is None:
+        return False
+    try:
+        check_permission(top_group_id, user)
+    except HTTPException:
+        return False
+    return True
+
+
+async def _allowed_topics(user: User, topics: list[str] | set[str]) -> set[str]:
+    """The topics the user may subscribe to, a dir is checked by the kb or tenant of its top dir."""
+    allowed = set()
+    for topic in topics:
+        scope = topic
+        if topic.startswith('dir:'):
+            try:
+                scope = await get_top_dir_topic_async(topic[len('dir:'):], get_async_dir_mgr())
+            except Exception:
+                scope = None
+        if scope and await run_in_threadpool(_can_access, user, scope):
+            allowed.add(topic)
+        else:
+            print(f'websocket deny topic {topic} of user {user.name}')
+    return allowed
 
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, token: str | None = None, topics: str | None = None):
+    """
+    The client is authenticated by the query parameter token (the access token of login).
+    Topics are subscribed by the query parameter topics (comma separated) or by the client messages
+    {"subscribe": [...]} and {"unsubscribe": [...]}: kb:{kb_id}, top_group:{top_group_id} and dir:{dir_id},
+    only the topics of the kbs and tenants the user has permission to are subscribed.
+    A client without topics receives the notifies of the user's tenant and its kbs.
+    """
+    user = await run_in_threadpool(_get_user, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    requested = {topic for topic in (topics or '').split(',') if topic}
+    if requested:
+        initial_topics = await _allowed_topics(user, requested)
+    else:
+        initial_topics = await run_in_threadpool(_default_topics, user)
+    connection = await manager.connect(websocket, initial_topics)
     try:
         while True:
             data = await websocket.receive_text()  # 接收来自客户端的消息
-            print(f'websocket receive client message: {data}')
+            try:
+                message = json.loads(data)
+            except ValueError:
+                message = None
+            if isinstance(message, dict) and ('subscribe' in message or 'unsubscribe' in message):
+                subscribe = message.get('subscribe') or []
+                unsubscribe = message.get('unsubscribe') or []
+                if not _is_topic_list(subscribe) or not _is_topic_list(unsubscribe):
+                    print(f'websocket ignore invalid topics: {data}')
+                    continue
+                connection.topics.update(await _allowed_topics(user, subscribe))
+                connection.topics.difference_update(unsubscribe)
+            else:
+                print(f'websocket receive client message: {data}')
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)  # 处理断开连接
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import redis
+import redis.asyncio
+from rag_file_sdk.dir_api import DirMgr, AsyncDirMgr, FilePatchBatch
+from rag_file_server.dir.model import FileNode
+
+from celery_task.model import AcceptedNotifyRequest, ParseFileNotify, ToVectorStoreNotify, FileStatusNotify, \
+    RevisionMdNotify
+from config.config import config
+
+NOTIFY_CHANNEL = 'rag_server:notify'
+
+_redis: redis.Redis | None = None
+
+
+def _file_patches(notifies: list[AcceptedNotifyRequest]) -> FilePatchBatch:
+    """The updates of the notifies merged by file, later notifies override the earlier ones."""
+    patches = FilePatchBatch()
+    for notify in notifies:
+        if notify.type == ParseFileNotify.__name__:
+            data: ParseFileNotify = ParseFileNotify.model_validate(notify.data)
+            patches.add(data.file_node_id, parse_percent=data.percent)
+        elif notify.type == ToVectorStoreNotify.__name__:
+            data: ToVectorStoreNotify = ToVectorStoreNotify.model_validate(notify.data)
+            patches.add(data.file_node_id, to_vector_store_percent=data.percent)
+        elif notify.type == FileStatusNotify.__name__:
+            data: FileStatusNotify = FileStatusNotify.model_validate(notify.data)
+            patches.add(data.file_node_ids, status=data.status)
+        elif notify.type == RevisionMdNotify.__name__:
+            data: RevisionMdNotify = RevisionMdNotify.model_validate(notify.data)
+            patches.add(data.file_node_ids, revision_not_in_vector_store=data.not_in_vector_store)
+    return patches
+
+
+def apply_notifies(notifies: list[AcceptedNotifyRequest]):
+    """Apply the notifies to the file nodes in one request."""
+    DirMgr(config.file_server_url).patch_files(_file_patches(notifies).patches())
+
+
+async def apply_notifies_async(notifies: list[AcceptedNotifyRequest], dir_mgr: AsyncDirMgr):
+    """Async apply_notifies."""
+    await dir_mgr.patch_files(_file_patches(notifies).patches())
+
+
+# 文件服务中知识库和租户的顶层目录名，见 kb.crud.get_kb_dir_name 和 FileMgrApi.get_top_group_dir_name
+_TOP_DIR_TOPICS = [(re.compile(r'__kb_dir_(.+)__'), 'kb'),
+                   (re.compile(r'__top_group_dir_(\d+)__'), 'top_group')]
+TOPIC_CACHE_SIZE = 10000
+TOPIC_CACHE_TTL = 300  # 文件可能被移动，缓存的主题定期重新获取（秒）
+
+_file_topics: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()  # file_node_id -> (获取时间, 主题)
+_dir_topics: dict[str, str | None] = {}  # 目录 id -> 其顶层目录的主题
+_topics_lock = threading.Lock()
+
+
+def _notify_file_node_ids(notify: AcceptedNotifyRequest) -> list[str]:
+    if 'file_node_id' in notify.data:
+        return [str(notify.data['file_node_id'])]
+    return [str(file_node_id) for file_node_id in notify.data.get('file_node_ids', [])]
+
+
+def _top_dir_topic(name: str) -> str | None:
+    return next((f"{prefix}:{match.group(1)}" for pattern, prefix in _TOP_DIR_TOPICS
+                 if (match := pattern.fullmatch(name))), None)
+
+
+def _cached_file_topics(file_node_ids: set[str]) -> tuple[dict[str, list[str]], list[str]]:
+    """Cached topics of the files, and the files not cached."""
+    now = time.time()
+    with _topics_lock:
+        ret = {file_node_id: _file_topics[file_node_id][1] for file_node_id in file_node_ids
+               if file_node_id in _file_topics and now - _file_topics[file_node_id][0] < TOPIC_CACHE_TTL}
+    return ret, [file_node_id for file_node_id in file_node_ids if file_node_id not in ret]
+
+
+def _cache_file_topics(file_node: FileNode) -> list[str]:
+    topics = []
+    if file_node.parent_id:
+        topics.append(f"dir:{file_node.parent_id}")
+        if top_dir_topic := _dir_topics.get(str(file_node.parent_id)):
+            topics.append(top_dir_topic)
+    with _topics_lock:
+        _file_topics.pop(str(file_node.id), None)
+        _file_topics[str(file_node.id)] = (time.time(), topics)
+        while len(_file_topics) > TOPIC_CACHE_SIZE:
+            _file_topics.popitem(last=False)
+        if len(_dir_topics) > TOPIC_CACHE_SIZE:
+            _dir_topics.clear()
+    return topics
+
+
+def _set_topics(notifies: list[AcceptedNotifyRequest], file_topics: dict[str, list[str]]):
+    for notify in notifies:
+        notify.topics = sorted({topic for file_node_id in _notify_file_node_ids(notify)
+                                for topic in file_topics.get(file_node_id, [])})
+
+
+def add_topics(notifies: list[AcceptedNotifyRequest]):
+    """Set the topics of the notifies: the kb or tenant and the dir of their files."""
+    try:
+        file_topics, missing = _cached_file_topics({file_node_id for notify in notifies
+                                                    for file_node_id in _notify_file_node_ids(notify)})
+        if missing:
+            dir_mgr = DirMgr(config.file_server_url)
+            for file_node in dir_mgr.get_files_by_ids(missing):
+                if file_node.parent_id and str(file_node.parent_id) not in _dir_topics:
+                    _dir_topics[str(file_node.parent_id)] = _top_dir_topic(
+                        dir_mgr.get_top_dir_node(str(file_node.parent_id)).name)
+                file_topics[str(file_node.id)] = _cache_file_topics(file_node)
+    except Exception as e:
+        print(f"get topics of notifies failed: {e}")
+        return
+    _set_topics(notifies, file_topics)
+
+
+async def add_topics_async(notifies: list[AcceptedNotifyRequest], dir_mgr: AsyncDirMgr):
+    """Async add_topics."""
+    try:
+        file_topics, missing = _cached_file_topics({file_node_id for notify in notifies
+                                                    for file_node_id in _notify_file_node_ids(notify)})
+        if missing:
+            file_nodes = await dir_mgr.get_files_by_ids(missing)
+            dir_ids = list({str(file_node.parent_id) for file_node in file_nodes
+                            if file_node.parent_id and str(file_node.parent_id) not in _dir_topics})
+            top_dirs = await asyncio.gather(*[dir_mgr.get_top_dir_node(dir_id) for dir_id in dir_ids])
+            for dir_id, top_dir in zip(dir_ids, top_dirs):
+                _dir_topics[dir_id] = _top_dir_topic(top_dir.name)
+            for file_node in file_nodes:
+                file_topics[str(file_node.id)] = _cache_file_topics(file_node)
+    except Exception as e:
+        print(f"get topics of notifies failed: {e}")
+        return
+    _set_topics(notifies, file_topics)
+
+
+async def get_top_dir_topic_async(dir_id: str, dir_mgr: AsyncDirMgr) -> str | None:
+    """The kb or tenant topic of the top dir of the dir."""
+    if dir_id not in _dir_topics:
+        _dir_topics[dir_id] = _top_dir_topic((await dir_mgr.get_top_dir_node(dir_id)).name)
+    return _dir_topics[dir_id]
+
+
+def _dumps(notifies: list[AcceptedNotifyRequest]) -> str:
+    return json.dumps([notify.model_dump(mode='json') for notify in notifies])
+
+
+def publish_notifies(notifies: list[AcceptedNotifyRequest]):
+    """Publish the notifies to every web worker, config.notify_redis_url must be set."""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(config.notify_redis_url)
+    _redis.publish(NOTIFY_CHANNEL, _dumps(notifies))
+
+
+async def publish_notifies_async(notifies: list[AcceptedNotifyRequest], client: redis.asyncio.Redis):
+    await client.publish(NOTIFY_CHANNEL, _dumps(notifies))
+
+
+async def subscribe_notifies(client: redis.asyncio.Redis,
+                             on_notify: Callable[[dict], Awaitable[None]],
+                             retry_interval: float = 1):
+    """Call on_notify for each published notify, until cancelled. Reconnect if the connection is lost."""
+    while True:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(NOTIFY_CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    for notify in json.loads(message['data']):
+                        try:
+                            await on_notify(notify)
+                        except Exception as e:
+                            print(f"handle notify {notify} failed: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"notify subscriber error: {e}")
+            await asyncio.sleep(retry_interval)
@@ -0,0 +1,113 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from rag_file_sdk.client import get_session
+
+from celery_task.model import AcceptedNotifyRequest, FileProcessNotify, FileStatusNotify, RevisionMdNotify
+from celery_task.notify_bus import apply_notifies, publish_notifies, add_topics
+from config.config import config
+
+
+class NotifyClient:
+    """
+    Buffer the percent notifies to accept_notify and send them in batches on a timer.
+    Percents of a file are coalesced: only the latest percent of each file is sent, in the order of their latest update.
+    Status and revision notifies are sent at once after the pending percents, because other code writes the status
+    into the dir service directly, a delayed status could overwrite a newer one.
+    """
+
+    def __init__(self, notify_url: str, flush_interval: float = config.notify_flush_interval):
+        self.batch_url = f"{notify_url}/batch"
+        self.flush_interval = flush_interval
+        # (通知类型, file_node_id) -> 最新的进度
+        self.pending: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pid: int | None = None
+
+    def process(self, notify_type: type[FileProcessNotify], file_node_id: str, percent: float):
+        self._put(notify_type.__name__, [file_node_id], percent)
+
+    def file_status(self, file_node_ids: list[str], status):
+        self._send_now(AcceptedNotifyRequest(type=FileStatusNotify.__name__,
+                                             data=dict(file_node_ids=[str(i) for i in file_node_ids], status=status)))
+
+    def revision_md(self, file_node_ids: list[str], not_in_vector_store: bool):
+        self._send_now(AcceptedNotifyRequest(type=RevisionMdNotify.__name__,
+                                             data=dict(file_node_ids=[str(i) for i in file_node_ids],
+                                                       not_in_vector_store=not_in_vector_store)))
+
+    def _put(self, notify_type: str, file_node_ids: list[str], value: float):
+        with self.lock:
+            self._check_fork()
+            for file_node_id in file_node_ids:
+                key = (notify_type, str(file_node_id))
+                self.pending.pop(key, None)
+                self.pending[key] = value
+
+    def _check_fork(self):
+        # fork 出的进程没有父进程的发送线程
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pending.clear()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"send notifies to {self.batch_url} failed: {e}")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, OrderedDict()
+            if pending:
+                self._send(self._to_notifies(pending))
+
+    def _send_now(self, notify: AcceptedNotifyRequest):
+        # 先发出之前的进度，再立即发送状态，不会晚于之后直接写入目录服务的状态
+        with self.flush_lock:
+            with self.lock:
+                self._check_fork()
+                pending, self.pending = self.pending, OrderedDict()
+            self._send(self._to_notifies(pending) + [notify])
+
+    def _send(self, notifies: list[AcceptedNotifyRequest]):
+        if config.notify_redis_url:
+            # 直接更新文件状态并发布给所有 web worker，不经过 accept_notify
+            apply_notifies(notifies)
+            add_topics(notifies)
+            publish_notifies(notifies)
+        else:
+            get_session().post(self.batch_url, json=[notify.model_dump() for notify in notifies])
+
+    @staticmethod
+    def _to_notifies(pending: OrderedDict[tuple[str, str], float]) -> list[AcceptedNotifyRequest]:
+        return [AcceptedNotifyRequest(type=notify_type, data=dict(file_node_id=file_node_id, percent=percent))
+                for (notify_type, file_node_id), percent in pending.items()]
+
+
+_clients: dict[str, NotifyClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_notify_client(notify_url: str) -> NotifyClient:
+    with _clients_lock:
+        if notify_url not in _clients:
+            _clients[notify_url] = NotifyClient(notify_url)
+        return _clients[notify_url]
+
+
+@atexit.register
+def flush_notify_clients():
+    for client in list(_clients.values()):
+        try:
+            client.flush()
+        except Exception as e:
+            print(f"send notifies to {client.batch_url} failed: {e}")
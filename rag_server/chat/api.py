@@ -10,7 +10,7 @@ from starlette.responses import StreamingResponse
 
 from app.model import App
 from chat.model import ChatRequest, ChatSession, ChatRecord, ChatSessionType
-from chat.rag import retrieve_by_chat_records, augment_query_by_kb_context
+from chat.rag import retrieve_by_chat_records, augment_query_by_kb_context, format_search_result
 from db.database import get_session
 from user_role_group_mgr.auth import get_current_user
 from user_role_group_mgr.model import User
@@ -43,7 +43,7 @@ def chat(request: ChatRequest,
     app = cast(App, db.get_one(App, request.app_id))
     if app.kb_ids:
         search_result = retrieve_by_chat_records(chat_session.records, app.kb_ids)
-        kb_context = [result.text for result in search_result]
+        kb_context = [format_search_result(result) for result in search_result]
         augmented_query = augment_query_by_kb_context(request.input_text, kb_context)
     else:
         augmented_query = None
@@ -37,6 +37,16 @@ def retrieve_by_chat_records(records: list[ChatRecord], kb_ids: list[str]) -> li
     return search_results
 
 
+def format_search_result(result: SearchResult) -> str:
+    """Context of a search result for the prompt, with its section and pages if chunked along the structure."""
+    source = ' > '.join(result.headings)
+    if result.page_start is not None:
+        pages = f"p.{result.page_start}" if result.page_start == result.page_end \
+            else f"p.{result.page_start}-{result.page_end}"
+        source = f"{source} ({pages})" if source else pages
+    return f"[{source}]\n{result.text}" if source else result.text
+
+
 def augment_query_by_kb_context(query: str, context: list[str]) -> str:
     prompt_template = """
     你是一名专家。以下是用户的提问，以及从知识库中检索到的一些相关上下文信息。请结合这些上下文信息，为用户提供全面且有帮助的回答。
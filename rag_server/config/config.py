@@ -2,6 +2,7 @@ import json
 from pathlib import Path
 
 from pydantic import BaseModel
+from rag_file_sdk import client
 
 
 class Config(BaseModel):
@@ -10,12 +11,33 @@ class Config(BaseModel):
     celery_port: int
     sql_url: str
     file_server_url: str
+    file_server_timeout: float = 60  # 请求文件服务等 http 服务的超时（秒）
+    file_server_retries: int = 3  # 连接失败的重试次数
+    file_server_pool_size: int = 32  # 每个进程到每个 http 服务的最大连接数
+    file_server_openapi_refresh_interval: float = 300  # 重新获取文件服务 OpenAPI 文档的间隔（秒）
     tenants_files_root_dir: str
     default_pdf_parser_url: str
-    default_splitter_url: str
+    file_server_base_dir: str | None = None  # 与文件服务同机或共享挂载时，文件服务存储目录的本地路径
+    default_parse_job_url: str = 'http://localhost:9902/api/file_parser/jobs'
+    parse_job_poll_interval: int = 5  # celery 轮询解析任务的间隔（秒）
+    parse_job_timeout: float = 3600  # 从提交起解析任务未完成的最长时间（秒），超过则文件解析失败
     milvus_uri: str
     embedding_model_name_or_path: str
     docling_model_path: str
+    pdf_parse_workers: int | None = None  # None 表示使用全部 cpu 核
+    parse_job_expire: int = 3600  # 已结束的解析任务保留时长（秒）
+    pdf_shard_pages: int = 0  # 大 pdf 按页分片并行解析时每片的页数，0 表示不分片
+    pdf_shard_min_pages: int = 200  # 页数达到该值的 pdf 才分片解析
+    pdf_stream_pages: bool = False  # 未分片的 pdf 按页批次转换，每批转换完即输出这些页
+    parse_cache_bucket: str = '__parse_cache__'  # 按文件内容哈希缓存解析结果的 bucket
+    parse_cache_max_size: int | None = 10 * 1024 ** 3  # 解析缓存的最大字节数
+    parse_cache_max_age: float | None = 30 * 24 * 3600  # 解析缓存的最长保留时间（秒）
+    ingest_queue_size: int = 8  # 流水线入库时各阶段之间队列的最大长度
+    ingest_embed_batch_size: int = 64  # 流水线入库时每次计算向量的文本块数
+    ingest_page_poll_interval: float = 1  # 流水线入库时轮询已解析页的间隔（秒）
+    ingest_load_workers: int = 4  # 多个文件入库时并行读取和切分的线程数
+    notify_flush_interval: float = 0.5  # 进度等通知合并后批量发送的间隔（秒）
+    notify_redis_url: str | None = None  # 设置后通知经 redis pub/sub 分发给所有 web worker
 
     @property
     def accept_nodify_url(self):
@@ -25,3 +47,8 @@ class Config(BaseModel):
 config_path = Path(__file__).parent / 'config.json'
 with open(config_path) as f:
     config = Config(**json.load(f))
+
+# 所有进程（包括 celery worker 和解析子进程）都在导入配置时设置 rag_file_sdk 的连接池
+client.configure(timeout=config.file_server_timeout,
+                 retries=config.file_server_retries,
+                 pool_size=config.file_server_pool_size)
@@ -1,4 +1,4 @@
-from sqlalchemy import text
+from sqlalchemy import inspect, literal, text
 from sqlmodel import create_engine, Session
 
 from config.config import config
@@ -11,8 +11,36 @@ import chat.model
 engine = create_engine(config.sql_url, echo=False)
 
 
+def add_missing_columns():
+    """
+    create_all only creates missing tables, add the columns new to an existing table
+    with their default value, e.g. the ingest settings of KbConfig.
+    """
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in table_names:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                if column.default is not None and column.default.is_scalar:
+                    default = literal(column.default.arg, column.type).compile(
+                        engine, compile_kwargs={'literal_binds': True})
+                    ddl += f' DEFAULT {default}'
+                    if not column.nullable:
+                        # sqlite 只允许带默认值的非空列加到已有表
+                        ddl += ' NOT NULL'
+                print(ddl)
+                conn.execute(text(ddl))
+
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    add_missing_columns()
     # only for sqlite
     with engine.connect() as conn:
         conn.execute(text("PRAGMA foreign_keys=ON"))
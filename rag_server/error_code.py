@@ -4,11 +4,13 @@ from fastapi import HTTPException
 
 
 class ErrorCode(Enum):
+    FILE_NOT_EXISTS = (522, "file not exists")  # 文件服务的错误码
     LOGIN_FAILED = (540, "login failed")
     INVALID_TOKEN = (541, "invalid token")
     UNIQUE_CONSTRAINT_FAILED = (542, "unique constraint failed")
     NO_PERMISSION = (543, "no permission")
     KB_USED_BY_APP = (544, "kb used by app")
+    PARSE_JOB_NOT_EXISTS = (545, "parse job not exists")
 
     def __init__(self, code, desc):
         self.code = code
@@ -1,8 +1,6 @@
-import asyncio
 import json
 from typing import cast, Annotated, Literal
 
-import requests
 from fastapi import APIRouter, Depends, UploadFile, Form, HTTPException
 from rag_file_sdk.dir_api import DirMgr
 from rag_file_sdk.file_api import Bucket
@@ -16,7 +14,10 @@ from file_mgr.crud import FileMgrApi
 from file_mgr.model import FileMgrConfig, ParseFileRequest, FilesRequest
 from kb.crud import get_kb_dir_name, get_kb_config
 from store_retriever_server.crud import get_kb_vecstore_name
+from store_retriever_server.model import Chunk
 from store_retriever_server.store_engine import StoreEngine
+from store_retriever_server.structure_splitter import split_pages
+from store_retriever_server.text_splitter import get_text_splitter
 
 router = APIRouter(prefix="/file_mgr", tags=["file manager"])
 
@@ -52,8 +53,9 @@ def add_files(files: list[UploadFile],
               action: Annotated[Literal['override', 'ignore'], Form()] = 'ignore',
               db: Session = Depends(get_session)) -> UploadResponseOfDir:
     file_name_list = [file.filename for file in files]
-    content_list = [asyncio.run(file.read()) for file in files]
-    resp = dir_mgr.add_files(file_name_list, content_list, parent_id, action)
+    # 上传的文件已暂存在磁盘，按块转发给文件服务，不读入内存
+    resp = dir_mgr.add_files(file_name_list, [file.file for file in files], parent_id, action)
+    kb_config = None
     if kb_id:
         kb_config = get_kb_config(kb_id, db)
         parse_after_upload = kb_config.parse_after_upload
@@ -61,7 +63,7 @@ def add_files(files: list[UploadFile],
         file_mgr_config = get_file_mgr_config(top_group_id, db)
         parse_after_upload = file_mgr_config.parse_after_upload
     if parse_after_upload:
-        FileMgrApi.parse_files(resp.file_nodes, top_group_id, kb_id)
+        FileMgrApi.parse_files(resp.file_nodes, top_group_id, kb_id, kb_config, resp.sha256s)
     return resp
 
 
@@ -80,7 +82,7 @@ def delete_files(request: FilesRequest) -> None:
     bucket = Bucket(config.file_server_url, dir_name)
     all_files = dir_mgr.get_files_by_ids(request.file_node_ids)
     bucket.delete_files([file.storage_key + ".md.json" for file in all_files])
-    bucket.delete_files([file.storage_key + ".md.split.json" for file in all_files])
+    bucket.delete_files([file.storage_key + suffix for file in all_files for suffix in (".md.split.json", ".md.chunks.json")])
 
     dir_mgr.delete_files(request.file_node_ids)
 
@@ -96,18 +98,23 @@ def update_file(file: UploadFile,
     else:
         dir_name = FileMgrApi.get_top_group_dir_name(top_group_id)
     bucket = Bucket(config.file_server_url, dir_name)
-    content = asyncio.run(file.read())
-    bucket.set_file(file.filename, content, True)
+    bucket.set_file(file.filename, file.file, True)
 
     # 删除旧 split 文件
     if file.filename.endswith(".md.json"):
         bucket.delete_file(f"{file_node_id}.md.split.json")
+        bucket.delete_file(f"{file_node_id}.md.chunks.json")
         dir_mgr.update_files([file_node_id], {'revision_not_in_vector_store': True})
 
 
 @router.post("/parse_files")
-def parse_files_api(request: ParseFileRequest) -> None:
-    FileMgrApi.parse_files(dir_mgr.get_files_by_ids(request.file_node_ids), request.top_group_id, request.kb_id)
+def parse_files_api(request: ParseFileRequest,
+                    db: Session = Depends(get_session)) -> None:
+    kb_config = get_kb_config(request.kb_id, db) if request.kb_id else None
+    FileMgrApi.parse_files(dir_mgr.get_files_by_ids(request.file_node_ids),
+                           request.top_group_id,
+                           request.kb_id,
+                           kb_config)
 
 
 @router.get('/split_list')
@@ -119,7 +126,21 @@ def get_split_list(kb_id: str, file_node_id: str) -> list[str]:
     except HTTPException as e:
         assert e.status_code == 522
         md_list = cast(list[str], json.loads(bucket.get_str(file_node.storage_key + ".md.json")))
-        resp = requests.post(config.default_splitter_url, json={"text": '\n'.join(md_list)})
-        split_data = cast(list[str], resp.json())
+        split_data = get_text_splitter().split_text('\n'.join(md_list))
         bucket.set_str(file_node.storage_key + ".md.split.json", json.dumps(split_data))
     return split_data
+
+
+@router.get('/chunk_list')
+def get_chunk_list(kb_id: str, file_node_id: str) -> list[Chunk]:
+    """Chunks of the file along its structure, with heading breadcrumbs and pages."""
+    file_node = dir_mgr.get_files_by_ids([file_node_id])[0]
+    bucket = Bucket(config.file_server_url, get_kb_dir_name(kb_id))
+    try:
+        chunks = [Chunk(**item) for item in json.loads(bucket.get_str(file_node.storage_key + ".md.chunks.json"))]
+    except HTTPException as e:
+        assert e.status_code == 522
+        md_list = cast(list[str], json.loads(bucket.get_str(file_node.storage_key + ".md.json")))
+        chunks = split_pages(md_list)
+        bucket.set_str(file_node.storage_key + ".md.chunks.json", json.dumps([chunk.model_dump() for chunk in chunks]))
+    return chunks
@@ -1,15 +1,21 @@
 import json
+import uuid
 from typing import cast, Tuple
 
 import requests
 from fastapi import HTTPException
-from rag_file_sdk.dir_api import DirMgr
+from rag_file_sdk.dir_api import DirMgr, FilePatchBatch
 from rag_file_sdk.file_api import Bucket
 from rag_file_server.dir.model import FileNode, FileStatus, CeleryTaskType
 from sqlmodel import Session, select
 
+from celery_task.model import send_file_status_notify
 from config.config import config
 from file_mgr.model import FileMgrConfig
+from file_parser.model import ParseProfile
+from file_parser.native_parser import get_native_parser, parse_native
+from file_parser.parse_cache import parse_cache
+from kb.model import KbConfig
 
 dir_mgr = DirMgr(config.file_server_url)
 
@@ -54,10 +60,20 @@ class FileMgrApi:
         db.commit()
 
     @staticmethod
-    def parse_files(file_nodes: list[FileNode], top_group_id: int, kb_id: str | None) -> None:
+    def parse_files(file_nodes: list[FileNode],
+                    top_group_id: int,
+                    kb_id: str | None,
+                    kb_config: KbConfig | None = None,
+                    file_hashes: dict[str, str] | None = None) -> None:
+        """
+        Files of kb are parsed with the parse profile of kb_config,
+        and also split and added into the vector store if kb_config.ingest_pipeline.
+        file_hashes are the sha256 of the files by name if known, e.g. computed on upload.
+        """
         from kb.crud import get_kb_dir_name
+        from store_retriever_server.crud import get_kb_vecstore_name
 
-        from celery_task.celery_app import parse_pdf
+        from celery_task.celery_app import parse_pdf, ingest_file
         bucket_name = get_kb_dir_name(kb_id) if kb_id else FileMgrApi.get_top_group_dir_name(top_group_id)
         file_key_list = [file_node.storage_key for file_node in file_nodes]
         file_node_ids = [str(file_node.id) for file_node in file_nodes]
@@ -67,9 +83,55 @@ class FileMgrApi:
         # dir_mgr.update_files_status(file_node_ids, FileStatus.PARSING)
         # dir_mgr.update_celery_task(file_node_ids, task_id, CeleryTaskType.PARSE)
 
-        # 每个文件独立任务
-        dir_mgr.update_parse_percent(file_node_ids, 0)
-        for file_key, file_node_id in zip(file_key_list, file_node_ids):
-            dir_mgr.update_files_status([file_node_id], FileStatus.PARSING)
-            task_id = parse_pdf.delay(bucket_name, [file_key], [file_node_id]).id
-            dir_mgr.update_celery_task([file_node_id], task_id, CeleryTaskType.PARSE)
+        profile = kb_config.parse_profile if kb_config else ParseProfile.STANDARD
+        ingest_pipeline = kb_id is not None and kb_config is not None and kb_config.ingest_pipeline
+
+        # 每个文件独立任务，任务 id 预先生成，所有文件的进度、状态和任务在提交任务前一次更新
+        patches = FilePatchBatch()
+        tasks = []  # (任务, args, kwargs, task_id)
+        for file_node, file_key, file_node_id in zip(file_nodes, file_key_list, file_node_ids):
+            patches.add(file_node_id, parse_percent=0)
+            # 文本类文件直接解析，不经过 docling
+            if native_parser := get_native_parser(file_node.name):
+                try:
+                    parse_native(bucket_name, file_key, native_parser)
+                except Exception as e:
+                    print(f"parse {file_node.name} failed: {e}")
+                    send_file_status_notify(config.accept_nodify_url, [file_node_id], FileStatus.PARSE_FAILED)
+                    continue
+                parsed, cache_key = True, None
+            else:
+                # 相同内容的文件已解析过，直接链接缓存的解析结果
+                cache_key = parse_cache.cache_key(bucket_name, file_key, profile,
+                                                  (file_hashes or {}).get(file_node.name))
+                parsed = parse_cache.link_to(cache_key, bucket_name, file_key)
+            if parsed:
+                patches.add(file_node_id, parse_percent=100)
+
+            if ingest_pipeline:
+                task_id = str(uuid.uuid4())
+                patches.add(file_node_id,
+                            to_vector_store_percent=0,
+                            status=FileStatus.TO_VECTOR_STORE_ING if parsed else FileStatus.PARSING,
+                            celery_task_id=task_id,
+                            celery_task_type=CeleryTaskType.TO_VECTOR_STORE if parsed else CeleryTaskType.PARSE)
+                tasks.append((ingest_file,
+                              (kb_id, get_kb_vecstore_name(kb_id), bucket_name, file_key, file_node_id),
+                              dict(cache_key=cache_key, parsed=parsed, profile=profile.value,
+                                   structure_chunking=kb_config.structure_chunking),
+                              task_id))
+                continue
+
+            if parsed:
+                send_file_status_notify(config.accept_nodify_url, [file_node_id], FileStatus.PARSED)
+                continue
+
+            task_id = str(uuid.uuid4())
+            patches.add(file_node_id, status=FileStatus.PARSING, celery_task_id=task_id,
+                        celery_task_type=CeleryTaskType.PARSE)
+            tasks.append((parse_pdf, (bucket_name, [file_key], [file_node_id]),
+                          dict(cache_keys=[cache_key], profile=profile.value), task_id))
+
+        dir_mgr.patch_files(patches.patches())
+        for task, args, kwargs, task_id in tasks:
+            task.apply_async(args, kwargs, task_id=task_id)
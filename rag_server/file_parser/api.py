@@ -1,12 +1,35 @@
 from fastapi import APIRouter
 
-from file_parser.docling_wrapper.docling import docling_pdf_to_markdown
-from file_parser.model import ParseFileRequest
+from file_parser.model import ParseFileRequest, ParseJob, ParseJobRequest
+from file_parser.parse_pool import parse_pool
 
 router = APIRouter(prefix="/file_parser", tags=["file parser"])
 
 
 @router.post("/pdf_to_markdown/docling")
 def pdf_to_markdown_by_docling(request: ParseFileRequest) -> list[list[str]]:
-    return [docling_pdf_to_markdown(url, file_node_id, request.notify_url)
+    # 所有文件同时提交到进程池并行解析，结果按请求顺序返回
+    jobs = [parse_pool.submit(url, file_node_id, request.notify_url, profile=request.profile)
             for url, file_node_id in zip(request.file_urls, request.file_node_ids)]
+    return parse_pool.wait([job.job_id for job in jobs])
+
+
+@router.post("/jobs", response_model=ParseJob)
+def submit_parse_job(request: ParseJobRequest) -> ParseJob:
+    """Submit a parse job and return immediately, the parsed pages are written into the bucket of the file."""
+    return parse_pool.submit(request.file_url,
+                             request.file_node_id,
+                             request.notify_url,
+                             request.bucket_name,
+                             request.file_key,
+                             request.profile)
+
+
+@router.get("/jobs", response_model=list[ParseJob])
+def list_parse_jobs() -> list[ParseJob]:
+    return parse_pool.list_jobs()
+
+
+@router.get("/jobs/{job_id}", response_model=ParseJob)
+def get_parse_job(job_id: str) -> ParseJob:
+    return parse_pool.get_job(job_id)
@@ -0,0 +1,80 @@
+import hashlib
+from pathlib import Path
+
+from docling_core.types import Document as DsDocument
+from fastapi import HTTPException
+from pydantic import BaseModel
+from rag_file_sdk.file_api import Bucket
+
+from config.config import config
+
+
+def file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class CheckpointManifest(BaseModel):
+    file_hash: str
+    shard_pages: int
+    page_count: int
+    shard_starts: list[int] = []
+
+
+class ParseCheckpoint:
+    """
+    Checkpoints of a file parsed in page shards, saved in the bucket of the file:
+    each converted shard is saved as `{file_key}.ckpt_{start}.doc.json` (docling document, so the shards can
+    still be merged before exporting markdown), and `{file_key}.ckpt.json` is the manifest of saved shards.
+    A retried parse of the same file content resumes from the saved shards.
+    """
+
+    def __init__(self, bucket_name: str, file_key: str):
+        self.bucket = Bucket(config.file_server_url, bucket_name)
+        self.file_key = file_key
+        self.manifest: CheckpointManifest | None = None
+
+    @property
+    def manifest_key(self) -> str:
+        return self.file_key + '.ckpt.json'
+
+    def shard_key(self, start: int) -> str:
+        return f"{self.file_key}.ckpt_{start}.doc.json"
+
+    def load(self, file_hash: str, shard_pages: int, page_count: int) -> dict[int, DsDocument]:
+        """Load the saved shards, return dict of shard start page -> document."""
+        try:
+            manifest = CheckpointManifest.model_validate_json(self.bucket.get_str(self.manifest_key))
+        except HTTPException as e:
+            assert e.status_code == 522
+            manifest = None
+
+        if manifest and (manifest.file_hash, manifest.shard_pages, manifest.page_count) == \
+                (file_hash, shard_pages, page_count):
+            self.manifest = manifest
+            if not manifest.shard_starts:
+                return {}
+            contents = self.bucket.get_strs([self.shard_key(start) for start in manifest.shard_starts])
+            return {start: DsDocument.model_validate_json(content)
+                    for start, content in zip(manifest.shard_starts, contents)}
+
+        # 文件内容或分片方式变化，之前的检查点作废
+        if manifest:
+            self.clear(manifest)
+        self.manifest = CheckpointManifest(file_hash=file_hash, shard_pages=shard_pages, page_count=page_count)
+        return {}
+
+    def save(self, start: int, doc: DsDocument):
+        assert self.manifest is not None
+        self.bucket.set_file(self.shard_key(start), doc.model_dump_json(by_alias=True).encode('utf-8'), True)
+        self.manifest.shard_starts.append(start)
+        self.bucket.set_file(self.manifest_key, self.manifest.model_dump_json().encode('utf-8'), True)
+
+    def clear(self, manifest: CheckpointManifest | None = None):
+        manifest = manifest or self.manifest
+        if manifest:
+            self.bucket.delete_files([self.manifest_key] + [self.shard_key(start) for start in manifest.shard_starts])
+        self.manifest = None
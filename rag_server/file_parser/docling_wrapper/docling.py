@@ -1,6 +1,12 @@
+import tempfile
 import threading
 import time
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue
+from typing import Iterator
 
+from docling.datamodel.pipeline_options import PipelineOptions
 from docling.document_converter import DocumentConverter
 from docling_core.types.doc.base import Figure, BaseText
 from docling_core.types import Ref, Table
@@ -8,10 +14,161 @@ from tabulate import tabulate
 from docling_core.types import Document as DsDocument
 
 from config.config import config
-from file_parser.docling_wrapper.document_convertor import MyDocumentConverter
+from file_parser.docling_wrapper.document_convertor import MyDocumentConverter, download_source
+from file_parser.docling_wrapper.profile import get_pipeline_options
+from file_parser.model import ParseProfile
+from file_parser.progress import ParseProgress
 
 
-def export_to_markdown(  # noqa: C901
+class MarkdownExporter:
+    """
+    Export docling documents to markdown of each page.
+    The title, repeated text and embedded caption state is kept across exports, so the documents of consecutive
+    page batches can be exported one by one as they are converted (a caption is only dropped as embedded
+    when its table or figure is in the same or an earlier batch).
+    """
+
+    def __init__(self,
+                 delim: str = "\n\n",
+                 main_text_labels: list[str] = [
+                     "title",
+                     "subtitle-level-1",
+                     "paragraph",
+                     "caption",
+                     "table",
+                     "figure",
+                 ],
+                 strict_text: bool = False,
+                 image_placeholder: str = "<!-- image -->"):
+        self.delim = delim
+        self.main_text_labels = main_text_labels
+        self.strict_text = strict_text
+        self.image_placeholder = image_placeholder
+        self.has_title = False
+        self.prev_text = ""
+        self.embedded_captions: set[str] = set()
+
+    def export(self,  # noqa: C901
+               doc: DsDocument,
+               main_text_start: int = 0,
+               main_text_stop: int | None = None) -> list[str]:
+        md_texts: list[list[str]] = [[] for _ in range(doc.file_info.num_pages)]
+
+        if doc.main_text is not None:
+            # collect all captions embedded in table and figure objects
+            # to avoid repeating them
+            for orig_item in doc.main_text[main_text_start:main_text_stop]:
+                item = (
+                    doc._resolve_ref(orig_item)
+                    if isinstance(orig_item, Ref)
+                    else orig_item
+                )
+                if item is None:
+                    continue
+
+                if (
+                        isinstance(item, (Table, Figure))
+                        and item.text
+                        and item.obj_type in self.main_text_labels
+                ):
+                    self.embedded_captions.add(item.text)
+
+            # serialize document to markdown
+            for orig_item in doc.main_text[main_text_start:main_text_stop]:
+                markdown_text = ""
+
+                item = (
+                    doc._resolve_ref(orig_item)
+                    if isinstance(orig_item, Ref)
+                    else orig_item
+                )
+                if item is None:
+                    continue
+
+                item_type = item.obj_type
+                if isinstance(item, BaseText) and item_type in self.main_text_labels:
+                    text = item.text
+
+                    # skip captions of they are embedded in the actual
+                    # floating object
+                    if item_type == "caption" and text in self.embedded_captions:
+                        continue
+
+                    # ignore repeated text
+                    if self.prev_text == text or text is None:
+                        continue
+                    else:
+                        self.prev_text = text
+
+                    # first title match
+                    if item_type == "title" and not self.has_title:
+                        if self.strict_text:
+                            markdown_text = f"{text}"
+                        else:
+                            markdown_text = f"# {text}"
+                        self.has_title = True
+
+                    # secondary titles
+                    elif item_type in {"title", "subtitle-level-1"} or (
+                            self.has_title and item_type == "title"
+                    ):
+                        if self.strict_text:
+                            markdown_text = f"{text}"
+                        else:
+                            markdown_text = f"## {text}"
+
+                    # normal text
+                    else:
+                        markdown_text = text
+
+                elif (
+                        isinstance(item, Table)
+                        and item.data
+                        and item_type in self.main_text_labels
+                ):
+
+                    md_table = ""
+                    table = []
+                    for row in item.data:
+                        tmp = []
+                        for col in row:
+                            tmp.append(col.text)
+                        table.append(tmp)
+
+                    if len(table) > 1 and len(table[0]) > 0:
+                        try:
+                            md_table = tabulate(
+                                table[1:], headers=table[0], tablefmt="github"
+                            )
+                        except ValueError:
+                            md_table = tabulate(
+                                table[1:],
+                                headers=table[0],
+                                tablefmt="github",
+                                disable_numparse=True,
+                            )
+
+                    markdown_text = ""
+                    if item.text:
+                        markdown_text = item.text
+                    if not self.strict_text:
+                        markdown_text += "\n" + md_table
+
+                elif isinstance(item, Figure) and item_type in self.main_text_labels:
+                    markdown_text = ""
+                    if item.text:
+                        markdown_text = item.text
+                    if not self.strict_text:
+                        markdown_text += f"\n{self.image_placeholder}"
+
+                if markdown_text:
+                    page_index = item.prov[0].page - 1
+                    md_texts[page_index].append(markdown_text)
+
+        return [self.delim.join(item) for item in md_texts]
+
+
+def export_to_markdown(
         self: DsDocument,
         delim: str = "\n\n",
         main_text_start: int = 0,
@@ -27,130 +184,46 @@ def export_to_markdown(  # noqa: C901
         strict_text: bool = False,
         image_placeholder: str = "<!-- image -->",
 ) -> list[str]:
-    has_title = False
-    prev_text = ""
-    md_texts: list[list[str]] = [[] for _ in range(self.file_info.num_pages)]
-
-    if self.main_text is not None:
-        # collect all captions embedded in table and figure objects
-        # to avoid repeating them
-        embedded_captions = set()
-        for orig_item in self.main_text[main_text_start:main_text_stop]:
-            item = (
-                self._resolve_ref(orig_item)
-                if isinstance(orig_item, Ref)
-                else orig_item
-            )
-            if item is None:
-                continue
-
-            if (
-                    isinstance(item, (Table, Figure))
-                    and item.text
-                    and item.obj_type in main_text_labels
-            ):
-                embedded_captions.add(item.text)
-
-        # serialize document to markdown
-        for orig_item in self.main_text[main_text_start:main_text_stop]:
-            markdown_text = ""
-
-            item = (
-                self._resolve_ref(orig_item)
-                if isinstance(orig_item, Ref)
-                else orig_item
-            )
-            if item is None:
-                continue
-
-            item_type = item.obj_type
-            if isinstance(item, BaseText) and item_type in main_text_labels:
-                text = item.text
-
-                # skip captions of they are embedded in the actual
-                # floating object
-                if item_type == "caption" and text in embedded_captions:
-                    continue
-
-                # ignore repeated text
-                if prev_text == text or text is None:
-                    continue
-                else:
-                    prev_text = text
+    exporter = MarkdownExporter(delim, main_text_labels, strict_text, image_placeholder)
+    return exporter.export(self, main_text_start, main_text_stop)
 
-                # first title match
-                if item_type == "title" and not has_title:
-                    if strict_text:
-                        markdown_text = f"{text}"
-                    else:
-                        markdown_text = f"# {text}"
-                    has_title = True
 
-                # secondary titles
-                elif item_type in {"title", "subtitle-level-1"} or (
-                        has_title and item_type == "title"
-                ):
-                    if strict_text:
-                        markdown_text = f"{text}"
-                    else:
-                        markdown_text = f"## {text}"
-
-                # normal text
-                else:
-                    markdown_text = text
-
-            elif (
-                    isinstance(item, Table)
-                    and item.data
-                    and item_type in main_text_labels
-            ):
-
-                md_table = ""
-                table = []
-                for row in item.data:
-                    tmp = []
-                    for col in row:
-                        tmp.append(col.text)
-                    table.append(tmp)
-
-                if len(table) > 1 and len(table[0]) > 0:
-                    try:
-                        md_table = tabulate(
-                            table[1:], headers=table[0], tablefmt="github"
-                        )
-                    except ValueError:
-                        md_table = tabulate(
-                            table[1:],
-                            headers=table[0],
-                            tablefmt="github",
-                            disable_numparse=True,
-                        )
+# 每种 pipeline options 一个 converter，模型只加载一次
+converters: dict[str, MyDocumentConverter] = {}
+lock = threading.Lock()
 
-                markdown_text = ""
-                if item.text:
-                    markdown_text = item.text
-                if not strict_text:
-                    markdown_text += "\n" + md_table
 
-            elif isinstance(item, Figure) and item_type in main_text_labels:
-                markdown_text = ""
-                if item.text:
-                    markdown_text = item.text
-                if not strict_text:
-                    markdown_text += f"\n{image_placeholder}"
+def get_converter(pipeline_options: PipelineOptions = PipelineOptions()) -> MyDocumentConverter:
+    key = pipeline_options.model_dump_json()
+    with lock:
+        if key not in converters:
+            print('*' * 20, config.docling_model_path, key)
+            converters[key] = MyDocumentConverter(artifacts_path=config.docling_model_path,
+                                                  pipeline_options=pipeline_options)
+            # converter = DocumentConverter()
+    return converters[key]
 
-            if markdown_text:
-                page_index = item.prov[0].page - 1
-                md_texts[page_index].append(markdown_text)
 
-    return [delim.join(item) for item in md_texts]
+@contextmanager
+def open_source(source: str, profile: ParseProfile) -> Iterator[tuple[Path, MyDocumentConverter]]:
+    """Get the local path of the source, and the converter of the parse profile chosen by the pdf content."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_path = download_source(source, Path(temp_dir))
+        yield local_path, get_converter(get_pipeline_options(profile, local_path))
 
 
-converter: MyDocumentConverter | None = None
-lock = threading.Lock()
+def docling_pdf_to_document(source: str,
+                            progress: ParseProgress,
+                            profile: ParseProfile = ParseProfile.STANDARD) -> DsDocument:
+    """Convert a pdf (or a page shard of it) to docling document, used by page shard parsing."""
+    with open_source(source, profile) as (local_path, converter_):
+        return converter_.convert_single_(local_path, progress).output
 
 
-def docling_pdf_to_markdown(source: str, file_node_id: str, notify_url: str) -> list[str]:
+def docling_pdf_to_markdown(source: str,
+                            file_node_id: str,
+                            notify_url: str,
+                            profile: ParseProfile = ParseProfile.STANDARD) -> list[str]:
     # from celery_task.model import AcceptedNotifyRequest
     # from celery_task.model import ParseFileNotify
     # notify_request = AcceptedNotifyRequest(type='ParseFileNotify',
@@ -159,20 +232,36 @@ def docling_pdf_to_markdown(source: str, file_node_id: str, notify_url: str) ->
     # import requests
     # requests.post(notify_url, json=notify_request.model_dump())
 
-    start = time.time()
-    global converter
-    with lock:
-        if converter is None:
-            print('*' * 20, config.docling_model_path)
-            converter = MyDocumentConverter(artifacts_path=config.docling_model_path)
-            # converter = DocumentConverter()
-    print("-------- used 1: ", time.time() - start)
-    start = time.time()
-    result = converter.convert_single_(source, file_node_id, notify_url)
-    # result = converter.convert_single(source)
-    print("-------- used 2: ", time.time() - start)
+    with open_source(source, profile) as (local_path, converter_):
+        start = time.time()
+        result = converter_.convert_single_(local_path, ParseProgress(notify_url, file_node_id))
+        # result = converter.convert_single(source)
+        print("-------- used 2: ", time.time() - start)
     start = time.time()
     ret = export_to_markdown(result.output)
     print("-------- used 3: ", time.time() - start)
-    start = time.time()
     return ret
+
+
+def docling_pdf_to_markdown_stream(source: str,
+                                   progress: ParseProgress,
+                                   profile: ParseProfile = ParseProfile.STANDARD) -> Iterator[tuple[int, list[str]]]:
+    """Convert a pdf page batch by page batch, yield (start page index, markdown of the pages) of each batch."""
+    exporter = MarkdownExporter()
+    with open_source(source, profile) as (local_path, converter_):
+        for start, count, doc in converter_.convert_stream_(local_path, progress):
+            yield start, exporter.export(doc)[start:start + count]
+
+
+def docling_pdf_stream_to_queue(source: str,
+                                file_node_id: str,
+                                notify_url: str,
+                                queue: Queue,
+                                profile: ParseProfile = ParseProfile.STANDARD):
+    """Run in a worker process: put (start page index, markdown of the pages) of each batch into the queue,
+    then None when finished, the exception is raised by the future."""
+    try:
+        for item in docling_pdf_to_markdown_stream(source, ParseProgress(notify_url, file_node_id), profile):
+            queue.put(item)
+    finally:
+        queue.put(None)
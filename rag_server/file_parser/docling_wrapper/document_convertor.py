@@ -3,24 +3,59 @@ import tempfile
 import time
 import traceback
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
-import requests
 from docling.datamodel.base_models import ConversionStatus, Page, ErrorItem, DoclingComponentType
 from docling.datamodel.document import InputDocument, ConversionResult, DocumentConversionInput
 from docling.datamodel.settings import settings
 from docling.document_converter import DocumentConverter, _log
 from docling.utils.utils import chunkify
+from docling_core.types import Document as DsDocument
 from pydantic import AnyHttpUrl, TypeAdapter, ValidationError
-
-from celery_task.model import ParseFileNotify, send_process_notify
+from rag_file_sdk.client import get_session
+
+from file_parser.progress import ParseProgress
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def download_source(source: Path | AnyHttpUrl | str,
+                    temp_dir: Path,
+                    default_filename: str = DocumentConverter._default_download_filename) -> Path:
+    """Download the source into temp_dir if it is an url, otherwise return it as a local path without copy."""
+    try:
+        http_url: AnyHttpUrl = TypeAdapter(AnyHttpUrl).validate_python(source)
+        res = get_session().get(http_url, stream=True)
+        res.raise_for_status()
+        fname = None
+        # try to get filename from response header
+        if cont_disp := res.headers.get("Content-Disposition"):
+            for par in cont_disp.strip().split(";"):
+                # currently only handling directive "filename" (not "*filename")
+                if (split := par.split("=")) and split[0].strip() == "filename":
+                    fname = "=".join(split[1:]).strip().strip("'\"") or None
+                    break
+        # otherwise, use name from URL:
+        if fname is None:
+            fname = Path(http_url.path).name or default_filename
+        local_path = temp_dir / fname
+        with open(local_path, "wb") as f:
+            for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):  # using 1-MB chunks
+                f.write(chunk)
+    except ValidationError:
+        try:
+            local_path = TypeAdapter(Path).validate_python(source)
+        except ValidationError:
+            raise ValueError(
+                f"Unexpected file path type encountered: {type(source)}"
+            )
+    return local_path
 
 
 class MyDocumentConverter(DocumentConverter):
 
     def convert_(self, input: DocumentConversionInput,
-                 file_node_id: str,
-                 notify_url: str) -> Iterable[ConversionResult]:
+                 progress: ParseProgress) -> Iterable[ConversionResult]:
 
         for input_batch in chunkify(
                 input.docs(pdf_backend=self.pdf_backend), settings.perf.doc_batch_size
@@ -33,21 +68,17 @@ class MyDocumentConverter(DocumentConverter):
             #   yield from pool.map(self.process_document, input_batch)
 
             # Note: Pdfium backend is not thread-safe, thread pool usage was disabled.
-            yield from map(functools.partial(self._process_document_,
-                                             file_node_id=file_node_id,
-                                             notify_url=notify_url),
+            yield from map(functools.partial(self._process_document_, progress=progress),
                            input_batch)
 
     def convert_single_(self,
                         source: Path | AnyHttpUrl | str,
-                        file_node_id: str,
-                        notify_url: str) -> ConversionResult:
+                        progress: ParseProgress) -> ConversionResult:
         """Convert a single document.
 
         Args:
             source (Path | AnyHttpUrl | str): The PDF input source. Can be a path or URL.
-            file_node_id:
-            notify_url:
+            progress: Reporter of the converted pages.
         Raises:
             ValueError: If source is of unexpected type.
             RuntimeError: If conversion fails.
@@ -57,34 +88,9 @@ class MyDocumentConverter(DocumentConverter):
 
         """
         with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                http_url: AnyHttpUrl = TypeAdapter(AnyHttpUrl).validate_python(source)
-                res = requests.get(http_url, stream=True)
-                res.raise_for_status()
-                fname = None
-                # try to get filename from response header
-                if cont_disp := res.headers.get("Content-Disposition"):
-                    for par in cont_disp.strip().split(";"):
-                        # currently only handling directive "filename" (not "*filename")
-                        if (split := par.split("=")) and split[0].strip() == "filename":
-                            fname = "=".join(split[1:]).strip().strip("'\"") or None
-                            break
-                # otherwise, use name from URL:
-                if fname is None:
-                    fname = Path(http_url.path).name or self._default_download_filename
-                local_path = Path(temp_dir) / fname
-                with open(local_path, "wb") as f:
-                    for chunk in res.iter_content(chunk_size=1024):  # using 1-KB chunks
-                        f.write(chunk)
-            except ValidationError:
-                try:
-                    local_path = TypeAdapter(Path).validate_python(source)
-                except ValidationError:
-                    raise ValueError(
-                        f"Unexpected file path type encountered: {type(source)}"
-                    )
+            local_path = download_source(source, Path(temp_dir), self._default_download_filename)
             conv_inp = DocumentConversionInput.from_paths(paths=[local_path])
-            conv_res_iter = self.convert_(conv_inp, file_node_id, notify_url)
+            conv_res_iter = self.convert_(conv_inp, progress)
             conv_res: ConversionResult = next(conv_res_iter)
         if conv_res.status not in {
             ConversionStatus.SUCCESS,
@@ -93,10 +99,91 @@ class MyDocumentConverter(DocumentConverter):
             raise RuntimeError(f"Conversion failed with status: {conv_res.status}")
         return conv_res
 
+    def convert_stream_(self,
+                        source: Path | AnyHttpUrl | str,
+                        progress: ParseProgress) -> Iterator[tuple[int, int, DsDocument]]:
+        """Convert a single document batch by batch.
+
+        Args:
+            source (Path | AnyHttpUrl | str): The PDF input source. Can be a path or URL.
+            progress: Reporter of the converted pages.
+        Raises:
+            ValueError: If source is of unexpected type.
+            RuntimeError: If conversion fails.
+
+        Returns:
+            Iterator of (start page index, page count, document of the pages) for each page batch,
+            yielded as soon as the batch is assembled.
+
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            local_path = download_source(source, Path(temp_dir), self._default_download_filename)
+            conv_inp = DocumentConversionInput.from_paths(paths=[local_path])
+            in_doc: InputDocument = next(iter(conv_inp.docs(pdf_backend=self.pdf_backend)))
+            if not in_doc.valid:
+                raise RuntimeError(f"Conversion failed with status: {ConversionStatus.FAILURE}")
+
+            _log.info(f"Processing document {in_doc.file.name} in stream")
+            pages = [Page(page_no=i) for i in range(0, in_doc.page_count)]
+            try:
+                for page_batch in chunkify(pages, settings.perf.page_batch_size):
+                    batch_res = ConversionResult(input=in_doc)
+                    batch_res.pages = self._convert_page_batch_(in_doc, page_batch)
+                    for page in batch_res.pages:
+                        if not page._backend.is_valid():
+                            _log.info(f"Page {page.page_no} failed to parse.")
+                    self._assemble_doc(batch_res)
+
+                    start = batch_res.pages[0].page_no
+                    progress.update(start + len(batch_res.pages), len(pages))
+                    yield start, len(batch_res.pages), batch_res.output
+            finally:
+                # Free up mem resources of PDF backend
+                in_doc._backend.unload()
+
+    def _convert_page_batch_(self, in_doc: InputDocument, page_batch: Iterable[Page]) -> list[Page]:
+        # Pipeline
+
+        # 1. Initialise the page resources
+        init_pages = map(
+            functools.partial(self._initialize_page, in_doc), page_batch
+        )
+
+        # 2. Populate page image
+        pages_with_images = map(
+            functools.partial(self._populate_page_images, in_doc), init_pages
+        )
+
+        # 3. Populate programmatic page cells
+        pages_with_cells = map(
+            functools.partial(self._parse_page_cells, in_doc),
+            pages_with_images,
+        )
+
+        # 4. Run pipeline stages
+        pipeline_pages = self.model_pipeline.apply(pages_with_cells)
+
+        # 5. Assemble page elements (per page)
+        assembled_pages = self.page_assemble_model(pipeline_pages)
+
+        # exhaust assembled_pages
+        batch_assembled_pages = []
+        for assembled_page in assembled_pages:
+            # Free up mem resources before moving on with next batch
+
+            # Remove page images (can be disabled)
+            if self.assemble_options.images_scale is None:
+                assembled_page._image_cache = {}
+
+            # Unload backend
+            assembled_page._backend.unload()
+
+            batch_assembled_pages.append(assembled_page)
+        return batch_assembled_pages
+
     def _process_document_(self,
                            in_doc: InputDocument,
-                           file_node_id: str,
-                           notify_url: str) -> ConversionResult:
+                           progress: ParseProgress) -> ConversionResult:
         start_doc_time = time.time()
         conv_res = ConversionResult(input=in_doc)
 
@@ -117,49 +204,14 @@ class MyDocumentConverter(DocumentConverter):
             for page_batch in chunkify(conv_res.pages, settings.perf.page_batch_size):
                 iter_count += 1
                 start_pb_time = time.time()
-                # Pipeline
-
-                # 1. Initialise the page resources
-                init_pages = map(
-                    functools.partial(self._initialize_page, in_doc), page_batch
-                )
-
-                # 2. Populate page image
-                pages_with_images = map(
-                    functools.partial(self._populate_page_images, in_doc), init_pages
-                )
-
-                # 3. Populate programmatic page cells
-                pages_with_cells = map(
-                    functools.partial(self._parse_page_cells, in_doc),
-                    pages_with_images,
-                )
-
-                # 4. Run pipeline stages
-                pipeline_pages = self.model_pipeline.apply(pages_with_cells)
-
-                # 5. Assemble page elements (per page)
-                assembled_pages = self.page_assemble_model(pipeline_pages)
-
-                # exhaust assembled_pages
-                for assembled_page in assembled_pages:
-                    # Free up mem resources before moving on with next batch
-
-                    # Remove page images (can be disabled)
-                    if self.assemble_options.images_scale is None:
-                        assembled_page._image_cache = {}
-
-                    # Unload backend
-                    assembled_page._backend.unload()
-
-                    all_assembled_pages.append(assembled_page)
+                all_assembled_pages.extend(self._convert_page_batch_(in_doc, page_batch))
 
                 end_pb_time = time.time() - start_pb_time
                 _log.info(f"Finished converting page batch time={end_pb_time:.3f}")
 
                 # 通知解析进度
-                percent = min(100, 100 * iter_count * settings.perf.page_batch_size / len(conv_res.pages))
-                send_process_notify(notify_url, ParseFileNotify, file_node_id, percent)
+                progress.update(min(iter_count * settings.perf.page_batch_size, len(conv_res.pages)),
+                                len(conv_res.pages))
 
             # Free up mem resources of PDF backend
             in_doc._backend.unload()
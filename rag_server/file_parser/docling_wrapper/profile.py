@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pypdfium2 as pdfium
+from docling.datamodel.pipeline_options import PipelineOptions, TableStructureOptions, TableFormerMode
+
+from file_parser.docling_wrapper.shard import pdfium_lock
+from file_parser.model import ParseProfile
+
+# 抽样检查的页数，以及有文本层的页至少包含的字符数
+TEXT_LAYER_SAMPLE_PAGES = 8
+TEXT_LAYER_MIN_CHARS = 32
+
+
+def has_text_layer(path: Path,
+                   sample_pages: int = TEXT_LAYER_SAMPLE_PAGES,
+                   min_chars: int = TEXT_LAYER_MIN_CHARS) -> bool:
+    """Whether the pdf is born-digital: every sampled page has at least min_chars characters in its text layer."""
+    with pdfium_lock:
+        return _has_text_layer(path, sample_pages, min_chars)
+
+
+def _has_text_layer(path: Path, sample_pages: int, min_chars: int) -> bool:
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page_count = len(pdf)
+        if page_count == 0:
+            return False
+        step = max(1, page_count // sample_pages)
+        for index in range(0, page_count, step)[:sample_pages]:
+            page = pdf[index]
+            text_page = page.get_textpage()
+            try:
+                if text_page.count_chars() < min_chars:
+                    return False
+            finally:
+                text_page.close()
+                page.close()
+        return True
+    finally:
+        pdf.close()
+
+
+def get_pipeline_options(profile: ParseProfile, path: Path) -> PipelineOptions:
+    """
+    Docling pipeline options of the parse profile, OCR of the standard profile is skipped for born-digital pdf.
+    The layout model always runs, it can't be disabled in docling pipeline.
+    """
+    if profile == ParseProfile.FAST:
+        return PipelineOptions(do_ocr=False, do_table_structure=False)
+    if profile == ParseProfile.FULL:
+        return PipelineOptions(do_ocr=True,
+                               do_table_structure=True,
+                               table_structure_options=TableStructureOptions(mode=TableFormerMode.ACCURATE))
+    return PipelineOptions(do_ocr=not has_text_layer(path), do_table_structure=True)
@@ -0,0 +1,80 @@
+import threading
+from pathlib import Path
+
+import pypdfium2 as pdfium
+from docling_core.types import Document as DsDocument, Ref
+
+# 有页码信息的文档元素列表，以及可以被 main_text 中的 Ref 引用的列表
+_PAGED_FIELDS = ['main_text', 'tables', 'figures', 'equations', 'footnotes',
+                 'page_headers', 'page_footers', 'page_dimensions', 'bitmaps']
+_REF_FIELDS = ['tables', 'figures', 'equations', 'footnotes']
+
+# pdfium 不是线程安全的，即使是不同的文档也不能在多个线程中同时调用，同一进程中的调用都要持有该锁
+pdfium_lock = threading.Lock()
+
+
+def get_page_count(path: Path) -> int:
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+
+def split_pdf(path: Path, shard_pages: int, out_dir: Path) -> list[tuple[int, Path]]:
+    """Split the pdf into shards of shard_pages pages, return list of (start page index, shard path)."""
+    with pdfium_lock:
+        return _split_pdf(path, shard_pages, out_dir)
+
+
+def _split_pdf(path: Path, shard_pages: int, out_dir: Path) -> list[tuple[int, Path]]:
+    pdf = pdfium.PdfDocument(path)
+    shards = []
+    try:
+        page_count = len(pdf)
+        for start in range(0, page_count, shard_pages):
+            shard = pdfium.PdfDocument.new()
+            shard.import_pages(pdf, list(range(start, min(start + shard_pages, page_count))))
+            shard_path = out_dir / f"{path.stem}.shard_{start}.pdf"
+            shard.save(shard_path)
+            shard.close()
+            shards.append((start, shard_path))
+    finally:
+        pdf.close()
+    return shards
+
+
+def _shift_pages(item, page_offset: int):
+    if hasattr(item, 'page') and item.page is not None:
+        item.page += page_offset
+    prov = getattr(item, 'prov', None)
+    for p in (prov if isinstance(prov, list) else [prov] if prov else []):
+        p.page += page_offset
+
+
+def merge_documents(docs: list[DsDocument], page_offsets: list[int], num_pages: int) -> DsDocument:
+    """
+    Merge the documents converted from page shards into one document in page order.
+    Page numbers are shifted by the shard's page offset, and refs in main_text are re-indexed.
+    """
+    merged = docs[0].model_copy(deep=True, update={field: None for field in _PAGED_FIELDS})
+    merged.file_info.num_pages = num_pages
+
+    for doc, page_offset in zip(docs, page_offsets):
+        doc = doc.model_copy(deep=True)
+        ref_offsets = {field: len(getattr(merged, field) or []) for field in _REF_FIELDS}
+
+        for field in _PAGED_FIELDS:
+            items = getattr(doc, field)
+            if not items:
+                continue
+            for item in items:
+                if isinstance(item, Ref):
+                    _, arr, index = item.ref.split('/')
+                    item.ref = f"#/{arr}/{int(index) + ref_offsets.get(arr, 0)}"
+                else:
+                    _shift_pages(item, page_offset)
+            setattr(merged, field, (getattr(merged, field) or []) + items)
+
+    return merged
@@ -1,7 +1,46 @@
+from enum import Enum
+
 from pydantic import BaseModel
 
 
+class ParseProfile(str, Enum):
+    FAST = 'fast'  # 只取文本层，不做 OCR 和表格结构识别
+    STANDARD = 'standard'  # 识别表格结构，只对没有文本层的 pdf 做 OCR
+    FULL = 'full'  # OCR 和精确表格结构识别
+
+
 class ParseFileRequest(BaseModel):
     file_urls: list[str]
     file_node_ids: list[str]
     notify_url: str
+    profile: ParseProfile = ParseProfile.STANDARD
+
+
+class ParseJobRequest(BaseModel):
+    file_node_id: str
+    notify_url: str
+    bucket_name: str
+    file_key: str
+    file_url: str | None = None  # 默认由 bucket_name 和 file_key 得到
+    profile: ParseProfile = ParseProfile.STANDARD
+
+
+class ParseJobStatus(str, Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+
+
+class ParseJob(BaseModel):
+    job_id: str
+    file_url: str | None = None
+    file_node_id: str
+    bucket_name: str | None = None
+    file_key: str | None = None
+    profile: ParseProfile = ParseProfile.STANDARD
+    status: ParseJobStatus = ParseJobStatus.PENDING
+    pages_done: int = 0
+    create_time: float = 0
+    finish_time: float | None = None
+    error: str | None = None
@@ -0,0 +1,215 @@
+import csv
+import io
+import mimetypes
+import zipfile
+from html.parser import HTMLParser
+from typing import Callable
+from xml.etree import ElementTree
+
+from rag_file_sdk.file_api import Bucket
+from tabulate import tabulate
+
+from config.config import config
+from file_parser.result_writer import ParseResultWriter
+from file_parser.storage import get_local_path
+
+# 文件内容 -> 每页的 markdown，与 pdf 解析结果 .md.json 的结构相同
+NativeParser = Callable[[bytes], list[str]]
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+CSV_PAGE_ROWS = 100  # csv 每页的行数，每页都带表头
+
+mimetypes.add_type('text/markdown', '.md')
+mimetypes.add_type('text/markdown', '.markdown')
+mimetypes.add_type(DOCX_MIME_TYPE, '.docx')
+
+_parsers: dict[str, NativeParser] = {}
+
+
+def register_parser(*mime_types: str) -> Callable[[NativeParser], NativeParser]:
+    def decorator(parser: NativeParser) -> NativeParser:
+        for mime_type in mime_types:
+            _parsers[mime_type] = parser
+        return parser
+
+    return decorator
+
+
+def get_native_parser(file_name: str) -> NativeParser | None:
+    """Parser of the file by its mime type, None if the file should be parsed by docling."""
+    mime_type, _ = mimetypes.guess_type(file_name)
+    return _parsers.get(mime_type) if mime_type else None
+
+
+def parse_native(bucket_name: str, file_key: str, parser: NativeParser) -> list[str]:
+    """Parse the file in the bucket and write the result into `{file_key}.md.json`."""
+    if local_path := get_local_path(bucket_name, file_key):
+        content = local_path.read_bytes()
+    else:
+        content = Bucket(config.file_server_url, bucket_name).get_file(file_key)
+    md_list = parser(content)
+    ParseResultWriter(bucket_name, file_key).finish(md_list)
+    return md_list
+
+
+def decode_text(content: bytes) -> str:
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return content.decode('utf-8', errors='replace')
+
+
+def to_md_table(rows: list[list[str]]) -> str:
+    if not rows:
+        return ''
+    width = max(len(row) for row in rows)
+    rows = [row + [''] * (width - len(row)) for row in rows]
+    return tabulate(rows[1:], headers=rows[0], tablefmt="github", disable_numparse=True)
+
+
+@register_parser('text/plain', 'text/markdown')
+def parse_text(content: bytes) -> list[str]:
+    # 换页符分页
+    return decode_text(content).split('\f')
+
+
+@register_parser('text/csv')
+def parse_csv(content: bytes) -> list[str]:
+    text = decode_text(content)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096])
+    except csv.Error:
+        dialect = csv.excel
+    rows = list(csv.reader(io.StringIO(text), dialect))
+    if not rows:
+        return ['']
+    header, rows = rows[0], rows[1:]
+    return [to_md_table([header] + rows[start:start + CSV_PAGE_ROWS])
+            for start in range(0, max(len(rows), 1), CSV_PAGE_ROWS)]
+
+
+class _HtmlToMarkdown(HTMLParser):
+    _BLOCK_TAGS = {'p', 'div', 'section', 'article', 'blockquote', 'pre', 'ul', 'ol', 'br', 'hr', 'tr'}
+    _SKIP_TAGS = {'script', 'style', 'head', 'title', 'noscript'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: list[str] = []
+        self.text: list[str] = []
+        self.prefix = ''
+        self.skip_depth = 0
+        self.table: list[list[str]] | None = None
+        self.cell: list[str] | None = None
+
+    def flush(self):
+        text = ' '.join(''.join(self.text).split())
+        if text:
+            self.blocks.append(self.prefix + text)
+        self.text = []
+        self.prefix = ''
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'table':
+            self.flush()
+            self.table = []
+        elif tag == 'tr' and self.table is not None:
+            self.table.append([])
+        elif tag in ('td', 'th') and self.table is not None:
+            self.cell = []
+        elif len(tag) == 2 and tag[0] == 'h' and tag[1].isdigit():
+            self.flush()
+            self.prefix = '#' * int(tag[1]) + ' '
+        elif tag == 'li':
+            self.flush()
+            self.prefix = '- '
+        elif tag in self._BLOCK_TAGS:
+            self.flush()
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'table' and self.table is not None:
+            self.blocks.append(to_md_table([row for row in self.table if row]))
+            self.table = None
+        elif tag in ('td', 'th') and self.cell is not None:
+            if self.table:
+                self.table[-1].append(' '.join(''.join(self.cell).split()))
+            self.cell = None
+        elif tag in self._BLOCK_TAGS or tag == 'li' or (len(tag) == 2 and tag[0] == 'h' and tag[1].isdigit()):
+            self.flush()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.cell is not None:
+            self.cell.append(data)
+        elif self.table is None:
+            self.text.append(data)
+
+
+@register_parser('text/html', 'application/xhtml+xml')
+def parse_html(content: bytes) -> list[str]:
+    parser = _HtmlToMarkdown()
+    parser.feed(decode_text(content))
+    parser.close()
+    parser.flush()
+    return ['\n\n'.join(parser.blocks)]
+
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def _docx_paragraph(paragraph: ElementTree.Element) -> tuple[str, bool]:
+    """Markdown of the paragraph, and whether a page break is before it."""
+    texts = []
+    page_break = False
+    for element in paragraph.iter():
+        if element.tag == _W + 't':
+            texts.append(element.text or '')
+        elif element.tag == _W + 'tab':
+            texts.append('\t')
+        elif element.tag == _W + 'br':
+            if element.get(_W + 'type') == 'page':
+                page_break = True
+            else:
+                texts.append('\n')
+        elif element.tag == _W + 'lastRenderedPageBreak':
+            page_break = True
+    text = ''.join(texts).strip()
+
+    style = paragraph.find(f'{_W}pPr/{_W}pStyle')
+    style_id = style.get(_W + 'val', '') if style is not None else ''
+    if text:
+        if style_id == 'Title':
+            text = '# ' + text
+        elif style_id.lower().startswith('heading') and style_id[7:].isdigit():
+            text = '#' * int(style_id[7:]) + ' ' + text
+        elif paragraph.find(f'{_W}pPr/{_W}numPr') is not None:
+            text = '- ' + text
+    return text, page_break
+
+
+@register_parser(DOCX_MIME_TYPE)
+def parse_docx(content: bytes) -> list[str]:
+    with zipfile.ZipFile(io.BytesIO(content)) as docx:
+        root = ElementTree.fromstring(docx.read('word/document.xml'))
+    body = root.find(_W + 'body')
+    pages: list[list[str]] = [[]]
+    for element in body if body is not None else []:
+        if element.tag == _W + 'p':
+            text, page_break = _docx_paragraph(element)
+            if page_break and pages[-1]:
+                pages.append([])
+            if text:
+                pages[-1].append(text)
+        elif element.tag == _W + 'tbl':
+            rows = [[' '.join(''.join(t.text or '' for t in cell.iter(_W + 't')).split())
+                     for cell in row.iter(_W + 'tc')]
+                    for row in element.iter(_W + 'tr')]
+            if table := to_md_table(rows):
+                pages[-1].append(table)
+    return ['\n\n'.join(page) for page in pages]
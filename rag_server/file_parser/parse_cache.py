@@ -0,0 +1,62 @@
+from functools import cache
+from importlib.metadata import version, PackageNotFoundError
+
+from fastapi import HTTPException
+from rag_file_sdk.file_api import Bucket
+
+from config.config import config
+from file_parser.model import ParseProfile
+
+
+@cache
+def get_parser_version() -> str:
+    try:
+        return f"docling_{version('docling')}"
+    except PackageNotFoundError:
+        return "docling"
+
+
+class ParseCache:
+    """
+    Content addressed cache of parse results in the file server:
+    `{sha256 of file}.{parser version}.{parse profile}.md.json` in the cache bucket,
+    linked into the bucket of the parsed file.
+    """
+
+    def __init__(self, bucket_name: str = config.parse_cache_bucket):
+        self.bucket = Bucket(config.file_server_url, bucket_name)
+        self._bucket_created = False
+
+    def cache_key(self, bucket_name: str, file_key: str, profile: ParseProfile = ParseProfile.STANDARD,
+                  file_hash: str | None = None) -> str:
+        """file_hash is the sha256 of the file, it is computed by the file server if not given."""
+        file_hash = file_hash or Bucket(config.file_server_url, bucket_name).get_sha256(file_key)
+        return f"{file_hash}.{get_parser_version()}.{profile.value}.md.json"
+
+    def link_to(self, cache_key: str, bucket_name: str, file_key: str) -> bool:
+        """Link the cached parse result to `{file_key}.md.json`, return False if not cached."""
+        try:
+            Bucket(config.file_server_url, bucket_name).link_file(file_key + '.md.json',
+                                                                  self.bucket.bucket_name,
+                                                                  cache_key)
+        except HTTPException as e:
+            assert e.status_code == 522
+            return False
+        return True
+
+    def store(self, cache_key: str, bucket_name: str, file_key: str):
+        self._create_bucket()
+        self.bucket.link_file(cache_key, bucket_name, file_key + '.md.json')
+        self.bucket.evict_files(config.parse_cache_max_size, config.parse_cache_max_age)
+
+    def _create_bucket(self):
+        if self._bucket_created:
+            return
+        try:
+            self.bucket.create_bucket()
+        except HTTPException as e:
+            assert e.status_code == 525  # bucket already exist
+        self._bucket_created = True
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,255 @@
+import multiprocessing
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from multiprocessing.managers import SyncManager
+from pathlib import Path
+from typing import Callable
+
+from docling_core.types import Document as DsDocument
+
+from config.config import config
+from error_code import raise_exception, ErrorCode
+from file_parser.checkpoint import ParseCheckpoint, file_sha256
+from file_parser.docling_wrapper.docling import docling_pdf_to_markdown, docling_pdf_to_document, \
+    docling_pdf_stream_to_queue, export_to_markdown, MarkdownExporter
+from file_parser.docling_wrapper.document_convertor import download_source
+from file_parser.docling_wrapper.shard import get_page_count, split_pdf, merge_documents
+from file_parser.model import ParseJob, ParseJobStatus, ParseProfile
+from file_parser.progress import ParseProgress
+from file_parser.result_writer import ParseResultWriter
+from file_parser.storage import resolve_source
+
+
+class ParsePool:
+    """
+    Parse pdf files in a pool of processes, each worker process holds its own docling converter.
+    Pdfium backend is not thread-safe, so processes are used instead of threads.
+
+    Each job is coordinated by a thread: small pdf is converted by one worker process,
+    big pdf (at least shard_min_pages pages) is split into page shards converted by several worker processes,
+    the pages of each shard are exported once it and the shards before it are converted,
+    then the shard documents are merged in page order before exported to markdown as the result.
+    Converted shards of a job writing into a bucket are checkpointed, so a resubmitted job of the same file
+    only converts the shards not finished before.
+    With stream_pages, a pdf converted by one worker process is exported page batch by page batch,
+    the pages are relayed back through a manager queue as soon as each batch is converted.
+    """
+
+    def __init__(self,
+                 max_workers: int | None = None,
+                 job_expire: float = 3600,
+                 shard_pages: int = 0,
+                 shard_min_pages: int = 200,
+                 stream_pages: bool = False):
+        self.max_workers = max_workers
+        self.job_expire = job_expire
+        self.shard_pages = shard_pages
+        self.shard_min_pages = shard_min_pages
+        self.stream_pages = stream_pages
+        self._executor: ProcessPoolExecutor | None = None
+        self._manager: SyncManager | None = None
+        self._job_executor = ThreadPoolExecutor(thread_name_prefix='parse_job')
+        self._jobs: dict[str, tuple[ParseJob, Future]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn 避免 fork 复制父进程中的模型和线程状态
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    @property
+    def manager(self) -> SyncManager:
+        """Manager process holding the page progress shared by shards and the queues of streamed pages."""
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context('spawn').Manager()
+            return self._manager
+
+    def submit(self,
+               file_url: str | None,
+               file_node_id: str,
+               notify_url: str,
+               bucket_name: str | None = None,
+               file_key: str | None = None,
+               profile: ParseProfile = ParseProfile.STANDARD) -> ParseJob:
+        """
+        Submit a parse job, if bucket_name and file_key are given, the file is opened in place when the file server
+        storage is visible from this host (downloaded by url otherwise), and the result is written into the bucket.
+        """
+        self._remove_expired_jobs()
+        job = ParseJob(job_id=str(uuid.uuid4()),
+                       file_url=file_url,
+                       file_node_id=file_node_id,
+                       bucket_name=bucket_name,
+                       file_key=file_key,
+                       profile=profile,
+                       create_time=time.time())
+        future = self._job_executor.submit(self._run_job, job, notify_url)
+        with self._lock:
+            self._jobs[job.job_id] = (job, future)
+        future.add_done_callback(lambda f: self._on_job_done(job, f))
+        return job
+
+    def get_job(self, job_id: str) -> ParseJob:
+        with self._lock:
+            item = self._jobs.get(job_id)
+        if item is None:
+            raise_exception(ErrorCode.PARSE_JOB_NOT_EXISTS, job_id)
+        job, future = item
+        if job.status == ParseJobStatus.PENDING and future.running():
+            job.status = ParseJobStatus.RUNNING
+        return job
+
+    def list_jobs(self) -> list[ParseJob]:
+        with self._lock:
+            job_ids = list(self._jobs.keys())
+        return [self.get_job(job_id) for job_id in job_ids]
+
+    def get_result(self, job_id: str, timeout: float | None = None) -> list[str]:
+        self.get_job(job_id)
+        with self._lock:
+            _, future = self._jobs[job_id]
+        return future.result(timeout)
+
+    def wait(self, job_ids: list[str], timeout: float | None = None) -> list[list[str]]:
+        return [self.get_result(job_id, timeout) for job_id in job_ids]
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            manager, self._manager = self._manager, None
+        self._job_executor.shutdown(wait=False, cancel_futures=True)
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if manager:
+            manager.shutdown()
+
+    def _run_job(self, job: ParseJob, notify_url: str) -> list[str]:
+        writer = ParseResultWriter(job.bucket_name, job.file_key) if job.bucket_name else None
+        checkpoint = ParseCheckpoint(job.bucket_name, job.file_key) if job.bucket_name else None
+
+        def on_pages(start: int, md_list: list[str]):
+            if writer:
+                writer.write_pages(start, md_list)
+            job.pages_done = start + len(md_list)
+
+        md_list = self._convert(job, notify_url, on_pages, checkpoint)
+        if writer:
+            writer.finish(md_list)
+        if checkpoint:
+            checkpoint.clear()
+        return md_list
+
+    def _convert(self,
+                 job: ParseJob,
+                 notify_url: str,
+                 on_pages: Callable[[int, list[str]], None],
+                 checkpoint: ParseCheckpoint | None = None) -> list[str]:
+        source = resolve_source(job.bucket_name, job.file_key, job.file_url)
+        if not self.shard_pages:
+            return self._convert_whole(source, job, notify_url, on_pages)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            local_path = download_source(source, Path(temp_dir))
+            page_count = get_page_count(local_path)
+            if page_count < max(self.shard_min_pages, self.shard_pages + 1):
+                return self._convert_whole(str(local_path), job, notify_url, on_pages)
+
+            shards = split_pdf(local_path, self.shard_pages, Path(temp_dir))
+            page_offsets = [start for start, _ in shards]
+            saved_docs = checkpoint.load(file_sha256(local_path), self.shard_pages, page_count) if checkpoint else {}
+            shared_pages = self.manager.dict()
+            for start in saved_docs:
+                shared_pages[start] = min(self.shard_pages, page_count - start)
+            futures = {start: self.executor.submit(docling_pdf_to_document,
+                                                   str(shard_path),
+                                                   ParseProgress(notify_url, job.file_node_id,
+                                                                 page_count, shared_pages, start),
+                                                   job.profile)
+                       for start, shard_path in shards if start not in saved_docs}
+
+            def get_doc(start_: int) -> DsDocument:
+                if start_ in saved_docs:
+                    return saved_docs[start_]
+                doc_ = futures[start_].result()
+                if checkpoint:
+                    checkpoint.save(start_, doc_)
+                return doc_
+
+            docs = []
+            # 按页序等待分片，前面的分片都完成后即只导出新分片的页，分片内页码从 0 开始
+            exporter = MarkdownExporter()
+            try:
+                for start in page_offsets:
+                    docs.append(get_doc(start))
+                    on_pages(start, exporter.export(docs[-1]))
+            except Exception:
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+        return export_to_markdown(merge_documents(docs, page_offsets, page_count))
+
+    def _convert_whole(self,
+                       source: str,
+                       job: ParseJob,
+                       notify_url: str,
+                       on_pages: Callable[[int, list[str]], None]) -> list[str]:
+        if not self.stream_pages:
+            md_list = self.executor.submit(docling_pdf_to_markdown,
+                                           source, job.file_node_id, notify_url, job.profile).result()
+            on_pages(0, md_list)
+            return md_list
+
+        page_queue = self.manager.Queue()
+        future = self.executor.submit(docling_pdf_stream_to_queue,
+                                      source, job.file_node_id, notify_url, page_queue, job.profile)
+        md_list = []
+        while True:
+            try:
+                item = page_queue.get(timeout=1)
+            except queue.Empty:
+                # 工作进程异常退出时不会放入结束标记
+                if future.done() and future.exception() is not None:
+                    break
+                continue
+            if item is None:
+                break
+            start, pages = item
+            on_pages(start, pages)
+            md_list.extend(pages)
+        future.result()
+        return md_list
+
+    def _on_job_done(self, job: ParseJob, future: Future):
+        job.finish_time = time.time()
+        if future.cancelled():
+            job.status = ParseJobStatus.FAILURE
+            job.error = 'cancelled'
+        elif future.exception() is not None:
+            job.status = ParseJobStatus.FAILURE
+            job.error = repr(future.exception())
+        else:
+            job.status = ParseJobStatus.SUCCESS
+
+    def _remove_expired_jobs(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [job_id for job_id, (job, _) in self._jobs.items()
+                           if job.finish_time and now - job.finish_time > self.job_expire]:
+                self._jobs.pop(job_id)
+
+
+parse_pool = ParsePool(config.pdf_parse_workers,
+                       config.parse_job_expire,
+                       config.pdf_shard_pages,
+                       config.pdf_shard_min_pages,
+                       config.pdf_stream_pages)
@@ -0,0 +1,31 @@
+from typing import MutableMapping
+
+from celery_task.model import ParseFileNotify, send_process_notify
+
+
+class ParseProgress:
+    """
+    Report the parse percent of a file.
+    When a file is parsed in page shards by several processes, all shards share the `shared_pages` dict
+    (a multiprocessing manager dict), so every shard reports the percent of the whole file.
+    """
+
+    def __init__(self,
+                 notify_url: str,
+                 file_node_id: str,
+                 total_pages: int | None = None,
+                 shared_pages: MutableMapping[int, int] | None = None,
+                 shard_key: int = 0):
+        self.notify_url = notify_url
+        self.file_node_id = file_node_id
+        self.total_pages = total_pages
+        self.shared_pages = shared_pages
+        self.shard_key = shard_key
+
+    def update(self, pages_done: int, page_count: int):
+        total_pages = self.total_pages or page_count
+        if self.shared_pages is not None:
+            self.shared_pages[self.shard_key] = pages_done
+            pages_done = sum(self.shared_pages.values())
+        percent = min(100, 100 * pages_done / total_pages)
+        send_process_notify(self.notify_url, ParseFileNotify, self.file_node_id, percent)
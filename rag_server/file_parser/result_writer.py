@@ -0,0 +1,39 @@
+import json
+
+from rag_file_sdk.file_api import Bucket
+
+from config.config import config
+
+
+class ParseResultWriter:
+    """
+    Write the parsed markdown of a file into its bucket.
+    Pages are written as `{file_key}.page_{index}.md` as soon as they are produced,
+    and replaced by the whole `{file_key}.md.json` when the file is finished.
+    """
+
+    def __init__(self, bucket_name: str, file_key: str):
+        self.bucket = Bucket(config.file_server_url, bucket_name)
+        self.file_key = file_key
+        self.page_keys: list[str] = []
+
+    @staticmethod
+    def page_key(file_key: str, page_index: int) -> str:
+        return f"{file_key}.page_{page_index}.md"
+
+    @property
+    def md_key(self) -> str:
+        return self.file_key + '.md.json'
+
+    def write_pages(self, start: int, md_list: list[str]):
+        if not md_list:
+            return
+        keys = [self.page_key(self.file_key, start + i) for i in range(len(md_list))]
+        self.bucket.set_files(keys, [md.encode('utf-8') for md in md_list], override=True)
+        self.page_keys.extend(keys)
+
+    def finish(self, md_list: list[str]):
+        self.bucket.set_file(self.md_key, json.dumps(md_list).encode('utf-8'), override=True)
+        if self.page_keys:
+            self.bucket.delete_files(self.page_keys)
+            self.page_keys = []
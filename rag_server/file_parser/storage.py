@@ -0,0 +1,25 @@
+from pathlib import Path
+
+from config.config import config
+
+
+def get_file_url(bucket_name: str, file_key: str) -> str:
+    return f"{config.file_server_url}/api/file/file/{bucket_name}/{file_key}"
+
+
+def get_local_path(bucket_name: str, file_key: str) -> Path | None:
+    """Local path of a file in the file server storage, None if the storage is not visible from this host."""
+    if not config.file_server_base_dir:
+        return None
+    path = Path(config.file_server_base_dir) / bucket_name / file_key
+    return path if path.is_file() else None
+
+
+def resolve_source(bucket_name: str | None, file_key: str | None, file_url: str | None) -> str:
+    """Open the file in place if possible, otherwise download it by url."""
+    if bucket_name and file_key:
+        if local_path := get_local_path(bucket_name, file_key):
+            return str(local_path)
+        return file_url or get_file_url(bucket_name, file_key)
+    assert file_url
+    return file_url
@@ -1,10 +1,18 @@
-from typing import cast, Sequence, Tuple
+import asyncio
+import re
+from contextlib import asynccontextmanager
+from typing import cast, Sequence, Tuple, AsyncContextManager, Callable
 
+import anyio
 from fastapi import APIRouter, Request, FastAPI, Depends, HTTPException
 import httpx
 from fastapi.openapi.utils import get_openapi
+from rag_file_sdk.client import create_async_client
 from starlette.responses import StreamingResponse
 
+# 逐跳头由每一跳的连接自己处理，不转发；host 由 httpx 按原服务的地址设置
+_HOP_HEADERS = {'host', 'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+
 
 # 获取原服务的 OpenAPI 文档并合并
 def add_proxy(app: FastAPI,
@@ -12,29 +20,55 @@ def add_proxy(app: FastAPI,
               prefix: str = '/',
               dependencies: list[Depends] | None = None,
               prefix_without_dep: str | None = None,
-              no_dep_method_paths: Sequence[Tuple[str, str]] = ()):
+              no_dep_method_paths: Sequence[Tuple[str, str]] = (),
+              openapi_refresh_interval: float = 300) -> Callable[[], AsyncContextManager[None]]:
+    """
+    Proxy the requests under prefix to source_url, the request and response bodies are streamed without buffering.
+    Return the lifespan of the proxy, the pooled client to source_url is only available in it,
+    and the OpenAPI schema of source_url is merged into the schema of app and refreshed in it.
+    """
+    client: httpx.AsyncClient | None = None
     prefix_without_dep = prefix_without_dep or prefix + '_no_dep'
     router = APIRouter(prefix=prefix, dependencies=dependencies)
     router_without_dep = APIRouter(prefix=prefix_without_dep)
 
-    def has_no_dep_method_path(method: str, path: str):
-        for method_, path_ in no_dep_method_paths:
-            if method_.lower() == method.lower() and path.startswith(path_):
-                return True
+    # 每个方法的路径前缀预先编译为一个正则，代理请求时不再逐个比较
+    no_dep_prefixes: dict[str, list[str]] = {}
+    for method_, path_ in no_dep_method_paths:
+        no_dep_prefixes.setdefault(method_.lower(), []).append(re.escape(path_))
+    no_dep_patterns = {method_: re.compile('|'.join(paths_)) for method_, paths_ in no_dep_prefixes.items()}
 
-        return False
+    def has_no_dep_method_path(method: str, path: str):
+        pattern = no_dep_patterns.get(method.lower())
+        return pattern is not None and pattern.match(path) is not None
 
     async def proxy_request(prefix_: str, request: Request):
-        async with httpx.AsyncClient() as client:
-            path = request.url.path[len(prefix_):]
-            response = await client.request(request.method,
-                                            f"{source_url}{path}",
-                                            headers=request.headers.raw,
-                                            data=await request.body(),
-                                            params=request.query_params)
-
-        return StreamingResponse(response.aiter_bytes(),  # 异步迭代字节流
-                                 headers=response.headers,
+        path = request.url.path[len(prefix_):]
+        has_body = 'content-length' in request.headers or 'transfer-encoding' in request.headers
+        upstream_request = client.build_request(request.method,
+                                                f"{source_url}{path}",
+                                                headers=[(key, value) for key, value in request.headers.items()
+                                                         if key not in _HOP_HEADERS],
+                                                content=request.stream() if has_body else None,  # 请求体边收边发
+                                                params=request.query_params)
+        try:
+            response = await client.send(upstream_request, stream=True)
+        except httpx.TransportError as e:
+            raise HTTPException(status_code=502, detail=f"file server unavailable: {e}")
+
+        async def stream():
+            try:
+                # 原样转发，不解压，content-encoding 和 content-length 保持一致
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                # 客户端断开时流被取消，仍要关闭到原服务的响应，连接才能回到连接池
+                with anyio.CancelScope(shield=True):
+                    await response.aclose()
+
+        return StreamingResponse(stream(),
+                                 headers={key: value for key, value in response.headers.items()
+                                          if key not in _HOP_HEADERS},
                                  status_code=response.status_code)
 
     # 代理所有请求
@@ -52,41 +86,70 @@ def add_proxy(app: FastAPI,
     app.include_router(router)
     app.include_router(router_without_dep)
 
+    def merge_openapi(original_openapi: dict | None) -> dict:
+        openapi_schema = get_openapi(
+            title="RAG API",
+            version="1.0.1",
+            description="RAG API",
+            routes=app.routes
+        )
+        if original_openapi is None:
+            return openapi_schema
+
+        paths = cast(dict[str, dict], openapi_schema['paths'])
+        security = paths[prefix + '/{__proxy_path__}']['get'].get('security')
+        paths = {path: methods for path, methods in paths.items() if '__proxy_path__' not in path}
+
+        # 将原服务的路由添加到 FastAPI 的 OpenAPI 文档中
+        for path, methods in original_openapi["paths"].items():
+            # path 不能重复，dep 和 no dep 必须分开
+            remove_methods = []
+            for method, method_value in methods.items():
+                if has_no_dep_method_path(method, path):
+                    paths[prefix_without_dep + path] = {method: method_value}
+                    remove_methods.append(method)
+            for method in remove_methods:
+                methods.pop(method)
+
+            paths[prefix + path] = methods
+            if security:
+                for value in cast(dict[str, dict], methods).values():
+                    value['security'] = security
+        openapi_schema['paths'] = paths
+
+        # 合并 components
+        cast(dict, openapi_schema['components']['schemas']).update(original_openapi['components']['schemas'])
+        return openapi_schema
+
     def custom_openapi():
+        # 原服务的文档由 lifespan 异步获取，获取之前只有本服务的文档
         if not app.openapi_schema:
-            original_openapi = httpx.get(f"{source_url}/openapi.json").json()
-
-            app.openapi_schema = get_openapi(
-                title="RAG API",
-                version="1.0.1",
-                description="RAG API",
-                routes=app.routes
-            )
-
-            paths = cast(dict[str, dict], app.openapi_schema['paths'])
-            security = paths[prefix + '/{__proxy_path__}']['get'].get('security')
-            paths = {path: methods for path, methods in paths.items() if '__proxy_path__' not in path}
-
-            # 将原服务的路由添加到 FastAPI 的 OpenAPI 文档中
-            for path, methods in original_openapi["paths"].items():
-                # path 不能重复，dep 和 no dep 必须分开
-                remove_methods = []
-                for method, method_value in methods.items():
-                    if has_no_dep_method_path(method, path):
-                        paths[prefix_without_dep + path] = {method: method_value}
-                        remove_methods.append(method)
-                for method in remove_methods:
-                    methods.pop(method)
-
-                paths[prefix + path] = methods
-                if security:
-                    for value in cast(dict[str, dict], methods).values():
-                        value['security'] = security
-            app.openapi_schema['paths'] = paths
-
-            # 合并 components
-            cast(dict, app.openapi_schema['components']['schemas']).update(original_openapi['components']['schemas'])
-
+            app.openapi_schema = merge_openapi(None)
         return app.openapi_schema
 
     app.openapi = custom_openapi
+
+    async def refresh_openapi():
+        while True:
+            try:
+                response = await client.get(f"{source_url}/openapi.json")
+                response.raise_for_status()
+                app.openapi_schema = merge_openapi(response.json())
+            except Exception as e:
+                print(f"get openapi of {source_url} failed: {e}")
+            await asyncio.sleep(openapi_refresh_interval)
+
+    @asynccontextmanager
+    async def lifespan():
+        nonlocal client
+        # 所有代理请求共用一个连接池
+        client = create_async_client()
+        task = asyncio.create_task(refresh_openapi())
+        try:
+            yield
+        finally:
+            task.cancel()
+            await client.aclose()
+            client = None
+
+    return lifespan
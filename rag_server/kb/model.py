@@ -4,6 +4,8 @@ from enum import Enum
 from sqlalchemy import UniqueConstraint
 from sqlmodel import SQLModel, Field
 
+from file_parser.model import ParseProfile
+
 
 class KbBase(SQLModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
@@ -29,6 +31,9 @@ class KbConfig(SQLModel, table=True):
     kb_id: str | None = Field(default=None, unique=True)
     parse_after_upload: bool
     pdf_parser_url: str
+    parse_profile: ParseProfile = ParseProfile.STANDARD  # pdf 解析在速度和准确度间的取舍
+    ingest_pipeline: bool = False  # 上传后解析、切分、向量化、入库流水线执行
+    structure_chunking: bool = False  # 按文档结构（标题、表格、页）切分，文本块带标题路径和页码
     access_by: AccessBy = AccessBy.MEMBER
 
 
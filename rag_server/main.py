@@ -10,7 +10,8 @@ from starlette.middleware.cors import CORSMiddleware
 from file_mgr.api import router as file_mgr_router
 from kb.api import router as kb_router
 from file_parser.api import router as file_parser_router
-from celery_task.notify import router as notify_router
+from file_parser.parse_pool import parse_pool
+from celery_task.notify import router as notify_router, notify_lifespan
 from store_retriever_server.api import router as vector_store_router
 from app.api import router as app_router
 from chat.api import router as chat_router
@@ -28,7 +29,9 @@ from user_role_group_mgr.auth import get_current_user
 async def lifespan(app: FastAPI):
     create_db_and_tables()
     init_db()
-    yield
+    async with notify_lifespan(), file_server_proxy_lifespan():
+        yield
+    parse_pool.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -45,11 +48,12 @@ app.include_router(vector_store_router, prefix='/api')
 app.include_router(app_router, prefix='/api')
 app.include_router(chat_router, prefix='/api')
 
-add_proxy(app,
-          config.file_server_url,
-          '/file_server',
-          dependencies=[Depends(get_current_user)],
-          no_dep_method_paths=[('GET', '/api/file/file')])
+file_server_proxy_lifespan = add_proxy(app,
+                                       config.file_server_url,
+                                       '/file_server',
+                                       dependencies=[Depends(get_current_user)],
+                                       no_dep_method_paths=[('GET', '/api/file/file')],
+                                       openapi_refresh_interval=config.file_server_openapi_refresh_interval)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1,15 +1,20 @@
+import uuid
+
 from fastapi import APIRouter, Depends
 from rag_file_sdk.dir_api import DirMgr
 from rag_file_server.dir.model import CeleryTaskType, FileStatus
+from sqlmodel import Session
 
 from celery_task.celery_app import to_vector_store
 from config.config import config
+from db.database import get_session
+from kb.crud import get_kb_config
 from store_retriever_server.crud import get_kb_vecstore_name
 from store_retriever_server.store_engine import StoreEngine
 from user_role_group_mgr.auth import get_current_user
 from user_role_group_mgr.model import User
-from store_retriever_server.model import SplitTextRequest, DocRequest, SearchRequest, SearchResult
-from store_retriever_server.text_splitter import TextSplitter
+from store_retriever_server.model import SplitTextRequest, SplitTextsRequest, DocRequest, SearchRequest, SearchResult
+from store_retriever_server.text_splitter import get_text_splitter
 
 router = APIRouter(prefix="/vector_store", tags=["vector store"])
 dir_mgr = DirMgr(config.file_server_url)
@@ -17,20 +22,32 @@ dir_mgr = DirMgr(config.file_server_url)
 
 @router.post('/split_text')
 def split_text(request: SplitTextRequest) -> list[str]:
-    return TextSplitter().split_text(request.text, request.chunk_size)
+    return get_text_splitter().split_text(request.text, request.chunk_size)
+
+
+@router.post('/split_texts')
+def split_texts(request: SplitTextsRequest) -> list[list[str]]:
+    splitter = get_text_splitter()
+    return [splitter.split_text(text, request.chunk_size) for text in request.texts]
 
 
 @router.post('/add_docs')
 def add_docs(request: DocRequest,
-             user: User = Depends(get_current_user)):
+             user: User = Depends(get_current_user),
+             db: Session = Depends(get_session)):
     file_node_ids = [str(file_node_id) for file_node_id in request.file_node_ids]
 
-    dir_mgr.update_to_vector_store_percent(file_node_ids, 0)
-    dir_mgr.update_files_status(file_node_ids, FileStatus.TO_VECTOR_STORE_ING)
-    task_id = to_vector_store.delay(request.kb_id,
-                                    get_kb_vecstore_name(request.kb_id),
-                                    file_node_ids).id
-    dir_mgr.update_celery_task(file_node_ids, task_id, CeleryTaskType.TO_VECTOR_STORE)
+    # 任务 id 预先生成，进度、状态和任务一次更新
+    task_id = str(uuid.uuid4())
+    dir_mgr.update_files(file_node_ids, {"to_vector_store_percent": 0,
+                                         "status": FileStatus.TO_VECTOR_STORE_ING,
+                                         "celery_task_id": task_id,
+                                         "celery_task_type": CeleryTaskType.TO_VECTOR_STORE})
+    to_vector_store.apply_async((request.kb_id,
+                                 get_kb_vecstore_name(request.kb_id),
+                                 file_node_ids,
+                                 get_kb_config(request.kb_id, db).structure_chunking),
+                                task_id=task_id)
 
 
 @router.post('/search', response_model=list[SearchResult])
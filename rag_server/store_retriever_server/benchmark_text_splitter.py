@@ -0,0 +1,111 @@
+"""
+Benchmark of TextSplitter against the previous implementation, which tokenized every text and split again.
+
+    python -m store_retriever_server.benchmark_text_splitter [text files ...]
+
+Without text files, generated Chinese and English corpora are used. The outputs of both are checked identical.
+"""
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from store_retriever_server.text_splitter import TextSplitter
+
+ZH_SENTENCES = [
+    "检索增强生成把外部知识库中的相关文本片段提供给大模型",
+    "文本切分的粒度直接影响召回的准确率和上下文的完整性",
+    "他说：“我们先解析文档，再切分、向量化，最后写入向量数据库。”",
+    "表格和图片的说明文字需要和正文一起保留",
+    "长文档按页并行解析可以显著缩短处理时间",
+]
+EN_SENTENCES = [
+    "Retrieval augmented generation grounds the answers of a language model on documents from a knowledge base.",
+    "The chunk size is measured in tokens, so the splitter has to count tokens of many candidate pieces.",
+    "He said, \"we parse, split, embed and insert the documents in a pipeline.\"",
+    "Tables, figures and their captions are exported to markdown page by page.",
+    "It's important that chunks don't break in the middle of a sentence, isn't it?",
+]
+
+
+def generate_corpus(sentences: List[str], sentence_sep: str, paragraphs: int, seed: int) -> str:
+    rng = random.Random(seed)
+    ret = []
+    for index in range(paragraphs):
+        if index % 20 == 0:
+            ret.append(f"## Section {index // 20}\n")
+        # 有些段落很长，需要逐级切分到句子
+        count = rng.choice([2, 5, 10, 40, 200])
+        ret.append(sentence_sep.join(rng.choice(sentences) for _ in range(count)) + "\n\n")
+    return "".join(ret)
+
+
+class ReferenceTextSplitter(TextSplitter):
+    """The previous implementation, token_size is called on every text at every level."""
+
+    def split_text(self, text: str, chunk_size: int | None = None) -> List[str]:
+        return self._reference_dfs(text, 0, chunk_size or self.chunk_size)
+
+    def _reference_dfs(self, text: str, fn_index: int, chunk_size: int) -> List[str]:
+        if self.token_size(text) <= chunk_size:
+            return [text]
+        ret = []
+        for sub in self.separate_fn_list[fn_index](text):
+            ret.extend(self._reference_dfs(sub, fn_index + 1, chunk_size))
+        return self._reference_merge(ret, chunk_size)
+
+    def _reference_merge(self, splits: List[str], chunk_size: int) -> List[str]:
+        ret = []
+        cur_chunk: List[Tuple[str, int]] = []
+        cur_chunk_size = 0
+        for split in splits:
+            split_size = self.token_size(split)
+            assert split_size <= chunk_size
+            if cur_chunk_size + split_size <= chunk_size:
+                cur_chunk.append((split, split_size))
+                cur_chunk_size += split_size
+            else:
+                ret.append("".join(text for text, _ in cur_chunk))
+                new_chunk = [(split, split_size)]
+                new_chunk_size = split_size
+                for index in range(len(cur_chunk) - 1, -1, -1):
+                    if new_chunk_size - split_size + cur_chunk[index][1] > self.chunk_overlap:
+                        break
+                    if new_chunk_size + cur_chunk[index][1] > chunk_size:
+                        break
+                    cur_chunk.insert(0, cur_chunk[index])
+                    new_chunk_size += cur_chunk[index][1]
+                cur_chunk = new_chunk
+                cur_chunk_size = new_chunk_size
+        ret.append("".join(text for text, _ in cur_chunk))
+        return ret
+
+
+def bench(name: str, text: str, chunk_sizes: List[int]):
+    splitter = TextSplitter()
+    reference = ReferenceTextSplitter()
+    for chunk_size in chunk_sizes:
+        start = time.time()
+        expected = reference.split_text(text, chunk_size)
+        reference_seconds = time.time() - start
+        start = time.time()
+        actual = splitter.split_text(text, chunk_size)
+        seconds = time.time() - start
+        assert actual == expected, f"{name} chunk_size={chunk_size}: output differs"
+        print(f"{name:<12} chars={len(text):<9} chunk_size={chunk_size:<5} chunks={len(actual):<6} "
+              f"reference={reference_seconds:.3f}s new={seconds:.3f}s speedup={reference_seconds / seconds:.1f}x")
+
+
+def main():
+    if len(sys.argv) > 1:
+        corpora = [(Path(path).name, Path(path).read_text(encoding='utf-8')) for path in sys.argv[1:]]
+    else:
+        corpora = [('chinese', generate_corpus(ZH_SENTENCES, "。", 2000, 0)),
+                   ('english', generate_corpus(EN_SENTENCES, " ", 2000, 1))]
+    for name, text in corpora:
+        bench(name, text, [128, 512])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterable, Callable
+
+from pydantic import BaseModel
+
+from store_retriever_server.model import Chunk
+from store_retriever_server.store_engine import StoreEngine
+from store_retriever_server.structure_splitter import StructureChunker
+from store_retriever_server.text_splitter import TextSplitter, get_text_splitter
+
+_END = object()
+
+
+class _Stopped(Exception):
+    ...
+
+
+class StageMetrics(BaseModel):
+    name: str
+    items: int = 0  # 该阶段输出的条目数：parse 为页数，其余为文本块数
+    busy_seconds: float = 0  # 处理耗时
+    blocked_seconds: float = 0  # 等待下游队列的耗时，即背压
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.busy_seconds if self.busy_seconds else 0
+
+    def __str__(self):
+        return f"{self.name}: items={self.items} busy={self.busy_seconds:.3f}s " \
+               f"blocked={self.blocked_seconds:.3f}s throughput={self.throughput:.1f}/s"
+
+
+class _StagedPipeline:
+    """Stages run in threads connected by bounded queues, the first error stops all stages and is raised by run."""
+
+    def __init__(self, stage_names: tuple[str, ...]):
+        self.metrics = {name: StageMetrics(name=name) for name in stage_names}
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+
+    def _run_stages(self, first_stage: Callable[[], None], stages: list[Callable[[], None]], name: str):
+        """Run first_stage in the caller's thread and the other stages in their own threads."""
+        threads = [threading.Thread(target=self._run_stage, args=(stage,), daemon=True) for stage in stages]
+        for thread in threads:
+            thread.start()
+
+        self._run_stage(first_stage)
+        for thread in threads:
+            thread.join()
+
+        for metrics in self.metrics.values():
+            print(f"ingest {name} {metrics}")
+        if self._error is not None:
+            raise self._error
+
+    def _run_stage(self, stage: Callable[[], None]):
+        try:
+            stage()
+        except _Stopped:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+
+    def _put(self, q: queue.Queue, item, metrics: StageMetrics):
+        start = time.time()
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        metrics.blocked_seconds += time.time() - start
+
+    def _get(self, q: queue.Queue, block: bool = True):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(block, timeout=0.5 if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                continue
+
+
+class IngestPipeline(_StagedPipeline):
+    """
+    Ingest a file into the vector store in pipeline: parse -> split -> embed -> insert.
+    Each stage runs in its own thread and hands its output to the next stage through a bounded queue,
+    so the stages overlap and a slow stage blocks the stages before it instead of buffering the whole file.
+
+    Pages are split as they arrive: the last chunk of the text so far may continue in the next page,
+    so it is kept and split again together with the next pages.
+    If structure, pages are chunked along the document structure with StructureChunker instead.
+    """
+
+    def __init__(self,
+                 store_engine: StoreEngine,
+                 doc_id: str,
+                 splitter: TextSplitter | None = None,
+                 queue_size: int = 8,
+                 embed_batch_size: int = 64,
+                 structure: bool = False):
+        super().__init__(('parse', 'split', 'embed', 'insert'))
+        self.store_engine = store_engine
+        self.doc_id = doc_id
+        self.splitter = splitter or get_text_splitter()
+        self.embed_batch_size = embed_batch_size
+        self.structure = structure
+        self.split_queue = queue.Queue(queue_size)
+        self.embed_queue = queue.Queue(queue_size)
+        self.insert_queue = queue.Queue(queue_size)
+        self.split_list: list[Chunk] = []
+
+    def run(self,
+            pages: Iterable[tuple[int, list[str]]],
+            on_parsed: Callable[[], None] | None = None) -> list[Chunk]:
+        """
+        Run the pipeline on the pages of a file, given as (start page index, markdown of the pages),
+        on_parsed is called when all pages are read. Return the chunks of the file.
+        """
+        self.store_engine.delete_doc(self.doc_id)
+        self._run_stages(lambda: self._parse_stage(pages, on_parsed),
+                         [self._split_stage, self._embed_stage, self._insert_stage],
+                         self.doc_id)
+        return self.split_list
+
+    def _parse_stage(self, pages: Iterable[tuple[int, list[str]]], on_parsed: Callable[[], None] | None):
+        metrics = self.metrics['parse']
+        iterator = iter(pages)
+        while True:
+            start = time.time()
+            item = next(iterator, _END)
+            metrics.busy_seconds += time.time() - start
+            if item is _END:
+                break
+            metrics.items += len(item[1])
+            self._put(self.split_queue, item, metrics)
+        if on_parsed:
+            on_parsed()
+        self._put(self.split_queue, _END, metrics)
+
+    def _split_stage(self):
+        metrics = self.metrics['split']
+        chunker = StructureChunker(self.splitter) if self.structure else None
+        tail = None  # 尚未输出的最后一个文本块
+        while True:
+            item = self._get(self.split_queue)
+            if item is _END:
+                break
+            start_page, md_list = item
+            if not md_list:
+                continue
+            start = time.time()
+            if chunker:
+                chunks = [chunk for page_index, md in enumerate(md_list, start_page)
+                          for chunk in chunker.add_page(page_index, md)]
+            else:
+                text = '\n'.join(md_list if tail is None else [tail] + md_list)
+                texts = self.splitter.split_text(text)
+                tail = texts.pop()
+                chunks = [Chunk(text=text) for text in texts]
+            metrics.busy_seconds += time.time() - start
+            self._emit_chunks(chunks, metrics)
+
+        if chunker:
+            self._emit_chunks(chunker.finish(), metrics)
+        elif tail is not None:
+            self._emit_chunks([Chunk(text=tail)], metrics)
+        self._put(self.embed_queue, _END, metrics)
+
+    def _emit_chunks(self, chunks: list[Chunk], metrics: StageMetrics):
+        if not chunks:
+            return
+        self.split_list.extend(chunks)
+        metrics.items += len(chunks)
+        self._put(self.embed_queue, chunks, metrics)
+
+    def _embed_stage(self):
+        metrics = self.metrics['embed']
+        pending: list[Chunk] = []
+        finished = False
+        while not finished or pending:
+            # 凑满一批再计算向量，上游暂时没有数据时先计算已有的块
+            if not finished and len(pending) < self.embed_batch_size:
+                try:
+                    chunks = self._get(self.embed_queue, block=not pending)
+                    if chunks is _END:
+                        finished = True
+                    else:
+                        pending.extend(chunks)
+                    continue
+                except queue.Empty:
+                    pass
+
+            chunks, pending = pending[:self.embed_batch_size], pending[self.embed_batch_size:]
+            start = time.time()
+            vectors = self.store_engine.embed_doc([chunk.embed_text for chunk in chunks])
+            metrics.busy_seconds += time.time() - start
+            metrics.items += len(chunks)
+            self._put(self.insert_queue, (chunks, vectors), metrics)
+        self._put(self.insert_queue, _END, metrics)
+
+    def _insert_stage(self):
+        metrics = self.metrics['insert']
+        while True:
+            item = self._get(self.insert_queue)
+            if item is _END:
+                break
+            chunks, vectors = item
+            start = time.time()
+            self.store_engine.insert(chunks, vectors, self.doc_id)
+            metrics.busy_seconds += time.time() - start
+            metrics.items += len(chunks)
+
+
+class DocsIngestPipeline(_StagedPipeline):
+    """
+    Ingest many split files into the vector store in pipeline: load -> embed -> insert.
+    The next files are loaded (split list fetched or split) by a thread pool while the current ones are embedded,
+    and the chunks of small files are embedded and inserted together in batches of embed_batch_size,
+    so many small files are bound by the embedding throughput rather than the round trips of each file.
+    """
+
+    def __init__(self,
+                 store_engine: StoreEngine,
+                 queue_size: int = 8,
+                 embed_batch_size: int = 64,
+                 load_workers: int = 4):
+        super().__init__(('load', 'embed', 'insert'))
+        self.store_engine = store_engine
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.load_workers = load_workers
+        self.embed_queue = queue.Queue(queue_size)
+        self.insert_queue = queue.Queue(queue_size)
+
+    def run(self,
+            doc_ids: list[str],
+            load: Callable[[str], list[Chunk]],
+            on_done: Callable[[str], None] | None = None):
+        """
+        Load the chunks of each doc with load(doc_id) and add them into the vector store in place of the old ones,
+        on_done(doc_id) is called once all chunks of the doc are inserted.
+        """
+        self._run_stages(lambda: self._load_stage(doc_ids, load),
+                         [self._embed_stage, lambda: self._insert_stage(on_done)],
+                         f"{len(doc_ids)} docs")
+
+    def _load_stage(self, doc_ids: list[str], load: Callable[[str], list[Chunk]]):
+        metrics = self.metrics['load']
+        with ThreadPoolExecutor(self.load_workers) as executor:
+            # 按顺序取结果，最多预先加载 queue_size 个文件
+            futures: deque[tuple[str, Future]] = deque()
+            doc_id_iter = iter(doc_ids)
+            try:
+                while True:
+                    while len(futures) < self.queue_size and (doc_id := next(doc_id_iter, None)) is not None:
+                        futures.append((doc_id, executor.submit(load, doc_id)))
+                    if not futures:
+                        break
+                    doc_id, future = futures.popleft()
+                    start = time.time()
+                    chunks = future.result()
+                    self.store_engine.delete_doc(doc_id)
+                    metrics.busy_seconds += time.time() - start
+                    metrics.items += len(chunks)
+                    self._put(self.embed_queue, (doc_id, chunks), metrics)
+            finally:
+                for _, future in futures:
+                    future.cancel()
+        self._put(self.embed_queue, _END, metrics)
+
+    def _embed_stage(self):
+        metrics = self.metrics['embed']
+        # (doc_id, chunk)，chunk 为 None 表示该文件的块已全部在它之前
+        pending: deque[tuple[str, Chunk | None]] = deque()
+        pending_chunks = 0
+        finished = False
+        while not finished or pending:
+            # 跨文件凑满一批再计算向量，上游暂时没有数据时先计算已有的块
+            if not finished and pending_chunks < self.embed_batch_size:
+                try:
+                    item = self._get(self.embed_queue, block=not pending)
+                    if item is _END:
+                        finished = True
+                    else:
+                        doc_id, chunks = item
+                        pending.extend((doc_id, chunk) for chunk in chunks)
+                        pending.append((doc_id, None))
+                        pending_chunks += len(chunks)
+                    continue
+                except queue.Empty:
+                    pass
+
+            batch = []
+            count = 0
+            while pending and (count < self.embed_batch_size or pending[0][1] is None):
+                doc_id, chunk = pending.popleft()
+                batch.append((doc_id, chunk))
+                count += chunk is not None
+            pending_chunks -= count
+            chunks = [chunk for _, chunk in batch if chunk is not None]
+            start = time.time()
+            vectors = self.store_engine.embed_doc([chunk.embed_text for chunk in chunks]) if chunks else []
+            metrics.busy_seconds += time.time() - start
+            metrics.items += len(chunks)
+            self._put(self.insert_queue, (batch, vectors), metrics)
+        self._put(self.insert_queue, _END, metrics)
+
+    def _insert_stage(self, on_done: Callable[[str], None] | None):
+        metrics = self.metrics['insert']
+        while True:
+            item = self._get(self.insert_queue)
+            if item is _END:
+                break
+            batch, vectors = item
+            docs: dict[str, tuple[list[Chunk], list]] = {}
+            done = []
+            vector_iter = iter(vectors)
+            for doc_id, chunk in batch:
+                if chunk is None:
+                    done.append(doc_id)
+                else:
+                    chunks, doc_vectors = docs.setdefault(doc_id, ([], []))
+                    chunks.append(chunk)
+                    doc_vectors.append(next(vector_iter))
+            start = time.time()
+            self.store_engine.insert_docs([(doc_id, chunks, doc_vectors)
+                                           for doc_id, (chunks, doc_vectors) in docs.items()])
+            metrics.busy_seconds += time.time() - start
+            metrics.items += sum(len(chunks) for chunks, _ in docs.values())
+            if on_done:
+                for doc_id in done:
+                    on_done(doc_id)
@@ -6,6 +6,11 @@ class SplitTextRequest(BaseModel):
     chunk_size: int = 512
 
 
+class SplitTextsRequest(BaseModel):
+    texts: list[str]
+    chunk_size: int = 512
+
+
 class DocRequest(BaseModel):
     kb_id: str
     file_node_ids: list[str]
@@ -17,8 +22,30 @@ class SearchRequest(BaseModel):
     limit: int = 3
 
 
+class Chunk(BaseModel):
+    text: str
+    headings: list[str] = []  # 所在章节的各级标题
+    page_start: int | None = None  # 起止页码，从 1 开始
+    page_end: int | None = None
+
+    @property
+    def breadcrumb(self) -> str:
+        return ' > '.join(self.headings)
+
+    @property
+    def embed_text(self) -> str:
+        """Text to embed, the breadcrumb gives the chunk the context of its section."""
+        return f"{self.breadcrumb}\n{self.text}" if self.headings else self.text
+
+    def metadata(self) -> dict:
+        return self.model_dump(exclude={'text'}, exclude_defaults=True)
+
+
 class SearchResult(BaseModel):
     id: int
     text: str
     distance: float
     doc_id: str
+    headings: list[str] = []
+    page_start: int | None = None
+    page_end: int | None = None
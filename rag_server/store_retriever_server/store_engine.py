@@ -5,7 +5,7 @@ from pymilvus import MilvusClient, FieldSchema, DataType, CollectionSchema
 
 from celery_task.model import send_process_notify, ToVectorStoreNotify
 from config.config import config
-from store_retriever_server.model import SearchResult
+from store_retriever_server.model import SearchResult, Chunk
 
 sentence_transformer_ef: SentenceTransformerEmbeddingFunction | None = None
 
@@ -62,16 +62,30 @@ class StoreEngine(BaseModel):
         return sentence_transformer_ef.encode_queries([query])[0]
 
     def add_doc(self, texts: list[str], doc_id: str):
+        self.add_chunks([Chunk(text=text) for text in texts], doc_id)
+
+    def add_chunks(self, chunks: list[Chunk], doc_id: str):
         # delete old docs by source doc id
         self.delete_doc(doc_id)
         send_process_notify(self.notify_url, ToVectorStoreNotify, doc_id, 10)
 
-        vectors = self.embed_doc(texts)
+        vectors = self.embed_doc([chunk.embed_text for chunk in chunks])
         send_process_notify(self.notify_url, ToVectorStoreNotify, doc_id, 60)
-        data = [dict(text=text, vector=vector, doc_id=doc_id) for text, vector in zip(texts, vectors)]
-        self.client.insert(collection_name=self.name, data=data)
+        self.insert(chunks, vectors, doc_id)
         send_process_notify(self.notify_url, ToVectorStoreNotify, doc_id, 100)
 
+    def insert(self, chunks: list[Chunk], vectors: list[np.array], doc_id: str):
+        self.insert_docs([(doc_id, chunks, vectors)])
+
+    def insert_docs(self, docs: list[tuple[str, list[Chunk], list[np.array]]]):
+        """Insert the chunks of several docs, given as (doc_id, chunks, vectors), in one request."""
+        # 标题和页码存为动态字段
+        data = [dict(text=chunk.text, vector=vector, doc_id=doc_id, **chunk.metadata())
+                for doc_id, chunks, vectors in docs
+                for chunk, vector in zip(chunks, vectors)]
+        if data:
+            self.client.insert(collection_name=self.name, data=data)
+
     def delete_doc(self, doc_id: str):
         self.client.delete(collection_name=self.name, filter=f"doc_id == '{doc_id}'")
 
@@ -80,14 +94,17 @@ class StoreEngine(BaseModel):
             collection_name=self.name,
             data=[self.embed_query(query)],
             limit=limit,
-            output_fields=["text", "doc_id"],
+            output_fields=["text", "doc_id", "headings", "page_start", "page_end"],
             # search_params={"metric_type": "IP", "params": {}}  # Search parameters
         )
 
         return [SearchResult(id=item['id'],
                              text=item['entity']['text'],
                              distance=item['distance'],
-                             doc_id=item['entity']['doc_id']) for item in res[0]]
+                             doc_id=item['entity']['doc_id'],
+                             headings=item['entity'].get('headings') or [],
+                             page_start=item['entity'].get('page_start'),
+                             page_end=item['entity'].get('page_end')) for item in res[0]]
 
     class Config:
         arbitrary_types_allowed = True
@@ -0,0 +1,113 @@
+import re
+from typing import Iterable
+
+from store_retriever_server.model import Chunk
+from store_retriever_server.text_splitter import TextSplitter, get_text_splitter
+
+BLOCK_DELIM = "\n\n"
+
+_HEADING = re.compile(r'#{1,6}(?=\s)')
+_TABLE_SEPARATOR = re.compile(r'\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?')
+
+
+class StructureChunker:
+    """
+    Chunk the markdown pages of a document along its structure, as exported from the docling layout:
+    a chunk never crosses a heading, keeps the headings of its section as breadcrumb and the pages it comes from,
+    a table larger than a chunk is split by rows with its header repeated in every part.
+
+    Pages are added one by one, the chunks are returned as soon as they are complete.
+    """
+
+    def __init__(self, splitter: TextSplitter | None = None, chunk_size: int | None = None):
+        self.splitter = splitter or get_text_splitter()
+        self.chunk_size = chunk_size or self.splitter.chunk_size
+        self.headings: list[tuple[int, str]] = []  # (标题级别, 标题)
+        self.blocks: list[tuple[str, int]] = []  # 当前块中的 (markdown 块, 页码)
+        self.size = 0
+
+    def add_page(self, page_index: int, md: str) -> list[Chunk]:
+        ret = []
+        for block in md.split(BLOCK_DELIM):
+            block = block.strip('\n')
+            if block.strip():
+                ret.extend(self._add_block(block, page_index + 1))
+        return ret
+
+    def finish(self) -> list[Chunk]:
+        return self._flush()
+
+    def _add_block(self, block: str, page_no: int) -> list[Chunk]:
+        if '\n' not in block and (match := _HEADING.match(block)):
+            ret = self._flush()
+            level = len(match.group())
+            while self.headings and self.headings[-1][0] >= level:
+                self.headings.pop()
+            self.headings.append((level, block[level:].strip()))
+            return ret
+
+        size = self.splitter.token_size(block)
+        if size > self.chunk_size:
+            ret = self._flush()
+            ret.extend(self._chunk([(text, page_no)]) for text in self._split_block(block))
+            return ret
+
+        ret = []
+        if self.blocks and self.size + 1 + size > self.chunk_size:
+            ret = self._flush()
+        # 块之间的分隔符计 1 个 token
+        self.size += size + (1 if self.blocks else 0)
+        self.blocks.append((block, page_no))
+        return ret
+
+    def _split_block(self, block: str) -> list[str]:
+        lines = block.split('\n')
+        separator = next((index for index, line in enumerate(lines)
+                          if index > 0 and lines[index - 1].lstrip().startswith('|')
+                          and _TABLE_SEPARATOR.fullmatch(line.strip())), None)
+        if separator is None:
+            return self.splitter.split_text(block, self.chunk_size)
+
+        # 表格按行切分，每部分都带标题和表头
+        header = '\n'.join(lines[:separator + 1])
+        header_size = self.splitter.token_size(header)
+        ret = []
+        rows: list[str] = []
+        size = header_size
+        for row in lines[separator + 1:]:
+            row_size = self.splitter.token_size(row) + 1
+            if rows and size + row_size > self.chunk_size:
+                ret.append('\n'.join([header] + rows))
+                rows, size = [], header_size
+            if header_size + row_size > self.chunk_size:
+                # 表头加一行都放不下，这一行按文本切分
+                ret.extend(self.splitter.split_text(row, self.chunk_size))
+                continue
+            rows.append(row)
+            size += row_size
+        if rows:
+            ret.append('\n'.join([header] + rows))
+        return ret
+
+    def _chunk(self, blocks: list[tuple[str, int]]) -> Chunk:
+        return Chunk(text=BLOCK_DELIM.join(text for text, _ in blocks),
+                     headings=[heading for _, heading in self.headings],
+                     page_start=min(page_no for _, page_no in blocks),
+                     page_end=max(page_no for _, page_no in blocks))
+
+    def _flush(self) -> list[Chunk]:
+        if not self.blocks:
+            return []
+        chunk = self._chunk(self.blocks)
+        self.blocks, self.size = [], 0
+        return [chunk]
+
+
+def split_pages(md_list: Iterable[str], splitter: TextSplitter | None = None) -> list[Chunk]:
+    """Chunk the markdown pages of a document along its structure, see StructureChunker."""
+    chunker = StructureChunker(splitter)
+    ret = []
+    for page_index, md in enumerate(md_list):
+        ret.extend(chunker.add_page(page_index, md))
+    ret.extend(chunker.finish())
+    return ret
@@ -1,8 +1,10 @@
+import functools
 from typing import List, Callable, Tuple, Any
 
 from pydantic import BaseModel, model_validator, Field
 
-from store_retriever_server.utils import get_default_token_length_fn, get_splitter_by_sep, get_split_by_char
+from store_retriever_server.utils import get_default_token_length_fn, get_splitter_by_sep, get_split_by_char, \
+    get_span_token_counter, SpanTokenCounter
 
 DEFAULT_CHUNK_SIZE = 512
 DEFAULT_CHUNK_OVERLAP = 100
@@ -57,47 +59,106 @@ class TextSplitter(BaseModel):
                 get_splitter_by_sep(seps=token_seps),
                 get_split_by_char()
             ]
-            return data
+        return data
 
     def split_text(self, text: str, chunk_size: int | None = None) -> List[str]:
         chunk_size = chunk_size or self.chunk_size
-        return self._split_text_dfs(text, 0, chunk_size)
-
-    def _split_text_dfs(self, text: str, fn_index: int, chunk_size: int) -> List[str]:
-        if self.token_size(text) <= chunk_size:
-            return [text]
+        # 整个文档只做一次 token 化，之后按子串在文档中的位置计算长度
+        counter = get_span_token_counter(text, self.token_length_fn)
+        return [chunk for chunk, _ in self._split_text_dfs(text, 0, 0, chunk_size, counter)]
+
+    def _token_size(self, text: str, start: int | None, counter: SpanTokenCounter) -> int:
+        if start is None:
+            return self.token_size(text)
+        return counter.count(start, start + len(text))
+
+    def _split_text_dfs(self,
+                        text: str,
+                        start: int | None,
+                        fn_index: int,
+                        chunk_size: int,
+                        counter: SpanTokenCounter) -> List[Tuple[str, int | None]]:
+        """Split text at offset start of the document (None if unknown), return list of (chunk, offset)."""
+        if self._token_size(text, start, counter) <= chunk_size:
+            return [(text, start)]
 
         ret = []
-        for sub in self.separate_fn_list[fn_index](text):
-            ret.extend(self._split_text_dfs(sub, fn_index + 1, chunk_size))
+        for sub, sub_start in self._locate(self.separate_fn_list[fn_index](text), start, counter.text):
+            ret.extend(self._split_text_dfs(sub, sub_start, fn_index + 1, chunk_size, counter))
+
+        return self._merge(ret, chunk_size, counter)
 
-        return self._merge(ret, chunk_size)
+    @staticmethod
+    def _locate(splits: List[str], start: int | None, doc: str) -> List[Tuple[str, int | None]]:
+        """Offsets of the splits in the document, splits are in order but some text between them may be dropped."""
+        ret = []
+        pos = start
+        for split in splits:
+            index = doc.find(split, pos) if pos is not None else -1
+            if index < 0:
+                ret.append((split, None))
+                pos = None
+            else:
+                ret.append((split, index))
+                pos = index + len(split)
+        return ret
 
-    def _merge(self, splits: List[str], chunk_size: int) -> List[str]:
+    def _merge(self,
+               splits: List[Tuple[str, int | None]],
+               chunk_size: int,
+               counter: SpanTokenCounter) -> List[Tuple[str, int | None]]:
         ret = []
-        cur_chunk: List[Tuple[str, int]] = []  # list of (text, length)
+        cur_chunk: List[Tuple[str, int | None, int]] = []  # list of (text, offset, length)
         cur_chunk_size = 0
 
-        for split in splits:
-            split_size = self.token_size(split)
+        for split, split_start in splits:
+            split_size = self._token_size(split, split_start, counter)
             assert split_size <= chunk_size
             if cur_chunk_size + split_size <= chunk_size:
-                cur_chunk.append((split, split_size))
+                cur_chunk.append((split, split_start, split_size))
                 cur_chunk_size += split_size
             else:
-                ret.append("".join(text for text, _ in cur_chunk))
+                ret.append(self._join(cur_chunk))
                 # collect overlap
-                new_chunk = [(split, split_size)]
+                new_chunk = [(split, split_start, split_size)]
                 new_chunk_size = split_size
                 for index in range(len(cur_chunk) - 1, -1, -1):
-                    if new_chunk_size - split_size + cur_chunk[index][1] > self.chunk_overlap:
+                    if new_chunk_size - split_size + cur_chunk[index][2] > self.chunk_overlap:
                         break
-                    if new_chunk_size + cur_chunk[index][1] > chunk_size:
+                    if new_chunk_size + cur_chunk[index][2] > chunk_size:
                         break
                     cur_chunk.insert(0, cur_chunk[index])
-                    new_chunk_size += cur_chunk[index][1]
+                    new_chunk_size += cur_chunk[index][2]
                 cur_chunk = new_chunk
                 cur_chunk_size = new_chunk_size
 
-        ret.append("".join(text for text, _ in cur_chunk))
+        ret.append(self._join(cur_chunk))
         return ret
+
+    @staticmethod
+    def _join(chunk: List[Tuple[str, int | None, int]]) -> Tuple[str, int | None]:
+        """Join the splits, the offset is kept only if the splits are adjacent in the document."""
+        text = "".join(split for split, _, _ in chunk)
+        if not chunk:
+            return text, None
+        start = chunk[0][1]
+        pos = start
+        for split, split_start, _ in chunk:
+            if pos is None or split_start != pos:
+                return text, None
+            pos += len(split)
+        return text, start
+
+
+@functools.lru_cache(maxsize=None)
+def get_text_splitter(chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                      sentence_seps: str = DEFAULT_SENTENCE_SEPS,
+                      secondary_seps: str = DEFAULT_SECONDARY_SEPS,
+                      token_seps: str = DEFAULT_TOKEN_SEPS) -> TextSplitter:
+    """Shared splitter of the config, the separate functions and the tokenizer are built once per process."""
+    return TextSplitter(chunk_size=chunk_size,
+                        chunk_overlap=chunk_overlap,
+                        sentence_seps=sentence_seps,
+                        secondary_seps=secondary_seps,
+                        token_seps=token_seps)
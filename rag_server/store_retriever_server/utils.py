@@ -1,7 +1,39 @@
+import bisect
+import functools
 from typing import Callable, List, Optional
 import re
 
+import numpy as np
+
 DEFAULT_QUOTA = "“”‘’「『」』"
+_WHITESPACE = re.compile(r'\s')
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+def _split_by_seps_out_of_quota(text: str, seps: str, quota: str, keep_sep: bool) -> List[str]:
+    """
+    Same as re.split by the separators followed by an even number of quotes till the end of text,
+    i.e. `(?:[seps])(?=(?:[^quota]*[quota][^quota]*[quota])*[^quota]*$)`, which rescans the rest of text
+    at every separator. The quotes after each separator are counted in one pass instead.
+    """
+    quota_positions = [match.start() for match in compile_pattern(f'[{quota}]').finditer(text)]
+    ret = []
+    prev = 0
+    index = 0
+    for match in compile_pattern(f'[{seps}]').finditer(text):
+        while index < len(quota_positions) and quota_positions[index] <= match.start():
+            index += 1
+        if (len(quota_positions) - index) % 2 == 0:
+            ret.append(text[prev:match.start()])
+            if keep_sep:
+                ret.append(match.group())
+            prev = match.end()
+    ret.append(text[prev:])
+    return ret
 
 
 def split_by_sep(text: str,
@@ -13,20 +45,31 @@ def split_by_sep(text: str,
     """
     When not_sep_in_quota = True,
         in order to skip separators inside paired quotes,
-        use non-capturing group (?:...) to match non-separation points.
+        a separator is used only if an even number of quotes follow it.
     Currently not distinguishing between left and right parentheses.
     """
-    if not sep_pattern:
+    if not sep_pattern and not_sep_in_quota:
         assert seps
-        sep_pattern = rf'(?:[{seps}])(?=(?:[^{quota}]*[{quota}][^{quota}]*[{quota}])*[^{quota}]*$)' \
-            if not_sep_in_quota else rf'(?:[{seps}])'
-    if keep_sep:
-        sep_pattern = '(' + sep_pattern + ')'
-    sentences = re.split(sep_pattern, text)
+        sentences = _split_by_seps_out_of_quota(text, seps, quota, keep_sep)
+        sep_re = compile_pattern(f'[{seps}]')
+        quota_re = compile_pattern(f'[{quota}]')
+
+        def is_sep(s: str) -> bool:
+            return bool(sep_re.match(s)) and len(quota_re.findall(s, 1)) % 2 == 0
+    else:
+        if not sep_pattern:
+            assert seps
+            sep_pattern = rf'(?:[{seps}])'
+        if keep_sep:
+            sep_pattern = '(' + sep_pattern + ')'
+        pattern = compile_pattern(sep_pattern)
+        sentences = pattern.split(text)
+        is_sep = pattern.match
+
     ret = []
     for i in range(len(sentences)):
         s = sentences[i]
-        if not s.strip() or re.match(sep_pattern, s):
+        if not s.strip() or is_sep(s):
             continue
         if keep_sep and i + 1 < len(sentences):
             s += sentences[i + 1]
@@ -46,11 +89,135 @@ def get_split_by_char() -> Callable[[str], List[str]]:
     return lambda text: list(text)
 
 
-def get_default_token_length_fn() -> Callable[[str], int]:
-    import tiktoken
-    encoder = tiktoken.get_encoding("cl100k_base")
+class SpanTokenCounter:
+    """Token length of substrings text[start:end] of a document, memoized."""
+
+    def __init__(self, text: str, token_length_fn: Callable[[str], int]):
+        self.text = text
+        self.token_length_fn = token_length_fn
+        self._cache: dict[tuple[int, int], int] = {}
+
+    def count(self, start: int, end: int) -> int:
+        key = (start, end)
+        if key not in self._cache:
+            self._cache[key] = self._count(start, end) if start < end else self.token_length_fn('')
+        return self._cache[key]
+
+    def _count(self, start: int, end: int) -> int:
+        return self.token_length_fn(self.text[start:end])
+
+
+class TiktokenSpanCounter(SpanTokenCounter):
+    """
+    Tiktoken encodes each piece of its regex pre-tokenization independently, so the document is tokenized once,
+    and the token length of a substring is the difference of the token counts before its boundaries,
+    as long as the substring is pre-tokenized into the same pieces as the document.
+
+    The pieces of a substring may differ from the document only at its edges: at the start if it starts inside
+    a document piece, until the pieces get in step again, and at the trailing whitespace, since the pattern looks
+    ahead after whitespace (`\\s+(?!\\S)`, `\\s++$`). Only these edges are encoded again.
+    """
+
+    def __init__(self, text: str, token_length_fn: 'TiktokenLength'):
+        super().__init__(text, token_length_fn)
+        self.encoder = token_length_fn.encoder
+        self.pattern = token_length_fn.pattern
+        self.boundaries: list[int] = []
+        self.prefix: dict[int, int] | None = None  # 预切分片段的边界 -> 边界前的 token 数
+        # 文档本身不超过块大小时只计算整个文档，不需要预切分，因此在第一次计算子串时才预切分
+        self.tokenized = any(special in text for special in self.encoder.special_tokens_set)
+
+    def _tokenize(self):
+        self.tokenized = True
+        if not self.text.isascii():
+            try:
+                code_points = np.frombuffer(self.text.encode('utf-32-le'), dtype=np.uint32)
+            except UnicodeEncodeError:
+                # 含单独的代理字符，tiktoken 将其替换后再编码，片段和偏移与原文对不上，按子串编码
+                return
+        tokens = self.encoder.encode_ordinary(self.text)
+        boundaries = [0] + [match.end() for match in self.pattern.finditer(self.text)]
+        # 按字节偏移计算每个片段边界之前的 token 数，token 不会跨越片段的边界
+        token_bytes = self.token_length_fn.token_byte_lengths[np.array(tokens, dtype=np.int64)]
+        token_starts = np.concatenate(([0], np.cumsum(token_bytes)))[:-1]
+        if self.text.isascii():
+            byte_offsets = np.array(boundaries)
+        else:
+            char_bytes = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+            byte_offsets = np.concatenate(([0], np.cumsum(char_bytes)))[boundaries]
+        counts = np.searchsorted(token_starts, byte_offsets, side='left')
+        if boundaries[-1] != len(self.text) or counts[-1] != len(tokens):
+            return
+        self.boundaries = boundaries
+        self.prefix = dict(zip(boundaries, counts.tolist()))
+
+    def _encode_len(self, start: int, end: int) -> int:
+        return len(self.encoder.encode_ordinary(self.text[start:end])) if start < end else 0
+
+    def _count(self, start: int, end: int) -> int:
+        if not self.tokenized and (start, end) != (0, len(self.text)):
+            self._tokenize()
+        if self.prefix is None:
+            return super()._count(start, end)
+
+        text = self.text
+        head = 0
+        if start not in self.prefix:
+            # 从 start 重新预切分，直到切分点与文档一致（且前一个字符不是空白）
+            pos = start
+            while True:
+                match = self.pattern.search(text, pos, end)
+                if match is None or match.end() >= end:
+                    return super()._count(start, end)
+                pos = match.end()
+                if pos in self.prefix and not _WHITESPACE.match(text, pos - 1):
+                    break
+            head = self._encode_len(start, pos)
+            start = pos
+
+        tail = end
+        while tail > start and _WHITESPACE.match(text, tail - 1):
+            tail -= 1
+        if tail == end and end in self.prefix:
+            body_end = end
+        else:
+            # 末尾的空白或不完整的片段，从其所在片段的开始处重新编码
+            body_end = self.boundaries[bisect.bisect_right(self.boundaries, min(tail, end - 1)) - 1]
+        return head + self.prefix[body_end] - self.prefix[start] + self._encode_len(body_end, end)
 
-    def token_length(text: str) -> int:
-        return len(encoder.encode(text, allowed_special="all"))
 
-    return token_length
+class TiktokenLength:
+    """Token length by a tiktoken encoding."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        import regex
+        import tiktoken
+        self.encoder = tiktoken.get_encoding(encoding_name)
+        # 预切分的正则不是 tiktoken 的公开接口，没有时不按偏移计数
+        pat_str = getattr(self.encoder, '_pat_str', None)
+        self.pattern = regex.compile(pat_str) if pat_str else None
+
+    def __call__(self, text: str) -> int:
+        return len(self.encoder.encode(text, allowed_special="all"))
+
+    @functools.cached_property
+    def token_byte_lengths(self) -> np.ndarray:
+        """Byte length of each token in the vocabulary."""
+        lengths = np.zeros(self.encoder.n_vocab, dtype=np.int64)
+        for token in range(self.encoder.n_vocab):
+            try:
+                lengths[token] = len(self.encoder.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        return lengths
+
+
+def get_span_token_counter(text: str, token_length_fn: Callable[[str], int]) -> SpanTokenCounter:
+    if isinstance(token_length_fn, TiktokenLength) and token_length_fn.pattern is not None:
+        return TiktokenSpanCounter(text, token_length_fn)
+    return SpanTokenCounter(text, token_length_fn)
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_token_length_fn() -> Callable[[str], int]:
+    return TiktokenLength("cl100k_base")
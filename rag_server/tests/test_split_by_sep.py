@@ -0,0 +1,45 @@
+import itertools
+import random
+import re
+
+import pytest
+
+from store_retriever_server.utils import DEFAULT_QUOTA, split_by_sep
+
+
+def reference_split_by_sep(text, seps, quota, not_sep_in_quota, keep_sep):
+    # 改为单遍扫描之前的实现，分隔符后到文本末尾有偶数个引号时才切分
+    sep_pattern = rf'(?:[{seps}])(?=(?:[^{quota}]*[{quota}][^{quota}]*[{quota}])*[^{quota}]*$)' \
+        if not_sep_in_quota else rf'(?:[{seps}])'
+    if keep_sep:
+        sep_pattern = '(' + sep_pattern + ')'
+    sentences = re.split(sep_pattern, text)
+    ret = []
+    for i in range(len(sentences)):
+        s = sentences[i]
+        if not s.strip() or re.match(sep_pattern, s):
+            continue
+        if keep_sep and i + 1 < len(sentences):
+            s += sentences[i + 1]
+        ret.append(s)
+    return ret
+
+
+SEPS = ["。！？!?", ",，;；", " ", "\n"]
+QUOTAS = [DEFAULT_QUOTA, '"', "“”"]
+
+
+def random_text(rng, seps, quota):
+    alphabet = list(seps) + list(quota) + list("ab中文 \n\t")
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+
+
+@pytest.mark.parametrize("seps,quota,not_sep_in_quota,keep_sep",
+                         list(itertools.product(SEPS, QUOTAS, [True, False], [True, False])))
+def test_split_by_sep_matches_reference(seps, quota, not_sep_in_quota, keep_sep):
+    rng = random.Random(f"{seps}{quota}{not_sep_in_quota}{keep_sep}")
+    for _ in range(300):
+        text = random_text(rng, seps, quota)
+        expected = reference_split_by_sep(text, seps, quota, not_sep_in_quota, keep_sep)
+        assert split_by_sep(text, seps=seps, quota=quota, not_sep_in_quota=not_sep_in_quota,
+                            keep_sep=keep_sep) == expected, repr(text)
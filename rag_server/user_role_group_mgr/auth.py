@@ -36,6 +36,10 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)):
+    return get_user_by_token(token, db)
+
+
+def get_user_by_token(token: str, db: Session) -> User:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")